@@ -2,13 +2,17 @@
 
 
 def airzone_factory(address, port, machineId, system="innobus", **kwargs):
+    trace = kwargs.pop("trace", None)
     if system == 'localapi':        
         from airzone.localapi import Machine, API
-        api = API(address, port)
+        api = API(address, port, trace=trace)
         m = Machine(api, machineId)
     else:
         from airzone.protocol import Gateway, modbus_factory        
-        gat = Gateway(modbus_factory(address, port, kwargs.pop("use_rtu_framer", False)))
+        gat = kwargs.pop("gateway", None)
+        use_rtu_framer = kwargs.pop("use_rtu_framer", False)
+        if gat is None:
+            gat = Gateway(modbus_factory(address, port, use_rtu_framer), trace=trace)
         if system == 'innobus':
             from airzone.innobus import Machine
             m = Machine(gat, machineId)
@@ -23,9 +27,9 @@ if __name__ == '__main__':
     m = airzone_factory('modbus.local', 5020, 1, "innobus", **args)
     # m = airzone_factory('modbus.local', 5020, 1, "aido")
 
-    z = m.get_zones()[0]
-    print(m._machine_state)
-    print(z._zone_state)
+    z = list(m.zones)[0].pinned()
+    print(m.snapshot.state)
+    print(z.snapshot.state)
     print(bool(z.is_tacto_on()))
     print(z.get_signal_temperature_value())    
     print(z.is_floor_active())
@@ -34,8 +38,8 @@ if __name__ == '__main__':
     print(z.get_zone_mode())
     from airzone.protocol import state_value
 
-    print(state_value(z._zone_state, 0, 0, 1))
-    print(format(z._zone_state[0], '016b'))
+    print(state_value(z.snapshot.state, 0, 0, 1))
+    print(format(z.snapshot.state[0], '016b'))
 
     ## Localapi
     # Lines for Tests. Adapt argument ip address and system id (1 == standard).
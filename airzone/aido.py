@@ -1,6 +1,13 @@
+import logging
+from collections import namedtuple
 from enum import IntEnum
 
-from deprecated import deprecated  # type: ignore
+from airzone.protocol import ILLEGAL_DATA_ADDRESS, exception_code
+from airzone.serialization import SCHEMA_VERSION, Exportable, enum_name
+from airzone.snapshot import EMPTY, publish
+from airzone.utils import deprecated
+
+_LOGGER = logging.getLogger(__name__)
 
 
 class OperationMode(IntEnum):
@@ -47,14 +54,57 @@ class Louvres(IntEnum):
 
 
 
-class Aido():
+# Registers 0-6 hold the state. The addresses of the active error code and
+# the warnings bitmask depend on the unit and are not part of this register
+# map: pass them as fault_registers, from the unit documentation, to read them
+# in the same transaction as the state.
+STATE_REGISTERS = 7
+
+
+class Fault(namedtuple('Fault', ['machine_id', 'kind', 'code'])):
+    """
+    Active fault of an Aido.
+    Arguments:
+        kind -- 'error' or 'warning'
+        code -- error code, or warning bit number (1 based)
+    """
+    __slots__ = ()
+
+
+def decode_faults(machine_id, state, fault_registers):
+    """
+    Fault records of a register read, empty when the faults were not read.
+    Arguments:
+        fault_registers -- (error code, warnings bitmask) register addresses
+    """
+    if state is None or fault_registers is None or len(state) <= max(fault_registers):
+        return ()
+    error_register, warnings_register = fault_registers
+    faults = []
+    if state[error_register]:
+        faults.append(Fault(machine_id, 'error', state[error_register]))
+    warnings = state[warnings_register]
+    faults.extend(Fault(machine_id, 'warning', bit + 1)
+                  for bit in range(16) if warnings >> bit & 1)
+    return tuple(faults)
 
-    def __init__(self, gateway, machineId, has_louvres = True, speed_as_per = False):
+
+class Aido(Exportable):
+
+    def __init__(self, gateway, machineId, has_louvres = True, speed_as_per = False,
+                 fault_registers = None):
+        """
+        Arguments:
+            fault_registers -- (error code, warnings bitmask) input register
+                               addresses of the unit, faults are not read when None
+        """
         self._gateway = gateway
         self._machineId = machineId
-        self._machine_state = None        
+        self._snapshot = EMPTY
         self._has_louvres = has_louvres
         self._speed_as_per = speed_as_per        
+        self._fault_registers = fault_registers
+        self._faults_supported = fault_registers is not None
 
         self._retrieve_machine_state()
     
@@ -67,14 +117,26 @@ class Aido():
             self._machineId, address, value)
 
     def _retrieve_machine_state(self):
-        new_state = self._read_registers(0, 7)
+        if self._faults_supported:
+            new_state = self._read_registers(0, max(STATE_REGISTERS, max(self._fault_registers) + 1))
+            if new_state is None and \
+                    exception_code(self._gateway, self._machineId) == ILLEGAL_DATA_ADDRESS:
+                # The unit has no such fault registers, it still answers the
+                # state ones. Timeouts don't tell anything, keep trying.
+                _LOGGER.warning('Aido %s rejected the fault registers %s, reading the state only',
+                                self._machineId, self._fault_registers)
+                self._faults_supported = False
+                new_state = self._read_registers(0, STATE_REGISTERS)
+        else:
+            new_state = self._read_registers(0, STATE_REGISTERS)
         if new_state != None:
-            self._machine_state = new_state
+            faults = decode_faults(self._machineId, new_state, self._fault_registers)
+            self._snapshot = publish(new_state, faults)
     
     def get_is_machine_on(self):
-        if self._machine_state == None:
+        if self.machine_state == None:
             return 0
-        return self._machine_state[0]
+        return self.machine_state[0]
     
     def turn_on(self):
         self._write_register(0, 1)
@@ -83,23 +145,23 @@ class Aido():
         self._write_register(0, 0)
 
     def get_signal_temperature_value(self):
-        if self._machine_state == None:
+        if self.machine_state == None:
             return -1
-        return self._machine_state[1] / 10
+        return self.machine_state[1] / 10
     
     def set_signal_temperature_value(self, value):
         if value >= 18 or value <= 30:
             self._write_register(1, int(value * 10))
 
     def get_local_temperature(self):
-        if self._machine_state == None:
+        if self.machine_state == None:
             return -1
-        return self._machine_state[2] / 10
+        return self.machine_state[2] / 10
     
     def get_operation_mode(self):
-        if self._machine_state == None:
+        if self.machine_state == None:
             return OperationMode.AUTO
-        return OperationMode(self._machine_state[3])
+        return OperationMode(self.machine_state[3])
 
     def set_operation_mode(self, operationMode):
         if not self.get_is_machine_on():
@@ -107,9 +169,9 @@ class Aido():
         self._write_register(3, OperationMode[operationMode].value)
     
     def get_speed(self):
-        if self._machine_state == None:
+        if self.machine_state == None:
             return Speed.AUTO
-        value = self._machine_state[4]
+        value = self.machine_state[4]
         #TODO: review for different machines
         if self._speed_as_per:
             value = value * 4 // 100
@@ -131,14 +193,24 @@ class Aido():
         return self._has_louvres
 
     def get_louvres(self):
-        if self._machine_state == None:
+        if self.machine_state == None:
             return Louvres.AUTO
-        return Louvres(self._machine_state[5])
+        return Louvres(self.machine_state[5])
 
     def set_louvres(self, louvre):
         self._write_register(5, Louvres[louvre].value)
     
-    #TODO Errors and warnings
+    def get_faults(self):
+        """
+        Fault records decoded by the last refresh.
+        """
+        return self._snapshot.record or ()
+
+    def get_errors(self):
+        return tuple(f for f in self.get_faults() if f.kind == 'error')
+
+    def get_warnings(self):
+        return tuple(f for f in self.get_faults() if f.kind == 'warning')
 
     def __str__(self):
         
@@ -155,10 +227,63 @@ class Aido():
         return f'Aido_M{self._machineId}_{str(self._gateway)}'
 
     
+    @property
+    def snapshot(self):
+        return self._snapshot
+
     @property
     def machine_state(self):
-        return self._machine_state
+        return self._snapshot.state
 
     @deprecated('Use the machine_state property instead')    
     def get_machine_state(self):
-        return self._machine_state
+        return self.machine_state
+
+    def _export_key(self):
+        return self._snapshot.version
+
+    def _export(self):
+        data = {
+            'schema': SCHEMA_VERSION,
+            'system': 'aido',
+            'unique_id': self.unique_id(),
+            'machine_id': self._machineId,
+            'timestamp': self._snapshot.timestamp,
+            'available': self.machine_state is not None,
+            'on': bool(self.get_is_machine_on()),
+            'operation_mode': enum_name(self.get_operation_mode()),
+            'signal_temperature': self.get_signal_temperature_value(),
+            'local_temperature': self.get_local_temperature(),
+            'speed': enum_name(self.get_speed()),
+            'speed_steps': self.get_speed_steps(),
+            'faults': [{'kind': f.kind, 'code': f.code} for f in self.get_faults()],
+        }
+        if self._has_louvres:
+            data['louvres'] = enum_name(self.get_louvres())
+        return data
+
+
+AidoResult = namedtuple('AidoResult', ['machine_id', 'available', 'snapshot', 'faults'])
+
+
+def refresh_aidos(aidos):
+    """
+    Refreshes the Aidos of one gateway one after another, a single read each
+    as modbus addresses one unit per request, and returns their results
+    together keyed by machine id.
+    """
+    results = {}
+    for aido in aidos:
+        previous = aido.snapshot
+        aido._retrieve_machine_state()
+        snapshot = aido.snapshot
+        results[aido._machineId] = AidoResult(
+            aido._machineId, snapshot is not previous, snapshot, aido.get_faults())
+    return results
+
+
+def build_aidos(gateway, machine_ids, **kwargs):
+    """
+    Aidos for every machine id behind one gateway.
+    """
+    return [Aido(gateway, machine_id, **kwargs) for machine_id in machine_ids]
@@ -0,0 +1,226 @@
+""" Asyncio variant of the Airzone local api integration.
+
+Every AsyncAPI built from a ClientPool shares one aiohttp session, so many
+webservers are refreshed from a single event loop over pooled keep-alive
+connections, with a cap on concurrent requests per webserver:
+
+    async with ClientPool(limit_per_host=2) as pool:
+        machines = await asyncio.gather(*(AsyncMachine.create(pool.api(ip)) for ip in sites))
+        ...
+        await refresh_all(machines)
+
+Needs the optional aiohttp dependency (pip install python-airzone[aio]).
+"""
+import asyncio
+import logging
+import time
+
+import aiohttp  # type: ignore
+
+from airzone.localapi import Machine, Zone
+from airzone.snapshot import EMPTY
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ClientPool():
+    """
+    Arguments:
+        limit -- maximum number of open connections over every webserver
+        limit_per_host -- maximum concurrent requests to a single webserver
+        timeout -- seconds allowed for each request
+    """
+
+    def __init__(self, limit=100, limit_per_host=2, timeout=10, trace=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.trace = trace
+        self._session = None
+
+    @property
+    def session(self):
+        # The session binds to the running loop, so it is created on first use.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def api(self, machine_ipaddr, port=3000):
+        return AsyncAPI(machine_ipaddr, port, pool=self)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncAPI():
+    """
+    A webserver reached through a ClientPool. Without a pool the API owns a
+    private one: close it with `await api.close()` or use `async with api`.
+    """
+
+    def __init__(self, machine_ipaddr, port=3000, pool=None, trace=None):
+        self._machine_ip = machine_ipaddr
+        self._port = port
+        self._API_ENDPOINT = f"http://{machine_ipaddr}:{str(port)}/api/v1/hvac"
+        self._owns_pool = pool is None
+        self._pool = pool if pool is not None else ClientPool()
+        self.trace = trace if trace is not None else self._pool.trace
+        self._label = str(self)
+
+    async def close(self):
+        """
+        Closes the private pool, a shared one is left to its owner.
+        """
+        if self._owns_pool:
+            await self._pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, method, system_id, zone_id, data):
+        start = time.perf_counter() if self.trace is not None else None
+        outcome = 'ok'
+        try:
+            async with self._pool.session.request(method, self._API_ENDPOINT, json=data) as response:
+                outcome = str(response.status)
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                if response.status >= 500:
+                    _LOGGER.info('[!] [%s] Server Error: %s', response.status, await response.text())
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            # ValueError: a body that isn't json
+            outcome = type(e).__name__
+            _LOGGER.exception('Error requesting %s', self)
+            return None
+        finally:
+            if start is not None:
+                self.trace.record(self._label, system_id, method, zone_id, None,
+                                  time.perf_counter() - start, outcome)
+
+    async def retrieve_state(self, system_id, zone_id):
+        data = {'SystemID': system_id, 'ZoneID': zone_id}
+        response = await self._request('POST', system_id, zone_id, data)
+        return None if response is None else response.get('data')
+
+    async def set_zone_parameter_value(self, machine_id, zone_id, parameter, value):
+        data = {'systemID': machine_id, 'zoneID': zone_id, parameter: value}
+        response = await self._request('PUT', machine_id, zone_id, data)
+        return None if response is None else value
+
+    def __str__(self):
+        return f'LocalApi: {str(self._machine_ip)}'
+
+
+class AsyncMachine(Machine):
+    """
+    localapi Machine refreshed with a single request for the system and all
+    its zones. Build it with `await AsyncMachine.create(api, system_id)`.
+    """
+
+    def __init__(self, api, system_id=1):
+        self._api = api
+        self._machine_id = system_id
+        self._error_log = []
+        self._snapshot = EMPTY
+        self._machine_zone_state = None
+        self._zones = {}
+
+    @classmethod
+    async def create(cls, api, system_id=1):
+        machine = cls(api, system_id)
+        await machine.refresh()
+        return machine
+
+    async def refresh(self):
+        """
+        Refreshes the machine and every zone. Returns whether it succeeded.
+        """
+        state = await self._api.retrieve_state(self._machine_id, 0)
+        if not state:
+            return False
+        self.machine_state = state[0]
+        for z in state:
+            zone_id = z['zoneID']
+            if zone_id == 0:
+                continue
+            zone = self._zones.get(zone_id)
+            if zone is None:
+                self._zones[zone_id] = AsyncZone(self._api, self, zone_id, z)
+            else:
+                zone.zone_state = z
+        return True
+
+    async def retrieve_machine_state(self, update_zones=True):
+        return await self.refresh()
+
+    speed = property(Machine.speed.fget)
+    operation_mode = property(Machine.operation_mode.fget)
+
+    async def set_speed(self, speed):
+        value = await self._api.set_zone_parameter_value(self._machine_id, 0, 'speed', int(speed))
+        if value:
+            self.machine_state = dict(self.machine_state, speed=value)
+
+    async def set_operation_mode(self, mode):
+        value = await self._api.set_zone_parameter_value(self._machine_id, 0, 'mode', int(mode))
+        if value:
+            self.machine_state = dict(self.machine_state, mode=value)
+
+
+class AsyncZone(Zone):
+    """
+    Zone of an AsyncMachine, its state comes from the machine refresh.
+    """
+
+    def __init__(self, api, machine, zone_id, state):
+        self._api = api
+        self._machine = machine
+        self._machine_id = machine.machine_id
+        self._zone_id = zone_id
+        self.zone_state = state
+        self._name = f'Zone_{zone_id}'
+        if self._snapshot.record.name is not None:
+            self._name = self._snapshot.record.name
+
+    async def retrieve_zone_state(self):
+        state = await self._api.retrieve_state(self._machine_id, self._zone_id)
+        if state:
+            self.zone_state = state[0]
+
+    def _set_parameter_value(self, prop, value):
+        raise TypeError(f'Use await zone.set_parameter_value({prop!r}, ...) on async zones')
+
+    async def set_parameter_value(self, prop, value):
+        return await self._api.set_zone_parameter_value(self._machine_id, self._zone_id, prop, value)
+
+    async def turn_on(self):
+        return await self.set_parameter_value('on', 1)
+
+    async def turn_off(self):
+        return await self.set_parameter_value('on', 0)
+
+
+async def refresh_all(machines):
+    """
+    Refreshes every machine concurrently, returns whether each one succeeded.
+    A failing machine doesn't stop the others.
+    """
+    results = await asyncio.gather(*(m.refresh() for m in machines), return_exceptions=True)
+    for machine, result in zip(machines, results):
+        if isinstance(result, BaseException):
+            _LOGGER.error('Error refreshing %s: %r', machine._api, result)
+    return [result is True for result in results]
@@ -0,0 +1,215 @@
+""" Incremental runtime and duty-cycle analytics.
+
+Every observed snapshot closes the interval since the previous one, which is
+attributed to the previous state (the state holds until it is seen changing).
+Each zone keeps running totals plus fixed size rings of hourly and daily
+buckets, so memory doesn't grow with history and every observation is O(1):
+
+    analytics = RuntimeAnalytics()
+    analytics.observe_machine(machine)  # after every refresh
+    analytics.export()  # totals and hourly/daily rollups per zone
+"""
+from collections import deque, namedtuple
+from threading import Lock
+
+from airzone.protocol import bit_value
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+Observation = namedtuple('Observation', ['demand', 'floor', 'grid_opened', 'dif_temp'])
+
+
+def observe_zone(zone, snapshot=None):
+    """
+    Observation of a snapshot of an innobus or localapi zone, the current one
+    when None, or None when the snapshot has no state.
+    """
+    if snapshot is None:
+        snapshot = zone.snapshot
+    state = snapshot.state
+    if state is None:
+        return None
+    if hasattr(zone, 'is_requesting_air'):
+        # zone register 9 flags, setpoint and room temperature of the innobus zone
+        return Observation(bool(bit_value(state, 9, 7)), bool(bit_value(state, 9, 5)),
+                           bool(bit_value(state, 9, 0)), state[3] / 10 - state[10] / 10)
+    record = snapshot.record
+    dif_temp = None
+    if record.setpoint is not None and record.room_temp is not None:
+        dif_temp = record.setpoint - record.room_temp
+    return Observation(bool(record.air_demand), bool(record.floor_demand), None, dif_temp)
+
+
+class Counters():
+    """
+    Time weighted totals of one period.
+    """
+    __slots__ = ('seconds', 'demand', 'floor', 'grid_opened', 'grid_seconds',
+                 'dif_temp', 'abs_dif_temp', 'temp_seconds', 'max_abs_dif_temp')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.demand = 0.0
+        self.floor = 0.0
+        self.grid_opened = 0.0
+        self.grid_seconds = 0.0
+        self.dif_temp = 0.0
+        self.abs_dif_temp = 0.0
+        self.temp_seconds = 0.0
+        self.max_abs_dif_temp = None
+
+    def add(self, seconds, observation):
+        self.seconds += seconds
+        if observation.demand:
+            self.demand += seconds
+        if observation.floor:
+            self.floor += seconds
+        if observation.grid_opened is not None:
+            self.grid_seconds += seconds
+            if observation.grid_opened:
+                self.grid_opened += seconds
+        dif_temp = observation.dif_temp
+        if dif_temp is not None:
+            self.temp_seconds += seconds
+            self.dif_temp += dif_temp * seconds
+            self.abs_dif_temp += abs(dif_temp) * seconds
+            if self.max_abs_dif_temp is None or abs(dif_temp) > self.max_abs_dif_temp:
+                self.max_abs_dif_temp = abs(dif_temp)
+
+    def as_dict(self):
+        seconds = self.seconds
+        return {
+            'observed_seconds': seconds,
+            'demand_seconds': self.demand,
+            'floor_demand_seconds': self.floor,
+            'grid_opened_seconds': self.grid_opened if self.grid_seconds else None,
+            'duty_cycle': self.demand / seconds if seconds else None,
+            'floor_duty_cycle': self.floor / seconds if seconds else None,
+            'grid_opened_ratio': self.grid_opened / self.grid_seconds if self.grid_seconds else None,
+            'mean_dif_temp': self.dif_temp / self.temp_seconds if self.temp_seconds else None,
+            'mean_abs_dif_temp': self.abs_dif_temp / self.temp_seconds if self.temp_seconds else None,
+            'max_abs_dif_temp': self.max_abs_dif_temp,
+        }
+
+
+class Rollup():
+    """
+    The last `keep` buckets of `period` seconds, aligned on local time when
+    `offset` is the seconds east of UTC.
+    """
+
+    def __init__(self, period, keep, offset=0):
+        self.period = period
+        self.offset = offset
+        self._buckets = deque(maxlen=keep)
+
+    def _bucket(self, start):
+        if not self._buckets or self._buckets[-1][0] < start:
+            self._buckets.append((start, Counters()))
+        return self._buckets[-1][1]
+
+    def add(self, begin, end, observation):
+        """
+        Adds the interval, split at the bucket boundaries it crosses.
+        """
+        while begin < end:
+            start = (begin + self.offset) // self.period * self.period - self.offset
+            stop = min(end, start + self.period)
+            self._bucket(start).add(stop - begin, observation)
+            begin = stop
+
+    def export(self):
+        return [dict(c.as_dict(), start=start) for start, c in self._buckets]
+
+
+class ZoneAnalytics():
+
+    def __init__(self, hours, days, utc_offset, max_gap):
+        self.total = Counters()
+        self.hourly = Rollup(HOUR, hours, utc_offset)
+        self.daily = Rollup(DAY, days, utc_offset)
+        self.max_gap = max_gap
+        self.version = None
+        self.timestamp = None
+        self.observation = None
+        self.gaps = 0
+
+    def update(self, version, timestamp, observation):
+        if version == self.version:
+            return False
+        if self.timestamp is not None and timestamp > self.timestamp:
+            begin = self.timestamp
+            end = timestamp
+            if end - begin > self.max_gap:
+                # Unobserved for too long, don't extrapolate the old state.
+                self.gaps += 1
+                end = begin + self.max_gap
+            if end > begin:
+                self.total.add(end - begin, self.observation)
+                self.hourly.add(begin, end, self.observation)
+                self.daily.add(begin, end, self.observation)
+        self.version = version
+        self.timestamp = timestamp
+        self.observation = observation
+        return True
+
+    def export(self):
+        return {
+            'total': self.total.as_dict(),
+            'hourly': self.hourly.export(),
+            'daily': self.daily.export(),
+            'gaps': self.gaps,
+        }
+
+
+def zone_key(zone):
+    machine = zone._machine
+    unique_id = machine.unique_id
+    return f'{unique_id() if callable(unique_id) else unique_id}_Z{zone._zone_id}'
+
+
+class RuntimeAnalytics():
+    """
+    Arguments:
+        hours, days -- hourly and daily buckets kept per zone
+        utc_offset -- seconds east of UTC of the local day boundaries
+        max_gap -- longest interval between two snapshots still attributed to
+                   the earlier state, longer ones only count for max_gap
+    """
+
+    def __init__(self, hours=48, days=31, utc_offset=0, max_gap=900):
+        self.hours = hours
+        self.days = days
+        self.utc_offset = utc_offset
+        self.max_gap = max_gap
+        self._zones = {}
+        self._lock = Lock()
+
+    def observe(self, zone, key=None):
+        """
+        Accounts the current snapshot of the zone. Snapshots already seen are
+        ignored, so it can be called after every refresh. Returns whether the
+        snapshot was new.
+        """
+        snapshot = zone.snapshot
+        if snapshot.state is None:
+            return False
+        key = key or zone_key(zone)
+        with self._lock:
+            analytics = self._zones.get(key)
+            if analytics is None:
+                analytics = self._zones[key] = ZoneAnalytics(
+                    self.hours, self.days, self.utc_offset, self.max_gap)
+            if analytics.version == snapshot.version:
+                return False
+            return analytics.update(snapshot.version, snapshot.timestamp, observe_zone(zone, snapshot))
+
+    def observe_machine(self, machine):
+        return sum(self.observe(zone) for zone in machine.zones)
+
+    def export(self, key=None):
+        with self._lock:
+            if key is not None:
+                return self._zones[key].export()
+            return {k: a.export() for k, a in self._zones.items()}
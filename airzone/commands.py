@@ -0,0 +1,139 @@
+""" Prioritized command queue for a modbus gateway.
+
+Writes are always sent before background reads, and a pending write to the same
+(device, register) is replaced by the latest value instead of being queued again,
+so a user action waits at most for the transaction already on the wire.
+"""
+import logging
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+from airzone.protocol import exception_code
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _resolve(future, result=None, exception=None):
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class CommandQueue():
+    """
+    Wraps a Gateway and exposes the same interface. Reads block the caller until
+    they are served, writes return a Future resolved with the value that
+    actually landed on the register.
+    """
+
+    def __init__(self, gateway):
+        self._gateway = gateway
+        self._cond = Condition()
+        self._writes = OrderedDict()
+        self._reads = deque()
+        self._closed = False
+        self._thread = Thread(target=self._run, name=f'airzone-commands-{gateway}', daemon=True)
+        self._thread.start()
+
+    @property
+    def gateway(self):
+        return self._gateway
+
+    def pending(self):
+        with self._cond:
+            return len(self._writes), len(self._reads)
+
+    def submit_write(self, machineid, address, value):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Command queue is closed')
+            key = (machineid, address)
+            if key in self._writes:
+                futures = self._writes[key][1]
+                futures.append(future)
+                self._writes[key] = (value, futures)
+            else:
+                self._writes[key] = (value, [future])
+            self._cond.notify()
+        return future
+
+    def submit_read(self, machineid, address, num_registers, input_registers=True):
+        future = Future()
+        if input_registers:
+            method = self._gateway.read_input_registers
+        else:
+            method = self._gateway.read_holding_registers
+        # the sampled cycle of a profiled caller goes with the read to the worker
+        profiler = getattr(self._gateway, 'profiler', None)
+        cycle = profiler.current() if profiler is not None else None
+        queued = time.perf_counter() if cycle is not None else None
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Command queue is closed')
+            self._reads.append((method, (machineid, address, num_registers), future, cycle, queued))
+            self._cond.notify()
+        return future
+
+    def read_input_registers(self, machineid, address, num_registers):
+        return self.submit_read(machineid, address, num_registers).result()
+
+    def read_holding_registers(self, machineid, address, num_registers):
+        return self.submit_read(machineid, address, num_registers, False).result()
+
+    def write_single_register(self, machineid, address, value):
+        return self.submit_write(machineid, address, value)
+
+    def exception_code(self, machineid):
+        return exception_code(self._gateway, machineid)
+
+    def _next(self):
+        with self._cond:
+            while not self._writes and not self._reads and not self._closed:
+                self._cond.wait()
+            if self._writes:
+                (machineid, address), (value, futures) = self._writes.popitem(last=False)
+                return 'write', (machineid, address, value), futures, None, None
+            if self._reads:
+                method, args, future, cycle, queued = self._reads.popleft()
+                return method, args, [future], cycle, queued
+            return None, None, None, None, None
+
+    def _run(self):
+        while True:
+            kind, args, futures, cycle, queued = self._next()
+            if kind is None:
+                return
+            try:
+                if kind == 'write':
+                    self._gateway.write_single_register(*args)
+                    result = args[2]
+                elif cycle is not None and self._gateway.profiler is not None:
+                    with self._gateway.profiler.resume(cycle, queued):
+                        result = kind(*args)
+                else:
+                    result = kind(*args)
+            except Exception as e:
+                _LOGGER.exception('Error executing queued command')
+                for future in futures:
+                    _resolve(future, exception=e)
+            else:
+                for future in futures:
+                    _resolve(future, result)
+
+    def close(self):
+        """
+        Stops the worker once the pending commands are served.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def __str__(self):
+        return str(self._gateway)
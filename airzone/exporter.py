@@ -0,0 +1,187 @@
+""" Prometheus text format exporter.
+
+Metrics are rendered from the last published snapshots only (through to_dict),
+so scrapes never cause bus or http traffic. The rendered text is cached per
+snapshot generation: scraping unchanged state costs nothing.
+
+    exporter = MetricsExporter(machines)
+    exporter.serve(port=9477)
+"""
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+_LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name in to_dict: (metric, help)
+MACHINE_METRICS = {
+    'available': ('machine_available', 'Whether the last refresh of the machine succeeded.'),
+    'timestamp': ('machine_snapshot_timestamp_seconds', 'Time of the last machine refresh.'),
+    'on': ('machine_on', 'Whether the machine is on.'),
+    'signal_temperature': ('machine_signal_temperature', 'Machine setpoint temperature.'),
+    'local_temperature': ('machine_local_temperature', 'Machine room temperature.'),
+}
+ZONE_METRICS = {
+    'available': ('zone_available', 'Whether the last refresh of the zone succeeded.'),
+    'timestamp': ('zone_snapshot_timestamp_seconds', 'Time of the last zone refresh.'),
+    'on': ('zone_on', 'Whether the zone is on.'),
+    'local_temperature': ('zone_local_temperature', 'Zone room temperature.'),
+    'signal_temperature': ('zone_signal_temperature', 'Zone setpoint temperature.'),
+    'dif_current_temp': ('zone_setpoint_difference', 'Setpoint minus room temperature.'),
+    'min_temp': ('zone_min_temperature', 'Minimum setpoint of the zone.'),
+    'max_temp': ('zone_max_temperature', 'Maximum setpoint of the zone.'),
+    'humidity': ('zone_humidity_percent', 'Zone relative humidity.'),
+    'requesting_air': ('zone_air_demand', 'Whether the zone is demanding air.'),
+    'air_demand': ('zone_air_demand', 'Whether the zone is demanding air.'),
+    'floor_demand': ('zone_floor_demand', 'Whether the zone is demanding floor heating.'),
+    'floor_active': ('zone_floor_demand', 'Whether the zone is demanding floor heating.'),
+    'grid_opened': ('zone_grid_opened', 'Whether the zone grid is opened.'),
+    'grid_motor_active': ('zone_grid_motor_active', 'Whether the zone grid motor is moving.'),
+    'proportional_aperture': ('zone_proportional_aperture', 'Proportional grid aperture.'),
+    'occupied': ('zone_occupied', 'Whether the zone presence sensor detects occupancy.'),
+    'window_opened': ('zone_window_opened', 'Whether the zone window is opened.'),
+}
+# enum fields exported as a constant 1 sample labelled with the value
+MACHINE_INFO = ('operation_mode', 'speed', 'units')
+ZONE_INFO = ('zone_mode', 'operation_mode', 'speed_selection', 'fancoil_speed', 'name', 'units')
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def format_value(value):
+    if value is True:
+        return '1'
+    if value is False:
+        return '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Families():
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.help = {}
+        self.samples = {}
+
+    def add(self, metric, help_text, labels, value):
+        if value is None:
+            return
+        name = f'{self.prefix}_{metric}'
+        self.help.setdefault(name, help_text)
+        self.samples.setdefault(name, []).append(f'{name}{format_labels(labels)} {format_value(value)}')
+
+    def render(self):
+        lines = []
+        for name, samples in self.samples.items():
+            lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(samples)
+        return ('\n'.join(lines) + '\n').encode()
+
+
+class MetricsExporter():
+    """
+    Arguments:
+        machines -- innobus Machine, Aido or localapi Machine objects, refreshed elsewhere
+        prefix -- prefix of every metric name
+    """
+
+    def __init__(self, machines=(), prefix='airzone'):
+        self._machines = list(machines)
+        self.prefix = prefix
+        self._cache = (None, None)
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+
+    def add_machine(self, machine):
+        with self._lock:
+            self._machines = self._machines + [machine]
+
+    def generation(self):
+        """
+        Changes whenever any snapshot of any exported machine changes.
+        """
+        return tuple(m._export_key() for m in self._machines)
+
+    def _collect(self, families, data):
+        machine_labels = {'system': data['system'], 'machine': data['unique_id']}
+        for field, (metric, help_text) in MACHINE_METRICS.items():
+            if field in data:
+                families.add(metric, help_text, machine_labels, data[field])
+        for field in MACHINE_INFO:
+            if data.get(field) is not None:
+                families.add(f'machine_{field}_info', f'Machine {field.replace("_", " ")}.',
+                             dict(machine_labels, **{field: data[field]}), 1)
+        for zone in data.get('zones', ()):
+            zone_labels = dict(machine_labels, zone=str(zone['zone_id']))
+            for field, (metric, help_text) in ZONE_METRICS.items():
+                if field in zone:
+                    families.add(metric, help_text, zone_labels, zone[field])
+            for field in ZONE_INFO:
+                if zone.get(field) is not None:
+                    name = field[len('zone_'):] if field.startswith('zone_') else field
+                    families.add(f'zone_{name}_info', f'Zone {name.replace("_", " ")}.',
+                                 dict(zone_labels, **{field: zone[field]}), 1)
+
+    def render(self):
+        """
+        Text exposition of every machine, cached per snapshot generation.
+        """
+        generation, text = self._cache
+        current = self.generation()
+        if generation == current:
+            return text
+        families = _Families(self.prefix)
+        for machine in self._machines:
+            try:
+                self._collect(families, machine.to_dict())
+            except Exception:
+                _LOGGER.exception('Error exporting %s', machine)
+        text = families.render()
+        self._cache = (current, text)
+        return text
+
+    def serve(self, host='', port=9477):
+        """
+        Serves /metrics from a background thread. Returns the bound address.
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = exporter.render()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, name='airzone-exporter', daemon=True)
+        self._thread.start()
+        return self._server.server_address
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,264 @@
+""" Redundant gateways in front of the same bus.
+
+FailoverGateway exposes the Gateway interface over several endpoints reaching
+the same devices. Requests go to the healthy endpoint with the lowest measured
+latency; when it fails the request is retried on the next one, so polls keep
+running through the outage of an endpoint:
+
+    gateway = failover_factory([('gw-a.local', 502), ('gw-b.local', 502)])
+    machine = airzone_factory(None, None, 1, gateway=gateway)
+"""
+import logging
+import time
+from collections import OrderedDict
+from threading import Event, Lock, RLock, Thread
+
+from airzone.protocol import ModbusError, exception_code
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Endpoint():
+    """
+    Health and latency of one gateway.
+    """
+
+    def __init__(self, gateway, alpha):
+        self.gateway = gateway
+        self.alpha = alpha
+        self.latency = None
+        self.healthy = True
+        self.down_until = 0.0
+        self.successes = 0
+        self.failures = 0
+
+    def record_success(self, elapsed):
+        self.successes += 1
+        self.healthy = True
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.alpha * (elapsed - self.latency)
+
+    def record_failure(self, now, cooldown):
+        self.failures += 1
+        self.healthy = False
+        self.down_until = now + cooldown
+
+    def stats(self):
+        return {
+            'endpoint': str(self.gateway),
+            'healthy': self.healthy,
+            'latency_ms': None if self.latency is None else self.latency * 1000,
+            'successes': self.successes,
+            'failures': self.failures,
+        }
+
+
+class FailoverGateway():
+    """
+    Arguments:
+        gateways -- Gateway objects reaching the same bus, in preference order
+        cooldown -- seconds an endpoint that failed is skipped before retrying it
+        alpha -- smoothing factor of the latency moving average
+        probe -- (device_id, address) read by the health checks, by default
+                 address 0 of the last device read through the gateway
+    """
+
+    def __init__(self, gateways, cooldown=30, alpha=0.2, probe=None, clock=time.monotonic):
+        if not gateways:
+            raise ValueError('FailoverGateway needs at least one gateway')
+        self._endpoints = [Endpoint(g, alpha) for g in gateways]
+        self.cooldown = cooldown
+        self.probe = probe
+        self._clock = clock
+        self._lock = Lock()
+        # Serializes direct writes and replays, so a replay never lands after
+        # a newer write to the same register.
+        self._write_lock = RLock()
+        self._pending_writes = OrderedDict()
+        self._exception_codes = {}
+        self._last_device = None
+        self._stop = Event()
+        self._thread = None
+
+    def _candidates(self):
+        """
+        Healthy endpoints by latency, then the ones whose cooldown is over,
+        then the rest: a request is tried everywhere before giving up.
+        """
+        now = self._clock()
+        with self._lock:
+            healthy = [e for e in self._endpoints if e.healthy]
+            retry = [e for e in self._endpoints if not e.healthy and e.down_until <= now]
+            down = [e for e in self._endpoints if not e.healthy and e.down_until > now]
+        healthy.sort(key=lambda e: float('inf') if e.latency is None else e.latency)
+        return healthy + retry + down
+
+    def _call(self, method, *args):
+        failed = []
+        machineid = args[0]
+        code = None
+        for endpoint in self._candidates():
+            start = time.perf_counter()
+            try:
+                result = getattr(endpoint.gateway, method)(*args)
+                ok = result is not None or method == 'write_single_register'
+            except ModbusError:
+                # The device rejected the write: the endpoint works.
+                with self._lock:
+                    endpoint.record_success(time.perf_counter() - start)
+                raise
+            except Exception:
+                _LOGGER.debug('%s failed on %s', method, endpoint.gateway, exc_info=True)
+                ok = False
+            if ok:
+                with self._lock:
+                    endpoint.record_success(time.perf_counter() - start)
+                    # Another endpoint answered what this one didn't: it's the
+                    # endpoint that is failing, not the device.
+                    for f in failed:
+                        f.record_failure(self._clock(), self.cooldown)
+                    self._exception_codes.pop(machineid, None)
+                    self._last_device = machineid
+                if failed:
+                    _LOGGER.warning('Failed over from %s to %s',
+                                    ', '.join(str(f.gateway) for f in failed), endpoint.gateway)
+                return True, result
+            answered = exception_code(endpoint.gateway, machineid)
+            if answered is not None:
+                # An exception response: the endpoint works, another path may
+                # still reach the device.
+                code = answered
+                with self._lock:
+                    endpoint.record_success(time.perf_counter() - start)
+            else:
+                failed.append(endpoint)
+        with self._lock:
+            if code is None:
+                self._exception_codes.pop(machineid, None)
+            else:
+                self._exception_codes[machineid] = code
+        return False, None
+
+    def read_input_registers(self, machineid, address, num_registers):
+        self.flush_writes()
+        return self._call('read_input_registers', machineid, address, num_registers)[1]
+
+    def read_holding_registers(self, machineid, address, num_registers):
+        self.flush_writes()
+        return self._call('read_holding_registers', machineid, address, num_registers)[1]
+
+    def exception_code(self, machineid):
+        return self._exception_codes.get(machineid)
+
+    def write_single_register(self, machineid, address, value):
+        """
+        Writes through the first endpoint accepting it. When none does the
+        write is kept, replacing older writes to the same register, and
+        replayed before the next request. A write that lands drops the older
+        one still kept for the register.
+        """
+        key = (machineid, address)
+        with self._write_lock:
+            try:
+                ok, _ = self._call('write_single_register', machineid, address, value)
+            except ModbusError:
+                with self._lock:
+                    self._pending_writes.pop(key, None)
+                raise
+            with self._lock:
+                self._pending_writes.pop(key, None)
+                if not ok:
+                    self._pending_writes[key] = value
+        if not ok:
+            _LOGGER.warning('No endpoint accepted the write of %s to %s:%s, queued',
+                            value, machineid, address)
+
+    @property
+    def pending_writes(self):
+        with self._lock:
+            return list((device, address, value)
+                        for (device, address), value in self._pending_writes.items())
+
+    def flush_writes(self):
+        """
+        Replays the writes no endpoint accepted, oldest first.
+        """
+        if not self._pending_writes:
+            return 0
+        written = 0
+        with self._write_lock:
+            for device, address, value in self.pending_writes:
+                try:
+                    ok, _ = self._call('write_single_register', device, address, value)
+                except ModbusError:
+                    _LOGGER.warning('Device %s rejected the queued write of %s to %s, dropped',
+                                    device, value, address)
+                    ok = True
+                if not ok:
+                    break
+                with self._lock:
+                    del self._pending_writes[(device, address)]
+                written += 1
+        return written
+
+    def check_health(self):
+        """
+        Probes every endpoint, down ones included, updating health and latency.
+        Any modbus answer, an exception response too, counts as alive.
+        """
+        device, address = self.probe or (self._last_device or 1, 0)
+        for endpoint in self._endpoints:
+            start = time.perf_counter()
+            try:
+                ok = endpoint.gateway.read_input_registers(device, address, 1) is not None or \
+                    exception_code(endpoint.gateway, device) is not None
+            except Exception:
+                ok = False
+            with self._lock:
+                if ok:
+                    endpoint.record_success(time.perf_counter() - start)
+                else:
+                    endpoint.record_failure(self._clock(), self.cooldown)
+        self.flush_writes()
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return [e.stats() for e in self._endpoints]
+
+    def start(self, interval=30):
+        """
+        Runs the health checks from a background thread.
+        """
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.check_health()
+                except Exception:
+                    _LOGGER.exception('Error checking %s', self)
+
+        self._thread = Thread(target=run, name='airzone-failover', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __str__(self):
+        return 'Failover_' + '_'.join(str(e.gateway) for e in self._endpoints)
+
+
+def failover_factory(endpoints, use_rtu_framer=False, trace=None, **kwargs):
+    """
+    FailoverGateway over Gateways built for every (address, port) endpoint.
+    """
+    from airzone.protocol import Gateway, modbus_factory
+    gateways = [Gateway(modbus_factory(address, port, use_rtu_framer), trace=trace)
+                for address, port in endpoints]
+    return FailoverGateway(gateways, **kwargs)
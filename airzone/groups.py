@@ -0,0 +1,177 @@
+""" Group and scene operations across machines and backends.
+
+A Scene holds the settings to apply ("21 degrees, cooling") and is applied to
+the zones and Aido units picked by a selector, over any mix of innobus,
+localapi and Aido machines. Operations behind the same gateway or webserver run
+one after another, as the bus serializes them anyway, while different gateways
+run in parallel, so a building wide change takes about one gateway's time:
+
+    scene = Scene(setpoint=21, mode='cooling')
+    results = scene.apply(machines, lambda target: target_id(target).startswith('B'))
+
+Settings: setpoint (degrees), mode (stop, cooling, heating, fan, dry, auto) and
+on (localapi zones and Aido units). Modes are set once per machine since the
+innobus and localapi modes are system wide.
+"""
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from airzone.polling import gateway_of
+
+_LOGGER = logging.getLogger(__name__)
+
+# scene mode: (innobus, localapi, aido) mode names
+MODES = {
+    'stop': ('STOP', 'STOP', None),
+    'cooling': ('COLD', 'COOLING', 'COOLING'),
+    'heating': ('HOT', 'HEATING', 'HEATING'),
+    'fan': ('AIR', 'FAN', 'FAN'),
+    'dry': (None, 'DRY', 'DRY'),
+    'auto': (None, 'AUTO', 'AUTO'),
+}
+
+
+class TargetResult(namedtuple('TargetResult', ['target', 'operation', 'ok', 'error', 'elapsed'])):
+    """
+    Outcome of one operation of a scene.
+    Arguments:
+        target -- identifier of the zone, machine or Aido
+        elapsed -- seconds the operation took
+    """
+    __slots__ = ()
+
+
+def backend_of(target):
+    module = type(target).__module__
+    if module.endswith('aido'):
+        return 'aido'
+    if module.endswith('innobus'):
+        return 'innobus'
+    return 'localapi'
+
+
+def target_id(target):
+    unique_id = target.unique_id
+    return unique_id() if callable(unique_id) else unique_id
+
+
+def select(machines, selector=None):
+    """
+    Zones of the innobus and localapi machines and the Aido units matching the
+    selector, every one of them when it is None.
+    """
+    targets = []
+    for machine in machines:
+        candidates = [machine] if backend_of(machine) == 'aido' else list(machine.zones)
+        targets.extend(t for t in candidates if selector is None or selector(t))
+    return targets
+
+
+class Scene():
+
+    def __init__(self, setpoint=None, mode=None, on=None):
+        if mode is not None and mode not in MODES:
+            raise ValueError(f'Unknown mode {mode}, expected one of {", ".join(MODES)}')
+        self.setpoint = setpoint
+        self.mode = mode
+        self.on = on
+
+    def _mode_operation(self, machine):
+        backend = backend_of(machine)
+        name = MODES[self.mode][('innobus', 'localapi', 'aido').index(backend)]
+        if backend == 'aido':
+            if name is None:
+                return machine.turn_off
+            return lambda: machine.set_operation_mode(name)
+        if name is None:
+            def unsupported():
+                raise ValueError(f'{backend} machines have no {self.mode} mode')
+            return unsupported
+        if backend == 'localapi':
+            from airzone.localapi import OperationMode
+
+            def set_mode():
+                if machine._api.set_zone_parameters(
+                        machine.machine_id, 0, {'mode': OperationMode[name].value}) is None:
+                    raise IOError('the webserver rejected the mode')
+            return set_mode
+
+        def set_innobus_mode():
+            machine.operation_mode = name
+        return set_innobus_mode
+
+    def _zone_operation(self, zone):
+        backend = backend_of(zone)
+        if backend == 'aido':
+            def set_aido():
+                if self.on:
+                    zone.turn_on()
+                elif self.on is not None:
+                    zone.turn_off()
+                if self.setpoint is not None:
+                    zone.set_signal_temperature_value(self.setpoint)
+            return set_aido
+        if backend == 'localapi':
+            parameters = {}
+            if self.setpoint is not None:
+                parameters['setpoint'] = self.setpoint
+            if self.on is not None:
+                parameters['on'] = int(bool(self.on))
+            if not parameters:
+                return None
+
+            def set_localapi():
+                if zone._api.set_zone_parameters(zone._machine_id, zone._zone_id, parameters) is None:
+                    raise IOError('the webserver rejected the settings')
+            return set_localapi
+        if self.setpoint is None:
+            return None
+
+        def set_innobus():
+            zone.signal_temperature_value = self.setpoint
+        return set_innobus
+
+    def plan(self, targets):
+        """
+        Operations of the scene grouped by gateway: {gateway id: [(target id,
+        operation name, callable)]}, machine modes first.
+        """
+        plans = {}
+        machines_done = set()
+        for target in targets:
+            operations = plans.setdefault(id(gateway_of(target)), [])
+            machine = getattr(target, '_machine', target)
+            if self.mode is not None and id(machine) not in machines_done:
+                machines_done.add(id(machine))
+                operations.append((target_id(machine), 'mode', self._mode_operation(machine)))
+            operation = self._zone_operation(target)
+            if operation is not None:
+                operations.append((target_id(target), 'settings', operation))
+        return plans
+
+    def apply(self, machines, selector=None, max_workers=None):
+        """
+        Applies the scene to the selected targets. Returns a TargetResult per
+        operation.
+        """
+        plans = self.plan(select(machines, selector))
+        if not plans:
+            return []
+        with ThreadPoolExecutor(max_workers=max_workers or len(plans)) as executor:
+            futures = [executor.submit(_run, operations) for operations in plans.values()]
+            return [result for f in futures for result in f.result()]
+
+
+def _run(operations):
+    results = []
+    for target, name, operation in operations:
+        start = time.perf_counter()
+        try:
+            operation()
+            results.append(TargetResult(target, name, True, None, time.perf_counter() - start))
+        except Exception as e:
+            _LOGGER.warning('Scene %s on %s failed: %s', name, target, e)
+            results.append(TargetResult(target, name, False, e, time.perf_counter() - start))
+    return results
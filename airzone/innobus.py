@@ -1,9 +1,13 @@
+import copy
 import datetime
 from enum import Enum, IntEnum
 
-from deprecated import deprecated  # type: ignore
-
-from airzone.protocol import *
+from airzone.protocol import (bit_value, change_bit_value, change_range_bit_value,
+                              date_as_number, state_value)
+from airzone.serialization import SCHEMA_VERSION, Exportable, enum_name
+from airzone.singleflight import single_flight
+from airzone.snapshot import EMPTY, publish
+from airzone.utils import bitfield, deprecated, true_in_list
 
 
 class OperationMode(Enum):
@@ -77,24 +81,35 @@ class LocalFancoilType(Enum):
     FANCOIL = 1
 
 
-class Machine():
+class Machine(Exportable):
 
     def __init__(self, gateway, machineId):
         self._gateway = gateway
         self._machineId = machineId
-        self._machine_state = None
+        self._snapshot = EMPTY
         self.sync_clock(True)
         self._zones = {}        
         self._retrieve_machine_state()
 
         
+    @property
+    def snapshot(self):
+        return self._snapshot
+
     @property
     def machine_state(self):
-        return self._machine_state
+        return self._snapshot.state
+
+    def pinned(self):
+        """
+        Copy of the machine reading only the current snapshot, so values read
+        together come from the same refresh.
+        """
+        return copy.copy(self)
 
     @machine_state.setter
     def machine_state(self, value):
-        self._machine_state = value
+        self._snapshot = publish(value)
         self.update_zones()
 
     def discover_zones(self):
@@ -128,6 +143,7 @@ class Machine():
         return self._gateway.write_single_register(
             self._machineId, address, value)
 
+    @single_flight
     def _retrieve_machine_state(self, retrieve_zones=True):
         self.machine_state = self.read_registers(0, 21)
 
@@ -143,9 +159,10 @@ class Machine():
 
     @property
     def operation_mode(self):
-        if self._machine_state == None:
+        state = self.machine_state
+        if state == None:
             return OperationMode.STOP
-        return OperationMode(self._machine_state[0])
+        return OperationMode(state[0])
 
     
     @operation_mode.setter
@@ -164,7 +181,7 @@ class Machine():
 
     @property
     def hotplus_differential_signal(self):
-        return state_value(self._machine_state, 2)
+        return state_value(self.machine_state, 2)
 
     @deprecated('use property')
     def get_hotplus_differential_signal(self):
@@ -172,16 +189,17 @@ class Machine():
 
     @property
     def protection_time(self):
-        return state_value(self._machine_state, 3, 0, 0)
+        return state_value(self.machine_state, 3, 0, 0)
 
     @deprecated('use property')
     def get_protection_time(self):
         return self.protection_time
 
     def central_relay_state_1(self):
-        if self._machine_state == None:
+        state = self.machine_state
+        if state == None:
             return bitfield(0)
-        return bitfield(self._machine_state[13])
+        return bitfield(state[13])
 
     def __str__(self):
         zs = "\n".join([str(z) for z in self.get_zones()])
@@ -195,7 +213,25 @@ class Machine():
 
     @deprecated('Use the machine_state property instead')
     def get_machine_state(self):
-        return self._machine_state
+        return self.machine_state
+
+    def _export_key(self):
+        return (self._snapshot.version,) + tuple(z.snapshot.version for z in self.zones)
+
+    def _export(self):
+        machine = self.pinned()
+        return {
+            'schema': SCHEMA_VERSION,
+            'system': 'innobus',
+            'unique_id': machine.unique_id,
+            'machine_id': machine._machineId,
+            'timestamp': machine._snapshot.timestamp,
+            'available': machine.machine_state is not None,
+            'operation_mode': enum_name(machine.operation_mode),
+            'hotplus_differential_signal': machine.hotplus_differential_signal,
+            'protection_time': machine.protection_time,
+            'zones': [z._export() for z in self.zones],
+        }
 
 
 
@@ -205,36 +241,49 @@ class Zone():
         self._machine = machine
         self._zone_id = zone_id    
         self.base_zone = zone_id * 256
-        self._zone_state = None
+        self._snapshot = EMPTY
         self.retrieve_zone_state()
 
     def write_register(self, address, value):
         return self._machine.write_register(self.base_zone + address, value)
 
     def write_bit_value(self, address, bit, value):
-        new_value = change_bit_value(self._zone_state, address, bit, value)
+        new_value = change_bit_value(self.zone_state, address, bit, value)
         self.write_register(address, new_value)
 
     def __str__(self):
-        return "Zone with id: " + str(self._zone_id) + \
-               " ZoneMode: " + str(self.get_zone_mode()) + \
-               " Tacto On: " + str(self.is_tacto_on()) + \
-               " Hold On: " + str(self.is_zone_hold())
+        zone = self.pinned()
+        return "Zone with id: " + str(zone._zone_id) + \
+               " ZoneMode: " + str(zone.get_zone_mode()) + \
+               " Tacto On: " + str(zone.is_tacto_on()) + \
+               " Hold On: " + str(zone.is_zone_hold())
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def pinned(self):
+        """
+        Copy of the zone reading only the current snapshot, so values read
+        together come from the same refresh.
+        """
+        return copy.copy(self)
 
     @property
     def zone_state(self):
-        return self._zone_state
+        return self._snapshot.state
     
     @zone_state.setter
     def zone_state(self, value):
-        self._zone_state = value
+        self._snapshot = publish(value)
 
+    @single_flight
     def retrieve_zone_state(self):
         self.zone_state = self._machine.read_registers(self.base_zone, 13)
 
     # OPERATION ZONE MODE
     def is_sleep_on(self):
-        return bit_value(self._zone_state, 0, 0)
+        return bit_value(self.zone_state, 0, 0)
 
     def turnon_sleep(self):
         self.write_bit_value(0, 0, 1)
@@ -243,7 +292,7 @@ class Zone():
         self.write_bit_value(0, 0, 0)
 
     def is_automatic_mode(self):
-        return bit_value(self._zone_state, 0, 1)
+        return bit_value(self.zone_state, 0, 1)
 
     def turnon_automatic_mode(self):
         self.write_bit_value(0, 1, 1)
@@ -252,7 +301,7 @@ class Zone():
         self.write_bit_value(0, 1, 0)
 
     def get_zone_mode(self):
-        temp = state_value(self._zone_state, 0, 0, 1)
+        temp = state_value(self.zone_state, 0, 0, 1)
         return ZoneMode(temp)
 
     def set_zone_mode(self, zoneMode):
@@ -270,11 +319,11 @@ class Zone():
             self.turnon_automatic_mode()
             self.turnon_sleep()
 
-        # temp = change_range_bit_value(self._zone_state, 0, 0, 2, ZoneMode[zoneMode].value)
+        # temp = change_range_bit_value(self.zone_state, 0, 0, 2, ZoneMode[zoneMode].value)
         # self.write_register(0, temp)
 
     def is_tacto_on(self):
-        return bit_value(self._zone_state, 0, 2)
+        return bit_value(self.zone_state, 0, 2)
 
     def turnon_tacto(self):
         self.write_bit_value(0, 2, 1)
@@ -283,7 +332,7 @@ class Zone():
         self.write_bit_value(0, 2, 0)
 
     def is_zone_hold(self):
-        return bit_value(self._zone_state, 0, 3)
+        return bit_value(self.zone_state, 0, 3)
 
     def turnon_hold(self):
         self.write_bit_value(0, 3, 1)
@@ -292,20 +341,20 @@ class Zone():
         self.write_bit_value(0, 3, 0)
 
     def get_speed_selection(self):
-        temp = state_value(self._zone_state, 0, 4, 5)
+        temp = state_value(self.zone_state, 0, 4, 5)
         return FancoilSpeed(temp)
 
     def set_speed_selection(self, fancoilSpeed):
-        temp = change_range_bit_value(self._zone_state, 0, 4, 5, FancoilSpeed[fancoilSpeed].value)
+        temp = change_range_bit_value(self.zone_state, 0, 4, 5, FancoilSpeed[fancoilSpeed].value)
         self.write_register(0, temp)
 
     ####
 
     @property
     def min_temp(self):
-        if self._zone_state == None:
+        if self.zone_state == None:
             return -1
-        return self._zone_state[1] / 10 
+        return self.zone_state[1] / 10 
     
     @min_temp.setter
     def min_temp(self, value):
@@ -323,9 +372,9 @@ class Zone():
 
     @property
     def max_temp(self):
-        if self._zone_state == None:
+        if self.zone_state == None:
             return -1
-        return self._zone_state[2] / 10
+        return self.zone_state[2] / 10
 
     @max_temp.setter
     def max_temp(self, value):
@@ -366,105 +415,106 @@ class Zone():
     # ZONE CONFIGURATION
 
     def is_master_zone(self):
-        return bit_value(self._zone_state, 4, 0)
+        return bit_value(self.zone_state, 4, 0)
 
     def get_grid_mode(self):
-        temp = bit_value(self._zone_state, 4, 1)
+        temp = bit_value(self.zone_state, 4, 1)
         return GridMode(temp)
 
     def is_AA_enabled(self):
-        return bit_value(self._zone_state, 4, 2)
+        return bit_value(self.zone_state, 4, 2)
 
     def is_Floor_enabled(self):
-        return bit_value(self._zone_state, 4, 3)
+        return bit_value(self.zone_state, 4, 3)
 
     def get_grid_angle_hot(self):
-        temp = state_value(self._zone_state, 4, 5, 6)
+        temp = state_value(self.zone_state, 4, 5, 6)
         return GridAngle(temp)
 
     def get_grid_angle_cold(self):
-        temp = state_value(self._zone_state, 4, 7, 8)
+        temp = state_value(self.zone_state, 4, 7, 8)
         return GridAngle(temp)
 
     def get_is_minimun_air_enabled(self):
-        temp = bit_value(self._zone_state, 4, 9)
+        temp = bit_value(self.zone_state, 4, 9)
         return temp
 
     def get_probe_type(self):
-        temp = state_value(self._zone_state, 4, 10, 11)
+        temp = state_value(self.zone_state, 4, 10, 11)
         return ProbeType(temp)
 
     def get_presence(self):
-        temp = state_value(self._zone_state, 4, 12, 13)
+        temp = state_value(self.zone_state, 4, 12, 13)
         return RelayConfig(temp)
 
     def get_window(self):
-        temp = state_value(self._zone_state, 4, 14, 15)
+        temp = state_value(self.zone_state, 4, 14, 15)
         return RelayConfig(temp)
 
     ######
 
     def get_grid_opened_time(self):
-        return state_value(self._zone_state, 5) * 10
+        return state_value(self.zone_state, 5) * 10
 
     def get_tacto_address(self):
-        return state_value(self._zone_state, 6)
+        return state_value(self.zone_state, 6)
 
     def get_master_tacto_address(self):
-        return state_value(self._zone_state, 7)
+        return state_value(self.zone_state, 7)
 
     def get_remote_probe_temperature(self):
-        return self._zone_state[8] / 10
+        return self.zone_state[8] / 10
 
     # Zone state register
     def is_zone_grid_opened(self):
-        return bit_value(self._zone_state, 9, 0)
+        return bit_value(self.zone_state, 9, 0)
 
     def is_grid_motor_active(self):
-        return bit_value(self._zone_state, 9, 1)
+        return bit_value(self.zone_state, 9, 1)
 
     def is_grid_motor_requested(self):
-        return bit_value(self._zone_state, 9, 2)
+        return bit_value(self.zone_state, 9, 2)
 
     def is_floor_active(self):
-        return bit_value(self._zone_state, 9, 5)
+        return bit_value(self.zone_state, 9, 5)
 
     def get_local_module_fancoil(self):
-        temp = bit_value(self._zone_state, 9, 6)
+        temp = bit_value(self.zone_state, 9, 6)
         return LocalFancoilType(temp)
 
     def is_requesting_air(self):
-        return bit_value(self._zone_state, 9, 7)
+        return bit_value(self.zone_state, 9, 7)
 
     def is_occupied(self):
-        return bit_value(self._zone_state, 9, 8)
+        return bit_value(self.zone_state, 9, 8)
 
     def is_window_opened(self):
-        return bit_value(self._zone_state, 9, 9)
+        return bit_value(self.zone_state, 9, 9)
 
     def get_fancoil_speed(self):
-        temp = state_value(self._zone_state, 9, 10, 11)
+        temp = state_value(self.zone_state, 9, 10, 11)
         return FancoilSpeed(temp)
 
     def get_proportional_aperture(self):
-        return state_value(self._zone_state, 9, 12, 13)
+        return state_value(self.zone_state, 9, 12, 13)
 
     def is_tacto_connected_cz(self):
-        return bit_value(self._zone_state, 9, 14)
+        return bit_value(self.zone_state, 9, 14)
 
     ###
 
     @property
     def local_temperature(self):
-        return self._zone_state[10] / 10
+        return self.zone_state[10] / 10
 
     @deprecated('use property')
     def get_local_temperature(self):
-        return self._zone_state[10] / 10
+        return self.zone_state[10] / 10
 
     @property
     def dif_current_temp(self):
-        return self.signal_temperature_value - self.local_temperature
+        state = self.zone_state
+        return state[3] / 10 - state[10] / 10
     
     @deprecated('use property')
     def get_dif_current_temp(self):
@@ -473,3 +523,53 @@ class Zone():
     @property
     def unique_id(self):
         return f'{self._machine.unique_id}_Z{self._zone_id}'
+
+    def _export(self):
+        zone = self.pinned()
+        data = {
+            'zone_id': zone._zone_id,
+            'unique_id': zone.unique_id,
+            'timestamp': zone._snapshot.timestamp,
+            'available': zone.zone_state is not None,
+        }
+        if zone.zone_state is None:
+            return data
+        data.update({
+            'zone_mode': enum_name(zone.get_zone_mode()),
+            'sleep_on': bool(zone.is_sleep_on()),
+            'automatic_mode': bool(zone.is_automatic_mode()),
+            'tacto_on': bool(zone.is_tacto_on()),
+            'zone_hold': bool(zone.is_zone_hold()),
+            'speed_selection': enum_name(zone.get_speed_selection()),
+            'min_temp': zone.min_temp,
+            'max_temp': zone.max_temp,
+            'signal_temperature': zone.signal_temperature_value,
+            'local_temperature': zone.local_temperature,
+            'dif_current_temp': zone.dif_current_temp,
+            'remote_probe_temperature': zone.get_remote_probe_temperature(),
+            'master_zone': bool(zone.is_master_zone()),
+            'grid_mode': enum_name(zone.get_grid_mode()),
+            'aa_enabled': bool(zone.is_AA_enabled()),
+            'floor_enabled': bool(zone.is_Floor_enabled()),
+            'grid_angle_hot': enum_name(zone.get_grid_angle_hot()),
+            'grid_angle_cold': enum_name(zone.get_grid_angle_cold()),
+            'minimum_air_enabled': bool(zone.get_is_minimun_air_enabled()),
+            'probe_type': enum_name(zone.get_probe_type()),
+            'presence': enum_name(zone.get_presence()),
+            'window': enum_name(zone.get_window()),
+            'grid_opened_time': zone.get_grid_opened_time(),
+            'tacto_address': zone.get_tacto_address(),
+            'master_tacto_address': zone.get_master_tacto_address(),
+            'grid_opened': bool(zone.is_zone_grid_opened()),
+            'grid_motor_active': bool(zone.is_grid_motor_active()),
+            'grid_motor_requested': bool(zone.is_grid_motor_requested()),
+            'floor_active': bool(zone.is_floor_active()),
+            'local_module_fancoil': enum_name(zone.get_local_module_fancoil()),
+            'requesting_air': bool(zone.is_requesting_air()),
+            'occupied': bool(zone.is_occupied()),
+            'window_opened': bool(zone.is_window_opened()),
+            'fancoil_speed': enum_name(zone.get_fancoil_speed()),
+            'proportional_aperture': zone.get_proportional_aperture(),
+            'tacto_connected_cz': bool(zone.is_tacto_connected_cz()),
+        })
+        return data
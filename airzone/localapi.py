@@ -1,10 +1,16 @@
 """ Airzone Local api integration
 """
 import logging
+import time
+from collections import namedtuple
 from enum import IntEnum
 
 import requests  # type: ignore
 
+from airzone.serialization import SCHEMA_VERSION, Exportable, enum_name
+from airzone.singleflight import single_flight
+from airzone.snapshot import EMPTY, publish
+
 _LOGGER = logging.getLogger(__name__)
 
 class OperationMode(IntEnum):
@@ -23,6 +29,10 @@ class TempUnits(IntEnum):
     CELSIUS = 0
     FAHRENHEIT = 1
 
+    @classmethod
+    def _missing_(cls, value):
+        return TempUnits.CELSIUS
+
 
 class Speed(IntEnum):
     AUTO = 0
@@ -39,21 +49,83 @@ class Speed(IntEnum):
         return Speed.AUTO
 
 
+_ZONE_FIELDS = ['system_id', 'zone_id', 'name', 'on', 'max_temp', 'min_temp', 'setpoint',
+                'room_temp', 'humidity', 'mode', 'modes', 'speed', 'units',
+                'air_demand', 'floor_demand', 'errors']
+
+
+class ZoneRecord(namedtuple('ZoneRecord', _ZONE_FIELDS)):
+    """
+    Immutable zone state parsed once from the json returned by the webserver,
+    with the enums already resolved. Records compare by value, so comparing two
+    of them tells whether anything changed between two refreshes.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_json(cls, z):
+        speed = z.get('speed')
+        return cls(
+            system_id=z.get('systemID'),
+            zone_id=z.get('zoneID'),
+            # Old localapi fw versions doesn't expose the name.
+            name=z.get('name'),
+            on=z.get('on'),
+            max_temp=z.get('maxTemp'),
+            min_temp=z.get('minTemp'),
+            setpoint=z.get('setpoint'),
+            room_temp=z.get('roomTemp'),
+            humidity=z.get('humidity'),
+            mode=OperationMode(z.get('mode')),
+            modes=tuple(OperationMode(m) for m in z.get('modes', ())),
+            speed=Speed.AUTO if speed is None else Speed(speed),
+            units=TempUnits(z.get('units', TempUnits.CELSIUS)),
+            air_demand=z.get('air_demand'),
+            floor_demand=z.get('floor_demand'),
+            errors=tuple(z.get('errors', ())),
+        )
+
+
+# systemID asking the webserver for the zones of every system at once.
+ALL_SYSTEMS = 127
+
+
 class API():
 
-    def __init__(self,  machine_ipaddr, port=3000):
+    profiler = None
+
+    def __init__(self,  machine_ipaddr, port=3000, trace=None):
         self._machine_ip = machine_ipaddr
         self._port = port
         self._API_ENDPOINT = f"http://{machine_ipaddr}:{str(port)}/api/v1/hvac"
+        self.trace = trace
+        self._label = str(self)
+
+    def _request(self, method, system_id, zone_id, data):
+        start = time.perf_counter() if self.trace is not None else None
+        outcome = 'ok'
+        profiler = self.profiler
+        sent = time.perf_counter() if profiler is not None and profiler.active() else None
+        try:
+            response = method(url=self._API_ENDPOINT, json=data)
+            outcome = str(response.status_code)
+            return response
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if sent is not None:
+                profiler.record_transaction(method.__name__.upper(), 0.0, time.perf_counter() - sent)
+            if start is not None:
+                self.trace.record(self._label, system_id, method.__name__.upper(), zone_id, None,
+                                  time.perf_counter() - start, outcome)
     
-    def retrieve_state(self, system_id, zone_id):
+    def _post(self, system_id, zone_id):
         try:
             data = {'SystemID': system_id, 'ZoneID': zone_id}
-            response = requests.post(url=self._API_ENDPOINT,
-                                           json=data)
+            response = self._request(requests.post, system_id, zone_id, data)
             if response.status_code == 200:
-                response_json = response.json()
-                return response_json['data']                
+                return response.json()
             elif response.status_code >= 500:
                 _LOGGER.info(f'[!] [{response.status_code}] Server Error: ' + response.text)                
                 return None
@@ -61,13 +133,58 @@ class API():
         except requests.exceptions.RequestException as e:
             _LOGGER.exception(str(e))
 
+    def retrieve_state(self, system_id, zone_id):
+        response_json = self._post(system_id, zone_id)
+        if response_json is not None:
+            return response_json.get('data')
+
+    def retrieve_all_systems(self):
+        """
+        Zones of every system behind the webserver with a single request, as
+        {system_id: zones}. Empty when the webserver answers that it doesn't
+        support it, None when it didn't answer or failed without saying why.
+        """
+        data = {'SystemID': ALL_SYSTEMS, 'ZoneID': 0}
+        try:
+            response = self._request(requests.post, ALL_SYSTEMS, 0, data)
+        except requests.exceptions.RequestException as e:
+            _LOGGER.warning('Error listing the systems of %s: %s', self, e)
+            return None
+        try:
+            response_json = response.json()
+        except ValueError:
+            response_json = None
+        if not isinstance(response_json, dict):
+            response_json = {}
+        if response.status_code >= 500 and not response_json.get('errors'):
+            _LOGGER.info(f'[!] [{response.status_code}] Server Error: ' + response.text)
+            return None
+        if response.status_code != 200:
+            # The firmware rejects the all systems id
+            return {}
+        if 'systems' in response_json:
+            zones = [z for system in response_json['systems'] for z in system.get('data', ())]
+        else:
+            zones = response_json.get('data')
+        systems = {}
+        for z in zones or ():
+            systems.setdefault(z['systemID'], []).append(z)
+        return systems
+
     def set_zone_parameter_value(self, machine_id, zone_id, parameter, value):
+        if self.set_zone_parameters(machine_id, zone_id, {parameter: value}) is not None:
+            return value
+
+    def set_zone_parameters(self, machine_id, zone_id, parameters):
+        """
+        Sets several parameters of a zone with a single request. Returns the
+        parameters on success.
+        """
         try:
             
             data = {'systemID': machine_id, 'zoneID': zone_id}
-            data[parameter] = value
-            response = requests.put(url=self._API_ENDPOINT,
-                                    json=data)
+            data.update(parameters)
+            response = self._request(requests.put, machine_id, zone_id, data)
 
             if response.status_code == 200:
                 # Update successfully. We update manually the value.
@@ -75,7 +192,7 @@ class API():
                 # so until a new retrieve_system_state is made the only zone with the proper
                 # system values is the first one. It this is not desirable a retrieve_system_state
                 # should be done just after this
-                return value                
+                return parameters                
             elif response.status_code >= 500:
                 _LOGGER.info(f'[!] [{response.status_code}] Server Error: ' + response.text)
                 return None
@@ -89,34 +206,57 @@ class API():
 
     
 
-class Machine():
+class Machine(Exportable):
 
-    def __init__(self, api, system_id=1, vaf_cbs=False):
+    def __init__(self, api, system_id=1, vaf_cbs=False, state=None):
+        """
+        Arguments:
+            state -- zones of the system already retrieved, the machine is
+                     then built without any request
+        """
         self._api = api        
         self._machine_id = system_id        
         self._error_log = []        
-        self._machine_state = None
+        self._snapshot = EMPTY
         self._machine_zone_state = None
         self._zones = {}                
-        self.retrieve_machine_state()
+        if state is None:
+            self.retrieve_machine_state()
+        else:
+            self.apply_state(state, update_zones=True)
+
+    @property
+    def snapshot(self):
+        return self._snapshot
 
     @property
     def machine_state(self):
-        return self._machine_state
+        return self._snapshot.state
 
 
     @machine_state.setter
     def machine_state(self, value):
-        self._machine_state = value
+        self._snapshot = publish(value, None if value is None else ZoneRecord.from_json(value))
         _LOGGER.debug(value)
+
+    @property
+    def record(self):
+        return self._snapshot.record
     
     @property
     def machine_id(self):
         return self._machine_id
      
  
+    @single_flight
     def retrieve_machine_state(self, update_zones = False):
         state = self._api.retrieve_state(self._machine_id, 0)
+        self.apply_state(state, update_zones)
+
+    def apply_state(self, state, update_zones=False):
+        """
+        Publishes the zones returned by a system wide request.
+        """
         if state is not None and len(state) > 0:
             if self._zones == {}:
                 self.discover_zones(state)
@@ -128,7 +268,7 @@ class Machine():
                         self._zones[zone_id].zone_state = z
     
     def discover_zones(self, state):
-        self._zones = {z['zoneID']: Zone(self._api, self, z['zoneID']) for z in state if z['zoneID'] != 0}        
+        self._zones = {z['zoneID']: Zone(self._api, self, z['zoneID'], z) for z in state if z['zoneID'] != 0}        
                     
     @property
     def zones(self):
@@ -136,11 +276,7 @@ class Machine():
           
     @property
     def speed(self):
-        if 'speed' in self.machine_state:
-            speed = self.machine_state['speed']
-            if speed is not None:
-                return Speed(speed)
-        return Speed.AUTO
+        return self._snapshot.record.speed
 
     @speed.setter
     def speed(self, speed):
@@ -149,11 +285,11 @@ class Machine():
             s = speed.value
         value = self._api.set_zone_parameter_value(self._machine_id, 0, 'speed', s)
         if value:
-            self.machine_state['speed'] = value
+            self.machine_state = dict(self.machine_state, speed=value)
 
     @property
     def operation_mode(self):
-        return OperationMode(self.machine_state['mode'])
+        return self._snapshot.record.mode
 
     @operation_mode.setter
     def operation_mode(self, mode):
@@ -162,17 +298,35 @@ class Machine():
             m = mode.value
         value = self._api.set_zone_parameter_value(self._machine_id, 0, 'mode', m)
         if value:
-            self.machine_state['mode'] = value
+            self.machine_state = dict(self.machine_state, mode=value)
 
     @property
     def units(self):
-        return TempUnits(self.machine_state['units'])        
+        return self._snapshot.record.units
 
     @property
     def unique_id(self):
         return f'{str(self._api)}_{self._machine_id}'
 
 
+    def _export_key(self):
+        return (self._snapshot.version,) + tuple(z.snapshot.version for z in self.zones)
+
+    def _export(self):
+        record = self.record
+        return {
+            'schema': SCHEMA_VERSION,
+            'system': 'localapi',
+            'unique_id': self.unique_id,
+            'machine_id': self._machine_id,
+            'timestamp': self._snapshot.timestamp,
+            'available': record is not None,
+            'operation_mode': enum_name(record.mode) if record else None,
+            'speed': enum_name(record.speed) if record else None,
+            'units': enum_name(record.units) if record else None,
+            'zones': [z._export() for z in self.zones],
+        }
+
     def __str__(self):
         zs = "\n".join([str(z) for z in self.zones])
         return "Machine with id: " + str(self._machine_id) + \
@@ -180,18 +334,94 @@ class Machine():
                 "\nZones\n" + str(zs)
 
 
+class Webserver():
+    """
+    Every system behind a localapi webserver, refreshed with as few requests
+    as the firmware allows: a single one when it answers for all systems at
+    once, one per system otherwise.
+    Arguments:
+        max_systems -- system ids probed when the firmware can't list them
+    """
+
+    def __init__(self, api, max_systems=8):
+        self._api = api
+        self.max_systems = max_systems
+        self._all_systems = None
+        self._machines = {}
+        self.discover()
+
+    def _retrieve(self, system_ids):
+        if self._all_systems is not False:
+            systems = self._api.retrieve_all_systems()
+            if systems is None:
+                # No answer: probing every system would fail as well, the
+                # next refresh asks again.
+                return {}
+            if systems:
+                self._all_systems = True
+                return systems
+            if self._all_systems is None:
+                _LOGGER.debug('%s does not list all systems, probing them', self._api)
+                self._all_systems = False
+        systems = {}
+        for system_id in system_ids:
+            state = self._api.retrieve_state(system_id, 0)
+            if state:
+                systems[system_id] = state
+        return systems
+
+    def discover(self):
+        """
+        Finds the systems behind the webserver and builds their machines.
+        """
+        systems = self._retrieve(range(1, self.max_systems + 1))
+        self._apply(systems)
+        return list(self._machines)
+
+    def refresh(self):
+        """
+        Refreshes every known system and its zones. Returns the refreshed ids.
+        """
+        systems = self._retrieve(list(self._machines))
+        self._apply(systems)
+        return list(systems)
+
+    def _apply(self, systems):
+        for system_id, state in sorted(systems.items()):
+            machine = self._machines.get(system_id)
+            if machine is None:
+                self._machines[system_id] = Machine(self._api, system_id, state=state)
+            else:
+                machine.apply_state(state, update_zones=True)
+
+    @property
+    def machines(self):
+        return self._machines.values()
+
+    @property
+    def systems(self):
+        return list(self._machines)
+
+    def machine(self, system_id):
+        return self._machines[system_id]
+
+    def __str__(self):
+        return f'Webserver {str(self._api)} systems: {self.systems}'
+
+
 class Zone:
-    def __init__(self, api, machine, zone_id):  
+    def __init__(self, api, machine, zone_id, state=None):  
         self._api = api
         self._machine = machine
         self._machine_id = self.machine.machine_id              
         self._zone_id = zone_id        
-        self.zone_state = None
-        self.retrieve_zone_state()
+        self.zone_state = state
+        if state is None:
+            self.retrieve_zone_state()
         # Old localapi fw versions doesn't expose the name.
         self._name = f'Zone_{zone_id}'
-        if 'name' in self.zone_state:
-            self._name = self.zone_state['name']
+        if self._snapshot.record.name is not None:
+            self._name = self._snapshot.record.name
 
 
     def _set_parameter_value(self, prop, value):
@@ -200,23 +430,32 @@ class Zone:
 
     @property
     def zone_state(self):
-        return self._zone_state
+        return self._snapshot.state
 
     @zone_state.setter
     def zone_state(self, value):
-        self._zone_state = value
+        self._snapshot = publish(value, None if value is None else ZoneRecord.from_json(value))
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def record(self):
+        return self._snapshot.record
 
     @property
     def machine(self):
         return self._machine
 
+    @single_flight
     def retrieve_zone_state(self):
         state = self._api.retrieve_state(self._machine_id, self._zone_id)        
         if state is not None and len(state)> 0:
             self.zone_state = state[0]
 
     def is_on(self):
-        return self.zone_state['on']
+        return self._snapshot.record.on
 
     def turn_on(self):
         self._set_parameter_value('on', 1)
@@ -226,7 +465,7 @@ class Zone:
 
     @property
     def signal_temperature_value(self):
-        return self.zone_state['setpoint']
+        return self._snapshot.record.setpoint
 
     @signal_temperature_value.setter
     def signal_temperature_value(self, setpoint):
@@ -235,49 +474,50 @@ class Zone:
     @property
     def name(self):
         # Old fw doesn't expose the name
-        if 'name' in self.zone_state:
-            return self.zone_state['name']
+        if self._snapshot.record.name is not None:
+            return self._snapshot.record.name
         return self._name
 
     @name.setter
     def name(self, name):
         # Old fw doesn't expose the name
         self._name = name
-        if 'name' in self.zone_state:
+        if self._snapshot.record.name is not None:
             self._set_parameter_value('name', name)
 
     @property
     def max_temp(self):
-        return self.zone_state['maxTemp']
+        return self._snapshot.record.max_temp
 
     @property
     def min_temp(self):
-        return self.zone_state['minTemp']
+        return self._snapshot.record.min_temp
 
     @property
     def local_temperature(self):
-        return self.zone_state['roomTemp']
+        return self._snapshot.record.room_temp
 
     @property
     def dif_current_temp(self):
-        return self.signal_temperature_value - self.local_temperature
+        record = self._snapshot.record
+        return record.setpoint - record.room_temp
 
     @property
     def room_humidity(self):
-        return self.zone_state['humidity']
+        return self._snapshot.record.humidity
 
     @property
     def air_demand(self):
-        return self.zone_state['air_demand']
+        return self._snapshot.record.air_demand
 
     @property
     def floor_demand(self):
-        return self.zone_state['floor_demand']
+        return self._snapshot.record.floor_demand
 
 
     @property
     def units(self):
-        return TempUnits(self.zone_state['units'])
+        return self._snapshot.record.units
 
 
     @property
@@ -285,6 +525,33 @@ class Zone:
         # TODO: review
         return f'{self.name}_Z{str(self._zone_id)}'
 
+    def _export(self):
+        snapshot = self._snapshot
+        record = snapshot.record
+        data = {
+            'zone_id': self._zone_id,
+            'timestamp': snapshot.timestamp,
+            'available': record is not None,
+        }
+        if record is None:
+            return data
+        data.update({
+            'unique_id': self.unique_id,
+            'name': record.name if record.name is not None else self._name,
+            'on': bool(record.on),
+            'operation_mode': enum_name(record.mode),
+            'signal_temperature': record.setpoint,
+            'local_temperature': record.room_temp,
+            'min_temp': record.min_temp,
+            'max_temp': record.max_temp,
+            'humidity': record.humidity,
+            'units': enum_name(record.units),
+            'air_demand': bool(record.air_demand),
+            'floor_demand': bool(record.floor_demand),
+            'errors': list(record.errors),
+        })
+        return data
+
 
     def __str__(self):
         return "Zone with id: " + str(self._zone_id) + \
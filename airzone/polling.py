@@ -0,0 +1,253 @@
+""" Adaptive per-zone polling.
+
+Zones that are demanding air, moving grids or changing between reads are polled
+at the fast rate; idle zones back off exponentially up to a ceiling. All zones
+behind the same gateway (or localapi webserver) share one transaction budget.
+"""
+import heapq
+import itertools
+import logging
+import time
+from threading import Event, Lock, Thread
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def gateway_of(zone):
+    """
+    Returns the object that carries the transactions of the zone: the modbus
+    gateway for innobus zones and the API for localapi zones. Machines and Aido
+    units are accepted too.
+    """
+    machine = getattr(zone, '_machine', zone)
+    if hasattr(machine, '_gateway'):
+        return machine._gateway
+    return machine._api
+
+
+def is_zone_active(zone):
+    """
+    True when the zone is asking the installation for something.
+    """
+    if hasattr(zone, 'is_requesting_air'):
+        return bool(zone.is_requesting_air() or zone.is_grid_motor_active())
+    if zone.zone_state is None:
+        return False
+    return bool(zone.air_demand or zone.floor_demand)
+
+
+class TransactionBudget():
+    """
+    Token bucket limiting the transactions per second sent to one gateway.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._stamp = None
+        self._lock = Lock()
+
+    def _refill(self, now):
+        if self._stamp is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_acquire(self, now, cost=1):
+        with self._lock:
+            self._refill(now)
+            if self._tokens >= cost:
+                self._tokens -= cost
+                return True
+            return False
+
+    def delay(self, now, cost=1):
+        """
+        Seconds to wait until `cost` transactions are available.
+        """
+        with self._lock:
+            self._refill(now)
+            missing = cost - self._tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate
+
+
+class _PollEntry():
+    __slots__ = ('zone', 'budget', 'interval', 'due', 'burst_until', 'last_poll')
+
+    def __init__(self, zone, budget, interval, due):
+        self.zone = zone
+        self.budget = budget
+        self.interval = interval
+        self.due = due
+        self.burst_until = 0.0
+        self.last_poll = None
+
+
+class AdaptivePoller():
+    """
+    Schedules zone refreshes according to zone activity.
+
+    Arguments:
+        min_interval: polling period of active or recently changed zones.
+        max_interval: ceiling of the exponential backoff of idle zones.
+        backoff: factor applied to the period of an idle zone after each poll.
+        burst_interval, burst_duration: polling period used during the
+            `burst_duration` seconds following a write on the zone.
+        transactions_per_second: budget shared by all zones of one gateway.
+    """
+
+    def __init__(self, min_interval=5, max_interval=300, backoff=2.0,
+                 burst_interval=1, burst_duration=10,
+                 transactions_per_second=10, clock=time.monotonic):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.burst_interval = burst_interval
+        self.burst_duration = burst_duration
+        self.transactions_per_second = transactions_per_second
+        self._clock = clock
+        self._entries = {}
+        self._budgets = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+        self._thread = None
+
+    def _push(self, entry):
+        heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+
+    def budget_for(self, gateway):
+        key = id(gateway)
+        if key not in self._budgets:
+            self._budgets[key] = TransactionBudget(self.transactions_per_second)
+        return self._budgets[key]
+
+    def add_zone(self, zone):
+        with self._lock:
+            if id(zone) in self._entries:
+                return
+            entry = _PollEntry(zone, self.budget_for(gateway_of(zone)),
+                               self.min_interval, self._clock())
+            self._entries[id(zone)] = entry
+            self._push(entry)
+        self._wakeup.set()
+
+    def add_machine(self, machine):
+        for zone in machine.zones:
+            self.add_zone(zone)
+
+    def remove_zone(self, zone):
+        with self._lock:
+            entry = self._entries.pop(id(zone), None)
+            if entry is not None:
+                entry.due = None
+
+    def notify_write(self, zone):
+        """
+        Polls the zone right away and keeps it on the burst rate for a while,
+        so the effect of a write is seen quickly.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(id(zone))
+            if entry is None:
+                return
+            entry.burst_until = now + self.burst_duration
+            entry.interval = self.min_interval
+            entry.due = now
+            self._push(entry)
+        self._wakeup.set()
+
+    def interval_of(self, zone):
+        entry = self._entries.get(id(zone))
+        return None if entry is None else entry.interval
+
+    def next_due(self):
+        with self._lock:
+            while self._heap:
+                due, _, entry = self._heap[0]
+                if entry.due == due:
+                    return due
+                heapq.heappop(self._heap)
+        return None
+
+    def _next_interval(self, entry, now, active, changed):
+        if now < entry.burst_until:
+            return self.burst_interval
+        if active or changed:
+            return self.min_interval
+        return min(entry.interval * self.backoff, self.max_interval)
+
+    def _refresh(self, entry, now):
+        zone = entry.zone
+        before = zone.zone_state
+        try:
+            zone.retrieve_zone_state()
+        except Exception:
+            _LOGGER.exception('Error polling zone %s', zone.unique_id)
+        after = zone.zone_state
+        if after is None:
+            return min(entry.interval * self.backoff, self.max_interval)
+        changed = entry.last_poll is not None and before != after
+        entry.last_poll = now
+        return self._next_interval(entry, now, is_zone_active(zone), changed)
+
+    def poll_once(self):
+        """
+        Refreshes every zone that is due and whose gateway has budget left.
+        Returns the refreshed zones.
+        """
+        polled = []
+        now = self._clock()
+        deferred = []
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, _, entry = heapq.heappop(self._heap)
+                if entry.due != due:
+                    continue
+            if not entry.budget.try_acquire(now):
+                deferred.append(entry)
+                continue
+            interval = self._refresh(entry, now)
+            polled.append(entry.zone)
+            with self._lock:
+                if entry.due is None:
+                    continue
+                entry.interval = interval
+                entry.due = now + interval
+                self._push(entry)
+        with self._lock:
+            for entry in deferred:
+                if entry.due is None:
+                    continue
+                entry.due = now + entry.budget.delay(now)
+                self._push(entry)
+        return polled
+
+    def run(self):
+        while not self._stop.is_set():
+            self.poll_once()
+            due = self.next_due()
+            timeout = 1.0 if due is None else max(0.0, due - self._clock())
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self.run, name='airzone-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,209 @@
+""" Opt-in poll cycle profiling.
+
+A cycle (a machine refresh, and whatever decoding follows it) is broken down
+into time spent waiting for the gateway lock, time in transactions on the wire
+or over http, and the rest, spent in python decoding the state:
+
+    profiler = CycleProfiler(sample_every=10)
+    profiler.attach(gateway)
+    with profiler.cycle(machine.unique_id):
+        machine._retrieve_machine_state()
+        machine.to_dict()
+    print(profiler.summary_table())
+    open('cycles.folded', 'w').write(profiler.folded())  # flamegraph.pl input
+
+Gateways and APIs only measure while the current thread runs a sampled
+cycle, unsampled cycles cost a counter increment. Every key is sampled on its
+own count, so machines polled in turn are all profiled.
+
+Cycles belong to a thread. A worker running transactions for a waiting cycle
+records them in it when the cycle is handed over with `current()` and
+`resume()`, as CommandQueue does for reads. Transactions on other threads,
+such as the pools of groups or the scanner, are not seen by the cycle: their
+time falls in the decode phase.
+"""
+import itertools
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+PHASES = ('lock_wait', 'io', 'decode')
+
+
+class _Cycle():
+    __slots__ = ('lock_wait', 'io', 'calls')
+
+    def __init__(self):
+        self.lock_wait = 0.0
+        self.io = 0.0
+        self.calls = {}
+
+
+class _MachineProfile():
+
+    def __init__(self, keep):
+        self.cycles = 0
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.durations = deque(maxlen=keep)
+        self.io_calls = Counter()
+        self.io_time = Counter()
+
+    def add(self, cycle, duration):
+        decode = max(duration - cycle.lock_wait - cycle.io, 0.0)
+        self.cycles += 1
+        self.totals['lock_wait'] += cycle.lock_wait
+        self.totals['io'] += cycle.io
+        self.totals['decode'] += decode
+        self.durations.append(duration)
+        for function, (count, seconds) in cycle.calls.items():
+            self.io_calls[function] += count
+            self.io_time[function] += seconds
+
+
+class CycleProfiler():
+    """
+    Arguments:
+        sample_every -- profile one cycle out of this many
+        keep -- cycle durations kept per machine for the percentiles
+    """
+
+    def __init__(self, sample_every=1, keep=1024):
+        self.sample_every = max(1, int(sample_every))
+        self.keep = keep
+        self._counters = defaultdict(itertools.count)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._machines = {}
+
+    def attach(self, *carriers):
+        """
+        Starts measuring the transactions of gateways or localapi APIs. Every
+        transport has a `profiler` attribute, None when not profiled, checked
+        on each transaction.
+        """
+        for carrier in carriers:
+            carrier.profiler = self
+
+    def detach(self, *carriers):
+        for carrier in carriers:
+            carrier.profiler = None
+
+    def active(self):
+        """
+        Whether the current thread is running a sampled cycle.
+        """
+        return getattr(self._local, 'cycle', None) is not None
+
+    def current(self):
+        """
+        Sampled cycle of the current thread, None outside of one. Hand it to
+        `resume` in the thread doing the work for it.
+        """
+        return getattr(self._local, 'cycle', None)
+
+    @contextmanager
+    def resume(self, cycle, queued=None):
+        """
+        Records the transactions of the body in `cycle`, the cycle of another
+        thread waiting for them. The time since `queued`, a perf_counter
+        reading taken when the work was handed over, counts as lock wait.
+        """
+        if cycle is None:
+            yield
+            return
+        previous = getattr(self._local, 'cycle', None)
+        self._local.cycle = cycle
+        if queued is not None:
+            cycle.lock_wait += time.perf_counter() - queued
+        try:
+            yield
+        finally:
+            self._local.cycle = previous
+
+    def record_transaction(self, function, lock_wait, io):
+        cycle = getattr(self._local, 'cycle', None)
+        if cycle is None:
+            return
+        cycle.lock_wait += lock_wait
+        cycle.io += io
+        count, seconds = cycle.calls.get(function, (0, 0.0))
+        cycle.calls[function] = (count + 1, seconds + io)
+
+    @contextmanager
+    def cycle(self, key):
+        """
+        Profiles the body as one cycle of `key` (usually the machine unique
+        id) when it is sampled, one cycle of the key out of sample_every.
+        Nested cycles count in the outer one.
+        """
+        if self.active() or next(self._counters[key]) % self.sample_every:
+            yield
+            return
+        cycle = self._local.cycle = _Cycle()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self._local.cycle = None
+            with self._lock:
+                profile = self._machines.get(key)
+                if profile is None:
+                    profile = self._machines[key] = _MachineProfile(self.keep)
+                profile.add(cycle, duration)
+
+    def profile(self, key, func, *args, **kwargs):
+        with self.cycle(key):
+            return func(*args, **kwargs)
+
+    def summary(self):
+        """
+        Per machine: sampled cycles, transactions per cycle, mean and p95 cycle
+        time and the mean time of every phase, in milliseconds.
+        """
+        result = {}
+        with self._lock:
+            for key, profile in self._machines.items():
+                durations = list(profile.durations)
+                p95 = durations[0] if len(durations) == 1 else \
+                    statistics.quantiles(durations, n=20, method='inclusive')[18]
+                row = {'cycles': profile.cycles,
+                       'transactions': sum(profile.io_calls.values()) / profile.cycles,
+                       'mean_ms': statistics.fmean(durations) * 1e3,
+                       'p95_ms': p95 * 1e3}
+                for phase in PHASES:
+                    row[f'{phase}_ms'] = profile.totals[phase] / profile.cycles * 1e3
+                result[key] = row
+        return result
+
+    def summary_table(self):
+        columns = ['cycles', 'transactions', 'mean_ms', 'p95_ms'] + [f'{p}_ms' for p in PHASES]
+        rows = self.summary()
+        width = max([len('machine')] + [len(str(k)) for k in rows])
+        lines = [f'{"machine":{width}s} ' + ' '.join(f'{c:>12s}' for c in columns)]
+        for key, row in sorted(rows.items(), key=lambda kv: -kv[1]['mean_ms']):
+            lines.append(f'{str(key):{width}s} {row["cycles"]:12d} ' +
+                         ' '.join(f'{row[c]:12.3f}' for c in columns[1:]))
+        return '\n'.join(lines)
+
+    def folded(self):
+        """
+        Sampled time in folded stack format (one "frame;frame value" line per
+        stack, values in microseconds), as read by flamegraph.pl and speedscope.
+        """
+        lines = []
+        with self._lock:
+            for key, profile in self._machines.items():
+                frame = str(key).replace(';', '_').replace(' ', '_')
+                lines.append(f'{frame};lock_wait {int(profile.totals["lock_wait"] * 1e6)}')
+                for function, seconds in profile.io_time.items():
+                    lines.append(f'{frame};io;{function} {int(seconds * 1e6)}')
+                lines.append(f'{frame};decode {int(profile.totals["decode"] * 1e6)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._machines.clear()
+            self._counters.clear()
@@ -2,25 +2,28 @@ import logging
 import time
 from threading import Lock
 
-from pymodbus import FramerType  # type: ignore
-from pymodbus.client import ModbusTcpClient as ModbusClient  # type: ignore
-
 from airzone.utils import *
 
 
-def modbus_factory(url, port, use_rtu_framer = False):
+def modbus_factory(url, port, use_rtu_framer = False, **kwargs):
     """                
         Builds the modbus client
         WIP to add more types.
         Arguments:
             url {String} -- Address where the master is listening
             port {String} -- Serial port string as it is used in pyserial
+            kwargs -- extra client options such as timeout or retries
 
     """
+    # pymodbus is only imported when a client is built, so importing the
+    # decoding helpers of this module stays cheap.
+    from pymodbus import FramerType  # type: ignore
+    from pymodbus.client import ModbusTcpClient as ModbusClient  # type: ignore
+
     if use_rtu_framer:
-        client = ModbusClient(url, port=port, framer=FramerType.RTU)
+        client = ModbusClient(url, port=port, framer=FramerType.RTU, **kwargs)
     else:
-        client = ModbusClient(url, port=port)    
+        client = ModbusClient(url, port=port, **kwargs)    
     return client
 
 
@@ -88,54 +91,126 @@ def date_as_number(date):
 # log.setLevel(logging.DEBUG)
 UNIT = 0x1
 
+_LOGGER = logging.getLogger(__name__)
+
+ILLEGAL_DATA_ADDRESS = 2
+
+
+def exception_code(gateway, machineid):
+    """
+    Modbus exception code the device answered its last read with, None when
+    the read succeeded, got no answer or the gateway doesn't keep track.
+    """
+    getter = getattr(gateway, 'exception_code', None)
+    return getter(machineid) if getter is not None else None
+
+
+class ModbusError(IOError):
+    """
+    The device answered with a modbus exception response.
+    """
+
+    def __init__(self, message, exception_code=None):
+        super().__init__(message)
+        self.exception_code = exception_code
+
 
 class Gateway():
 
-    def __init__(self, modbus_client):
+    profiler = None
+
+    def __init__(self, modbus_client, trace=None):
         """                
         Arguments:
             modbus_Client: an already configured ModbusClient to use
+            trace: optional TransactionTrace recording every transaction
         """ 
         self._lock = Lock()        
         self.client = modbus_client
+        self.trace = trace
+        # label of the traced transactions, formatted once
+        self._label = str(self)
+        self._exception_codes = {}
         with self._lock:           
             self.client.connect()
             time.sleep(2)       
 
+    def _call(self, function, method, **kwargs):
+        profiler = self.profiler
+        if profiler is None or not profiler.active():
+            with self._lock:
+                return method(**kwargs)
+        waited = time.perf_counter()
+        with self._lock:
+            acquired = time.perf_counter()
+            try:
+                return method(**kwargs)
+            finally:
+                profiler.record_transaction(function, acquired - waited, time.perf_counter() - acquired)
+
+    def _read(self, function, machineid, address, num_registers):
+        start = time.perf_counter() if self.trace is not None else None
+        outcome = 'ok'
+        try:
+            response = self._call(function, getattr(self.client, function),
+                                  address=address, count=num_registers, device_id=machineid)
+            if response.isError():
+                code = getattr(response, 'exception_code', None)
+                outcome = f'exception_code={code}'
+                self._exception_codes[machineid] = code
+                _LOGGER.debug('error response: %s', response)
+                return None
+            self._exception_codes.pop(machineid, None)
+            _LOGGER.debug('response: %s', response.registers)
+            return response.registers
+        except Exception as e:
+            outcome = type(e).__name__
+            self._exception_codes.pop(machineid, None)
+            _LOGGER.exception('Error in %s', function)
+        finally:
+            if start is not None:
+                self.trace.record(self._label, machineid, function, address, num_registers,
+                                  time.perf_counter() - start, outcome)
+        return None
 
     # innobus doc type 3
     def read_holding_registers(self, machineid, address, num_registers):
-        logging.debug(
-            f'read holding registers machineId: {str(machineid)} address: {str(address)} num_registers: {str(num_registers)}')
-
-        try:
-            with self._lock:
-                response = self.client.read_holding_registers(
-                    address=address, count=num_registers, device_id=machineid)
-
-                logging.debug('response: ' + str(response.registers))
-                return response.registers
-        except:
-            logging.exception('Error reading holding registers')
-        return None
+        _LOGGER.debug('read holding registers machineId: %s address: %s num_registers: %s',
+                      machineid, address, num_registers)
+        return self._read('read_holding_registers', machineid, address, num_registers)
 
     def read_input_registers(self, machineid, address, num_registers):  # innobus doc type 4
-        logging.debug('reading input registers: machineId:' + str(machineid) +
-                      ' address: ' + str(address) + ' num_registers: ' + str(num_registers))
-        try:
-            with self._lock:
-                response = self.client.read_input_registers(
-                    address=address, count=num_registers, device_id=machineid)
-                logging.debug('response: ' + str(response.registers))
-                return response.registers
-        except:
-            logging.exception('Error reading input registers')
-        return None
+        _LOGGER.debug('reading input registers: machineId: %s address: %s num_registers: %s',
+                      machineid, address, num_registers)
+        return self._read('read_input_registers', machineid, address, num_registers)
 
     def write_single_register(self, machineid, address, value):
-        with self._lock:
-            test = self.client.write_register(address=address, value=value, device_id=machineid)
-            print(test)
+        start = time.perf_counter() if self.trace is not None else None
+        outcome = 'ok'
+        try:
+            response = self._call('write_register', self.client.write_register,
+                                  address=address, value=value, device_id=machineid)
+            _LOGGER.debug('write response: %s', response)
+            if response.isError():
+                code = getattr(response, 'exception_code', None)
+                outcome = f'exception_code={code}'
+                raise ModbusError(f'Device {machineid} rejected the write to {address}: exception {code}', code)
+        except ModbusError:
+            raise
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if start is not None:
+                self.trace.record(self._label, machineid, 'write_register', address, 1,
+                                  time.perf_counter() - start, outcome)
     
+    def exception_code(self, machineid):
+        """
+        Modbus exception code of the last read of the device, None unless the
+        device answered it with an exception response.
+        """
+        return self._exception_codes.get(machineid)
+
     def __str__(self):
         return str(self.client)
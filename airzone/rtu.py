@@ -0,0 +1,373 @@
+""" Modbus RTU transport for serial (RS-485) buses.
+
+RtuBus exposes the Gateway interface over a serial line, speaking RTU framing
+itself with timings derived from the line settings:
+
+    bus = RtuBus('/dev/ttyUSB0', baudrate=9600)
+    machine = airzone_factory(None, None, 1, gateway=bus)
+
+Every device on the line shares one half-duplex bus, so transactions run one at
+a time, writes first and then reads in arrival order, each starting as soon as
+the 3.5 character silent interval after the previous frame is over. Response
+timeouts are computed from the frame sizes at the configured baud rate instead
+of a fixed TCP style timeout, so a missing device costs milliseconds.
+"""
+import heapq
+import itertools
+import logging
+import os
+import select
+import struct
+import time
+from threading import Condition
+
+from airzone.protocol import ModbusError
+
+_LOGGER = logging.getLogger(__name__)
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+WRITE_SINGLE_REGISTER = 6
+
+_WRITE, _READ = 0, 1
+
+_FUNCTION_NAMES = {
+    READ_HOLDING_REGISTERS: 'read_holding_registers',
+    READ_INPUT_REGISTERS: 'read_input_registers',
+    WRITE_SINGLE_REGISTER: 'write_register',
+}
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def frame(unit, pdu):
+    """
+    RTU frame: unit id, pdu and the crc, low byte first.
+    """
+    body = bytes([unit]) + pdu
+    return body + struct.pack('<H', crc16(body))
+
+
+def check_frame(data):
+    return len(data) >= 4 and crc16(data[:-2]) == struct.unpack('<H', data[-2:])[0]
+
+
+# Answer delay allowed to a device by default: TURNAROUND_CHARS character
+# times, at least MIN_TURNAROUND seconds for the processing time of the slave.
+TURNAROUND_CHARS = 20
+MIN_TURNAROUND = 0.01
+
+
+class RtuTiming():
+    """
+    Arguments:
+        baudrate, bytesize, parity, stopbits -- serial line settings
+        turnaround -- seconds a device may take to start answering, derived
+                      from the baud rate when None. Only waited for in full
+                      when the device doesn't answer.
+    """
+
+    def __init__(self, baudrate=9600, bytesize=8, parity='N', stopbits=1, turnaround=None):
+        self.baudrate = baudrate
+        self.bits_per_char = 1 + bytesize + (0 if parity == 'N' else 1) + stopbits
+        if turnaround is None:
+            turnaround = max(MIN_TURNAROUND, TURNAROUND_CHARS * self.char_time)
+        self.turnaround = turnaround
+
+    @property
+    def char_time(self):
+        return self.bits_per_char / self.baudrate
+
+    @property
+    def inter_frame(self):
+        # The spec fixes the silent interval above 19200 baud.
+        return 0.00175 if self.baudrate > 19200 else 3.5 * self.char_time
+
+    @property
+    def inter_char(self):
+        return 0.00075 if self.baudrate > 19200 else 1.5 * self.char_time
+
+    def frame_time(self, size):
+        return size * self.char_time
+
+    def timeout(self, request_size, response_size):
+        """
+        Time after which the answer of a transaction can't arrive anymore.
+        """
+        return (self.frame_time(request_size + response_size) + self.turnaround
+                + 2 * self.inter_frame)
+
+    def transaction_time(self, request_size, response_size):
+        """
+        Least bus time of a transaction, silent intervals included.
+        """
+        return self.frame_time(request_size + response_size) + 2 * self.inter_frame
+
+
+def response_size(function, count):
+    if function == WRITE_SINGLE_REGISTER:
+        return 8
+    return 5 + 2 * count
+
+
+class BusStats():
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.frames = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.busy = 0.0
+        self.wire = 0.0
+
+    def as_dict(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'frames': self.frames,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'frames_per_second': self.frames / elapsed,
+            # share of the elapsed time spent in transactions
+            'bus_utilization': self.busy / elapsed,
+            # share of the transactions time spent transmitting bytes
+            'wire_efficiency': self.wire / self.busy if self.busy else 0.0,
+        }
+
+
+def open_serial(port, baudrate, bytesize=8, parity='N', stopbits=1):
+    """
+    Opens the tty in raw mode with the line settings.
+    """
+    import termios
+    import tty
+
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        speed = getattr(termios, f'B{baudrate}')
+        attrs[4] = attrs[5] = speed
+        cflag = attrs[2] & ~(termios.CSIZE | termios.PARENB | termios.PARODD | termios.CSTOPB)
+        cflag |= {5: termios.CS5, 6: termios.CS6, 7: termios.CS7, 8: termios.CS8}[bytesize]
+        cflag |= termios.CLOCAL | termios.CREAD
+        if parity in ('E', 'O'):
+            cflag |= termios.PARENB
+        if parity == 'O':
+            cflag |= termios.PARODD
+        if stopbits == 2:
+            cflag |= termios.CSTOPB
+        attrs[2] = cflag
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        termios.tcflush(fd, termios.TCIOFLUSH)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+
+class RtuBus():
+    """
+    Arguments:
+        port -- serial device path
+        baudrate, bytesize, parity, stopbits -- serial line settings
+        turnaround -- seconds a device may take to start answering, derived
+                      from the baud rate when None
+        retries -- extra attempts of a transaction that got no valid answer
+        trace -- optional TransactionTrace recording every transaction
+    """
+
+    profiler = None
+
+    def __init__(self, port, baudrate=9600, bytesize=8, parity='N', stopbits=1,
+                 turnaround=None, retries=1, trace=None):
+        self.port = port
+        self.timing = RtuTiming(baudrate, bytesize, parity, stopbits, turnaround)
+        self.retries = retries
+        self.trace = trace
+        self._label = str(self)
+        self._fd = open_serial(port, baudrate, bytesize, parity, stopbits)
+        self._bus = Condition()
+        self._busy = False
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._idle_since = 0.0
+        self._exception_codes = {}
+        self.bus_stats = BusStats()
+
+    def _acquire(self, priority):
+        ticket = (priority, next(self._tickets))
+        with self._bus:
+            heapq.heappush(self._waiting, ticket)
+            while self._busy or self._waiting[0] != ticket:
+                self._bus.wait()
+            heapq.heappop(self._waiting)
+            self._busy = True
+
+    def _release(self):
+        with self._bus:
+            self._busy = False
+            self._bus.notify_all()
+
+    def _read_exactly(self, size, deadline):
+        data = b''
+        while len(data) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                break
+            chunk = os.read(self._fd, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _write_all(self, data, deadline):
+        """
+        Writes the whole frame, os.write may take only part of it.
+        """
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                written = 0
+            if written:
+                view = view[written:]
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([], [self._fd], [], remaining)[1]:
+                raise TimeoutError(f'Could not write the request to {self.port}')
+
+    def _drain(self):
+        while select.select([self._fd], [], [], 0)[0]:
+            if not os.read(self._fd, 256):
+                return
+
+    def _transact(self, unit, pdu, expected):
+        """
+        Sends one request and returns the response pdu, or None without a
+        valid answer. Called holding the bus.
+        """
+        request = frame(unit, pdu)
+        gap = self._idle_since + self.timing.inter_frame - time.monotonic()
+        if gap > 0:
+            time.sleep(gap)
+        self._drain()
+        self._write_all(request, time.monotonic() + self.timing.timeout(len(request), 0))
+        deadline = time.monotonic() + self.timing.timeout(len(request), expected)
+        try:
+            header = self._read_exactly(2, deadline)
+            if len(header) < 2:
+                self.bus_stats.timeouts += 1
+                return None
+            # exception responses are unit, function | 0x80, code and crc
+            size = 5 if header[1] & 0x80 else expected
+            data = header + self._read_exactly(size - 2, deadline)
+            if len(data) < size or not check_frame(data) or data[0] != unit:
+                self.bus_stats.errors += 1
+                return None
+            self.bus_stats.frames += 2
+            self.bus_stats.wire += self.timing.frame_time(len(request) + len(data))
+            return data[1:-2]
+        finally:
+            self._idle_since = time.monotonic()
+
+    def _execute(self, priority, unit, function, pdu, expected):
+        profiler = self.profiler
+        if profiler is not None and not profiler.active():
+            profiler = None
+        waited = time.perf_counter() if profiler is not None else None
+        self._acquire(priority)
+        acquired = time.perf_counter() if profiler is not None else None
+        start = time.monotonic()
+        try:
+            for _ in range(self.retries + 1):
+                response = self._transact(unit, pdu, expected)
+                if response is not None:
+                    return response
+            return None
+        finally:
+            self.bus_stats.busy += time.monotonic() - start
+            if profiler is not None:
+                profiler.record_transaction(_FUNCTION_NAMES[function], acquired - waited,
+                                            time.perf_counter() - acquired)
+            self._release()
+
+    def _read(self, function, machineid, address, num_registers):
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            pdu = struct.pack('>BHH', function, address, num_registers)
+            response = self._execute(_READ, machineid, function, pdu,
+                                     response_size(function, num_registers))
+            if response is None:
+                outcome = 'timeout'
+                self._exception_codes.pop(machineid, None)
+                return None
+            if response[0] & 0x80:
+                outcome = f'exception_code={response[1]}'
+                self._exception_codes[machineid] = response[1]
+                return None
+            self._exception_codes.pop(machineid, None)
+            _LOGGER.debug('response: %s', response)
+            return list(struct.unpack(f'>{num_registers}H', response[2:]))
+        except Exception as e:
+            outcome = type(e).__name__
+            self._exception_codes.pop(machineid, None)
+            _LOGGER.exception('Error reading from %s', self)
+            return None
+        finally:
+            if self.trace is not None:
+                self.trace.record(self._label, machineid, _FUNCTION_NAMES[function], address, num_registers,
+                                  time.perf_counter() - start, outcome)
+
+    def read_holding_registers(self, machineid, address, num_registers):
+        return self._read(READ_HOLDING_REGISTERS, machineid, address, num_registers)
+
+    def read_input_registers(self, machineid, address, num_registers):
+        return self._read(READ_INPUT_REGISTERS, machineid, address, num_registers)
+
+    def write_single_register(self, machineid, address, value):
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            pdu = struct.pack('>BHH', WRITE_SINGLE_REGISTER, address, value)
+            response = self._execute(_WRITE, machineid, WRITE_SINGLE_REGISTER, pdu,
+                                     response_size(WRITE_SINGLE_REGISTER, 1))
+            if response is None:
+                outcome = 'timeout'
+                raise TimeoutError(f'No answer from device {machineid} on {self.port}')
+            if response[0] & 0x80:
+                outcome = f'exception_code={response[1]}'
+                raise ModbusError(f'Device {machineid} rejected the write to {address}: exception {response[1]}',
+                                  response[1])
+        finally:
+            if self.trace is not None:
+                self.trace.record(self._label, machineid, 'write_register', address, 1,
+                                  time.perf_counter() - start, outcome)
+
+    def exception_code(self, machineid):
+        return self._exception_codes.get(machineid)
+
+    def stats(self):
+        """
+        Frames, errors, timeouts, frames per second and bus utilization.
+        """
+        return self.bus_stats.as_dict()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __str__(self):
+        return f'RtuBus_{self.port}'
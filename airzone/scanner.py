@@ -0,0 +1,176 @@
+""" Device id discovery on a modbus gateway.
+
+Probes a range of device ids with short timeouts over a bounded pool of
+connections and classifies every responder by its register layout.
+"""
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from airzone.aido import OperationMode as AidoOperationMode
+from airzone.innobus import OperationMode as InnobusOperationMode
+from airzone.protocol import modbus_factory
+
+_LOGGER = logging.getLogger(__name__)
+
+INNOBUS_STATE_REGISTERS = 21
+AIDO_STATE_REGISTERS = 7
+
+_INNOBUS_MODES = {m.value for m in InnobusOperationMode}
+_AIDO_MODES = {m.value for m in AidoOperationMode}
+
+
+class MachineSpec(namedtuple('MachineSpec', ['address', 'port', 'machineId', 'system', 'options'])):
+    """
+    Arguments needed by airzone_factory to build a discovered machine.
+    """
+
+    def build(self, **kwargs):
+        from airzone import airzone_factory
+        options = dict(self.options)
+        options.update(kwargs)
+        return airzone_factory(self.address, self.port, self.machineId, self.system, **options)
+
+
+ProbeResult = namedtuple('ProbeResult', ['machineId', 'system', 'registers'])
+
+
+def _is_innobus(state):
+    if state is None or len(state) != INNOBUS_STATE_REGISTERS:
+        return False
+    zones_lo, zones_hi = state[9], state[10]
+    return state[0] in _INNOBUS_MODES and bool(zones_lo or zones_hi) \
+        and zones_lo <= 0xFF and zones_hi <= 0xFF
+
+
+def _is_aido(state):
+    return state is not None and len(state) >= AIDO_STATE_REGISTERS and state[0] in (0, 1) \
+        and state[3] in _AIDO_MODES and state[5] <= 10
+
+
+def _first_zone(innobus_state):
+    """
+    Lowest zone id of the innobus zone mask.
+    """
+    mask = innobus_state[9] | innobus_state[10] << 8
+    return (mask & -mask).bit_length()
+
+
+def classify(innobus_state, aido_state, zone_answered=True):
+    """
+    Guesses the system from the registers read at address 0.
+    Arguments:
+        innobus_state -- the 21 machine registers of an innobus, or None
+        aido_state -- the 7 state registers of an Aido, or None
+        zone_answered -- whether the device answered a read of its first
+                         zone, which tells the layouts apart when both fit
+    """
+    innobus, aido = _is_innobus(innobus_state), _is_aido(aido_state)
+    if innobus and aido:
+        return 'innobus' if zone_answered else 'aido'
+    if innobus:
+        return 'innobus'
+    if aido:
+        return 'aido'
+    return None
+
+
+def _read(client, device_id, count, address=0):
+    try:
+        response = client.read_input_registers(address=address, count=count, device_id=device_id)
+    except Exception:
+        return None
+    if response is None or response.isError():
+        return None
+    return list(response.registers)
+
+
+class Scanner():
+    """
+    Arguments:
+        address, port -- modbus gateway to scan
+        timeout -- seconds to wait for every probe
+        concurrency -- number of connections probing in parallel
+        client_factory -- optional callable returning a new modbus client
+    """
+
+    def __init__(self, address, port, timeout=0.3, concurrency=16,
+                 use_rtu_framer=False, client_factory=None):
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.use_rtu_framer = use_rtu_framer
+        if client_factory is None:
+            def client_factory():
+                return modbus_factory(address, port, use_rtu_framer,
+                                      timeout=timeout, retries=0)
+        self._client_factory = client_factory
+        self._local = threading.local()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._client_factory()
+            client.connect()
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def probe(self, device_id):
+        """
+        Returns a ProbeResult, or None when the device does not answer.
+        """
+        client = self._client()
+        innobus_state = _read(client, device_id, INNOBUS_STATE_REGISTERS)
+        if innobus_state is not None:
+            # an Aido may answer the wide read too, its layout is the head of it
+            aido_state = innobus_state[:AIDO_STATE_REGISTERS]
+        else:
+            aido_state = _read(client, device_id, AIDO_STATE_REGISTERS)
+            if aido_state is None:
+                return None
+        zone_answered = True
+        if _is_innobus(innobus_state) and _is_aido(aido_state):
+            # only an innobus has zone registers
+            zone_answered = _read(client, device_id, 1, _first_zone(innobus_state) * 256) is not None
+        system = classify(innobus_state, aido_state, zone_answered)
+        registers = aido_state if system == 'aido' else innobus_state or aido_state
+        return ProbeResult(device_id, system, registers)
+
+    def probe_all(self, device_ids=range(1, 248)):
+        """
+        Probes every device id and returns the ProbeResult of the responders.
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                results = list(executor.map(self.probe, device_ids))
+        finally:
+            with self._clients_lock:
+                for client in self._clients:
+                    client.close()
+                self._clients = []
+        return [r for r in results if r is not None]
+
+    def scan(self, device_ids=range(1, 248)):
+        """
+        Returns a MachineSpec for every responder with a known layout.
+        """
+        options = {'use_rtu_framer': self.use_rtu_framer}
+        specs = []
+        for result in self.probe_all(device_ids):
+            if result.system is None:
+                _LOGGER.info('Device %s answered with an unknown layout: %s',
+                             result.machineId, result.registers)
+                continue
+            specs.append(MachineSpec(self.address, self.port, result.machineId,
+                                     result.system, options))
+        return specs
+
+
+def scan(address, port, device_ids=range(1, 248), **kwargs):
+    return Scanner(address, port, **kwargs).scan(device_ids)
@@ -0,0 +1,275 @@
+""" Comfort schedules applied with as few writes as possible.
+
+Every tick the engine computes the settings each zone should have, diffs them
+against the zone cached snapshot and only writes what differs: one register
+write per changed innobus register (zone mode and fan speed share register 0)
+and one localapi request per zone. Zones are written spread over a window, and
+every gateway has a write budget, so the top of the hour doesn't flood a bus:
+
+    scheduler = Scheduler([
+        ScheduleEntry('07:00', {'setpoint': 21, 'zone_mode': 'MANUAL'}, days=range(5)),
+        ScheduleEntry('22:00', {'setpoint': 18, 'zone_mode': 'MANUAL_SLEEP'}),
+    ], zones, spread=120)
+    scheduler.start()
+
+Settings: setpoint (degrees), zone_mode and speed (innobus ZoneMode and
+FancoilSpeed names), on (localapi zones).
+"""
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from collections import namedtuple
+from threading import Event, Lock, Thread
+
+from airzone.polling import TransactionBudget, gateway_of
+from airzone.protocol import change_range_bit_value
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _parse_time(value):
+    if isinstance(value, datetime.time):
+        return value
+    return datetime.time.fromisoformat(value)
+
+
+class ScheduleEntry(namedtuple('ScheduleEntry', ['at', 'settings', 'days', 'zones'])):
+    """
+    Settings in force from `at` until a later entry changes them.
+    Arguments:
+        at -- datetime.time or 'HH:MM'
+        settings -- dict of the settings to apply
+        days -- weekdays (0 is monday) the entry applies to, every day if None
+        zones -- predicate selecting the zones of the entry, every zone if None
+    """
+    __slots__ = ()
+
+    def __new__(cls, at, settings, days=None, zones=None):
+        return super().__new__(cls, _parse_time(at), dict(settings),
+                               None if days is None else frozenset(days), zones)
+
+    def applies(self, zone, weekday):
+        return (self.days is None or weekday in self.days) and \
+            (self.zones is None or self.zones(zone))
+
+
+def desired_settings(entries, zone, now):
+    """
+    Settings in force for the zone at `now`: every setting comes from the last
+    entry that set it, looking back up to a week. Entries whose selector fails
+    on the zone are skipped.
+    """
+    settings = {}
+    ordered = sorted(entries, key=lambda e: e.at, reverse=True)
+    broken = set()
+    for days_back in range(8):
+        day = now - datetime.timedelta(days=days_back)
+        for entry in ordered:
+            if (days_back == 0 and entry.at > now.time()) or id(entry) in broken:
+                continue
+            try:
+                applies = entry.applies(zone, day.weekday())
+            except Exception as e:
+                broken.add(id(entry))
+                _LOGGER.warning('Schedule entry at %s skipped for %s: %r', entry.at, zone, e)
+                continue
+            if applies:
+                for key, value in entry.settings.items():
+                    settings.setdefault(key, value)
+    return settings
+
+
+def _innobus_writes(zone, desired):
+    from airzone.innobus import FancoilSpeed, ZoneMode
+    state = zone.zone_state
+    if state is None:
+        return []
+    writes = []
+    register = state[0]
+    if 'zone_mode' in desired:
+        register = change_range_bit_value([register], 0, 0, 2, ZoneMode[desired['zone_mode']].value)
+    if 'speed' in desired:
+        register = change_range_bit_value([register], 0, 4, 2, FancoilSpeed[desired['speed']].value)
+    if register != state[0]:
+        writes.append((0, register))
+    if 'setpoint' in desired:
+        setpoint = int(round(desired['setpoint'] * 10))
+        if setpoint != state[3]:
+            writes.append((3, setpoint))
+    return writes
+
+
+def _localapi_writes(zone, desired):
+    record = zone.record
+    if record is None:
+        return []
+    parameters = {}
+    if 'setpoint' in desired and desired['setpoint'] != record.setpoint:
+        parameters['setpoint'] = desired['setpoint']
+    if 'on' in desired and int(bool(desired['on'])) != record.on:
+        parameters['on'] = int(bool(desired['on']))
+    return [parameters] if parameters else []
+
+
+def plan_writes(zone, desired):
+    """
+    Writes bringing the cached state of the zone to the desired settings:
+    (register, value) pairs for innobus zones, a parameters dict for localapi.
+    """
+    if hasattr(zone, 'base_zone'):
+        return _innobus_writes(zone, desired)
+    return _localapi_writes(zone, desired)
+
+
+def apply_writes(zone, writes):
+    for write in writes:
+        if hasattr(zone, 'base_zone'):
+            zone.write_register(*write)
+        else:
+            zone._api.set_zone_parameters(zone._machine_id, zone._zone_id, write)
+
+
+class Scheduler():
+    """
+    Arguments:
+        entries -- ScheduleEntry objects
+        zones -- innobus or localapi zones the schedule controls
+        spread -- seconds over which the zone writes of a tick are spread
+        writes_per_second -- write budget of every gateway or webserver
+        now -- returns the local datetime the schedule is evaluated at
+    """
+
+    def __init__(self, entries, zones, spread=60, writes_per_second=2,
+                 now=datetime.datetime.now, clock=time.monotonic):
+        self.entries = list(entries)
+        self.zones = list(zones)
+        self.spread = spread
+        self.writes_per_second = writes_per_second
+        self._now = now
+        self._clock = clock
+        self._budgets = {}
+        self._heap = []
+        self._queued = set()
+        self._applied = {}
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self.writes = 0
+        self.skipped = 0
+
+    def _budget(self, zone):
+        gateway = gateway_of(zone)
+        if id(gateway) not in self._budgets:
+            self._budgets[id(gateway)] = TransactionBudget(self.writes_per_second)
+        return self._budgets[id(gateway)]
+
+    def tick(self):
+        """
+        Queues the zones whose cached state differs from the schedule, each at
+        its own offset in the spread window. Returns the number queued.
+        """
+        now = self._now()
+        start = self._clock()
+        count = len(self.zones)
+        queued = 0
+        with self._lock:
+            for index, zone in enumerate(self.zones):
+                if id(zone) in self._queued:
+                    continue
+                try:
+                    desired = desired_settings(self.entries, zone, now)
+                    if not self._pending(zone, desired):
+                        continue
+                except Exception:
+                    # e.g. a mode name unknown to the zone, the others go on
+                    _LOGGER.exception('Error evaluating the schedule of %s', zone)
+                    continue
+                due = start + self.spread * index / count
+                heapq.heappush(self._heap, (due, next(self._seq), zone, desired))
+                self._queued.add(id(zone))
+                queued += 1
+        return queued
+
+    def _pending(self, zone, desired):
+        writes = plan_writes(zone, desired)
+        if not writes:
+            return []
+        # Writes don't publish snapshots: until the zone is refreshed the cache
+        # still shows the old values, don't repeat what was already written.
+        if self._applied.get(id(zone)) == (zone.snapshot.version, writes):
+            return []
+        return writes
+
+    def run_pending(self):
+        """
+        Writes the queued zones that are due, within the gateway budgets.
+        Returns the number of writes sent.
+        """
+        sent = 0
+        while True:
+            now = self._clock()
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    return sent
+                due, _, zone, desired = heapq.heappop(self._heap)
+                try:
+                    writes = self._pending(zone, desired)
+                except Exception:
+                    _LOGGER.exception('Error planning the schedule writes of %s', zone)
+                    self._queued.discard(id(zone))
+                    continue
+                budget = self._budget(zone)
+                if writes and not budget.try_acquire(now, len(writes)):
+                    delay = max(budget.delay(now, len(writes)), 0.01)
+                    heapq.heappush(self._heap, (now + delay, next(self._seq), zone, desired))
+                    continue
+                self._queued.discard(id(zone))
+                if not writes:
+                    self.skipped += 1
+                    continue
+                self._applied[id(zone)] = (zone.snapshot.version, writes)
+            try:
+                apply_writes(zone, writes)
+                sent += len(writes)
+                self.writes += len(writes)
+            except Exception:
+                _LOGGER.exception('Error applying the schedule to %s', zone)
+                with self._lock:
+                    self._applied.pop(id(zone), None)
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def run(self, interval=60):
+        """
+        Ticks every `interval` seconds and sends writes as they become due,
+        until stop() is called.
+        """
+        self._stop.clear()
+        next_tick = self._clock()
+        while not self._stop.is_set():
+            now = self._clock()
+            try:
+                if now >= next_tick:
+                    next_tick = now + interval
+                    self.tick()
+                self.run_pending()
+            except Exception:
+                _LOGGER.exception('Error running the schedule')
+            due = self.next_due()
+            wake = next_tick if due is None else min(next_tick, due)
+            self._stop.wait(max(0.0, wake - self._clock()))
+
+    def start(self, interval=60):
+        self._thread = Thread(target=self.run, args=(interval,), name='airzone-schedule', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
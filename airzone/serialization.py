@@ -0,0 +1,72 @@
+""" Structured export of machine state.
+
+to_dict() decodes every field of a machine and its zones into a stable schema,
+to_bytes() is its compact json encoding. Both are cached per snapshot version,
+so serving the same state many times costs a single decode and encode.
+"""
+import json
+from abc import ABC, abstractmethod
+
+from airzone.snapshot import freeze
+
+SCHEMA_VERSION = 1
+
+_EMPTY_CACHE = (None, None, None)
+
+
+def encode(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+
+
+def enum_name(value):
+    return None if value is None else value.name
+
+
+class Exportable(ABC):
+    """
+    Mixin providing to_dict/to_bytes. Subclasses implement _export_key, which
+    changes whenever any snapshot involved changes, and _export, which decodes
+    the current state into plain dicts, lists and scalars.
+    """
+
+    _export_cache = _EMPTY_CACHE
+
+    @abstractmethod
+    def _export_key(self):
+        pass
+
+    @abstractmethod
+    def _export(self):
+        pass
+
+    def to_dict(self, retries=3):
+        """
+        Decoded state as a read only dict.
+        """
+        key, data, _ = self._export_cache
+        current = self._export_key()
+        if key == current and data is not None:
+            return data
+        for _ in range(retries):
+            data = freeze(self._export())
+            # A refresh may publish new snapshots while decoding, retry so the
+            # cached data matches the key it is stored under.
+            after = self._export_key()
+            if after == current:
+                break
+            current = after
+        self._export_cache = (current, data, None)
+        return data
+
+    def to_bytes(self):
+        """
+        Compact json encoding of to_dict().
+        """
+        data = self.to_dict()
+        key, cached_data, encoded = self._export_cache
+        if encoded is not None and cached_data is data:
+            return encoded
+        encoded = encode(data)
+        if cached_data is data:
+            self._export_cache = (key, data, encoded)
+        return encoded
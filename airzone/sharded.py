@@ -0,0 +1,308 @@
+""" Multi-process sharded polling.
+
+Gateways are spread over worker processes. Every worker polls the raw registers
+of its machines and publishes them into its own shared memory ring buffer, which
+the parent process reads without copying or locking. Every slot is guarded by a
+sequence number (seqlock): odd while the worker writes it, 2 * (record + 1) once
+the record is complete, so readers detect torn or overwritten records.
+"""
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+from airzone.utils import bitfield, true_in_list
+
+_LOGGER = logging.getLogger(__name__)
+
+INNOBUS_STATE_REGISTERS = 21
+INNOBUS_ZONE_REGISTERS = 13
+AIDO_STATE_REGISTERS = 7
+
+_HEADER = struct.Struct('<QII')  # records published, slots, width
+_SLOT = struct.Struct('<QdHHHH')  # seq, timestamp, target, device id, address, count
+
+Record = namedtuple('Record', ['seq', 'timestamp', 'target', 'device_id', 'address', 'registers'])
+
+
+class GatewaySpec(namedtuple('GatewaySpec', ['address', 'port', 'machine_ids', 'system', 'options'])):
+    """
+    A gateway to poll in a worker process and the machines behind it.
+    """
+
+    def __new__(cls, address, port, machine_ids, system='innobus', options=None):
+        return super().__new__(cls, address, port, tuple(machine_ids), system, dict(options or {}))
+
+
+# Blocks created by this process, attaching to them shares the owner's tracker.
+_created = set()
+
+
+def _attach(name, shared_tracker=False):
+    """
+    Attaches to a block created by another process without leaving it to the
+    resource tracker of this one, which would unlink it when this process exits.
+    A process sharing the tracker of the owner, as its workers do, leaves the
+    registration alone: it is the owner's.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Only posix blocks are tracked, under the name passed to shm_open.
+    if os.name == 'posix' and not shared_tracker and name not in _created:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(f'/{name}', 'shared_memory')
+    return shm
+
+
+def default_gateway_factory(spec):
+    from airzone.protocol import Gateway, modbus_factory
+    return Gateway(modbus_factory(spec.address, spec.port, spec.options.get('use_rtu_framer', False)))
+
+
+class SnapshotRing():
+    """
+    Single producer ring of register snapshots in shared memory.
+    Arguments:
+        name -- shared memory block to attach to, None to create a new one
+        slots -- number of records kept
+        width -- maximum number of registers of a record
+        shared_tracker -- when attaching, whether this process shares the
+                          resource tracker of the owner, as its workers do
+    """
+
+    def __init__(self, name=None, slots=1024, width=INNOBUS_STATE_REGISTERS, shared_tracker=False):
+        self._owner = name is None
+        if self._owner:
+            self.slots = slots
+            self.width = width
+            size = _HEADER.size + slots * self._slot_size(width)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            _created.add(self._shm.name)
+            _HEADER.pack_into(self._shm.buf, 0, 0, slots, width)
+        else:
+            self._shm = _attach(name, shared_tracker)
+            _, self.slots, self.width = _HEADER.unpack_from(self._shm.buf, 0)
+        self._slot_size_bytes = self._slot_size(self.width)
+
+    @staticmethod
+    def _slot_size(width):
+        size = _SLOT.size + 2 * width
+        return size + (-size) % 8
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def head(self):
+        """
+        Number of records published so far.
+        """
+        return _HEADER.unpack_from(self._shm.buf, 0)[0]
+
+    def _offset(self, record):
+        return _HEADER.size + (record % self.slots) * self._slot_size_bytes
+
+    def publish(self, target, device_id, address, registers, timestamp=None):
+        count = len(registers)
+        if count > self.width:
+            raise ValueError(f'{count} registers do not fit in a slot of {self.width}')
+        buf = self._shm.buf
+        record = self.head
+        offset = self._offset(record)
+        _SLOT.pack_into(buf, offset, 2 * record + 1, 0.0, 0, 0, 0, 0)
+        struct.pack_into(f'<{count}H', buf, offset + _SLOT.size, *registers)
+        _SLOT.pack_into(buf, offset, 2 * record + 1, timestamp or time.time(),
+                        target, device_id, address, count)
+        struct.pack_into('<Q', buf, offset, 2 * record + 2)
+        struct.pack_into('<Q', buf, 0, record + 1)
+        return record
+
+    def _seq(self, offset):
+        return struct.unpack_from('<Q', self._shm.buf, offset)[0]
+
+    def is_current(self, record):
+        """
+        True while the slot still holds the complete record.
+        """
+        return self._seq(self._offset(record)) == 2 * record + 2
+
+    @contextmanager
+    def view(self, record):
+        """
+        Zero copy view of the registers of a record, None when the record was
+        overwritten. The view is released when the block exits, check
+        is_current(record) after consuming it:
+
+            with ring.view(record) as registers:
+                total = sum(registers)
+                valid = ring.is_current(record)
+        """
+        offset = self._offset(record)
+        if self._seq(offset) != 2 * record + 2:
+            yield None
+            return
+        count = _SLOT.unpack_from(self._shm.buf, offset)[5]
+        start = offset + _SLOT.size
+        with self._shm.buf[start:start + 2 * count] as data, data.cast('H') as registers:
+            yield registers
+
+    def read(self, record, retries=100):
+        """
+        Consistent copy of a record, or None when it was overwritten.
+        """
+        buf = self._shm.buf
+        offset = self._offset(record)
+        for _ in range(retries):
+            seq, timestamp, target, device_id, address, count = _SLOT.unpack_from(buf, offset)
+            if seq > 2 * record + 2:
+                return None
+            if seq != 2 * record + 2:
+                time.sleep(0)
+                continue
+            registers = struct.unpack_from(f'<{count}H', buf, offset + _SLOT.size)
+            if self._seq(offset) == seq:
+                return Record(record, timestamp, target, device_id, address, registers)
+        return None
+
+    def records(self, start=0):
+        """
+        Yields the records published from `start` that are still in the ring.
+        """
+        head = self.head
+        for record in range(max(start, head - self.slots), head):
+            r = self.read(record)
+            if r is not None:
+                yield r
+
+    def latest(self):
+        """
+        Last record of every (target, device id, address) still in the ring.
+        """
+        return {(r.target, r.device_id, r.address): r for r in self.records()}
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            _created.discard(self._shm.name)
+            self._shm.unlink()
+
+
+def poll_gateway(ring, target, gateway, spec):
+    """
+    Publishes one raw snapshot of every machine of the spec.
+    """
+    for machine_id in spec.machine_ids:
+        if spec.system == 'aido':
+            state = gateway.read_input_registers(machine_id, 0, AIDO_STATE_REGISTERS)
+            if state is not None:
+                ring.publish(target, machine_id, 0, state)
+            continue
+        state = gateway.read_input_registers(machine_id, 0, INNOBUS_STATE_REGISTERS)
+        if state is None:
+            continue
+        ring.publish(target, machine_id, 0, state)
+        zones = true_in_list(list(reversed(bitfield(state[9])))) + \
+            [v + 8 for v in true_in_list(list(reversed(bitfield(state[10]))))]
+        for zone in zones:
+            base = (zone + 1) * 256
+            zone_state = gateway.read_input_registers(machine_id, base, INNOBUS_ZONE_REGISTERS)
+            if zone_state is not None:
+                ring.publish(target, machine_id, base, zone_state)
+
+
+def _worker(ring_name, targets, interval, stop, gateway_factory):
+    ring = SnapshotRing(ring_name, shared_tracker=True)
+    try:
+        gateways = [(target, gateway_factory(spec), spec) for target, spec in targets]
+        while not stop.is_set():
+            start = time.monotonic()
+            for target, gateway, spec in gateways:
+                try:
+                    poll_gateway(ring, target, gateway, spec)
+                except Exception:
+                    _LOGGER.exception('Error polling %s', spec.address)
+            stop.wait(max(0.0, interval - (time.monotonic() - start)))
+    finally:
+        ring.close()
+
+
+class ShardedPoller():
+    """
+    Polls the gateway specs over a pool of worker processes.
+    Arguments:
+        specs -- list of GatewaySpec
+        processes -- number of workers, one per core by default
+        interval -- seconds between two sweeps of a worker
+        slots -- records kept in the ring of every worker
+        gateway_factory -- picklable callable building a Gateway from a spec
+    """
+
+    def __init__(self, specs, processes=None, interval=5, slots=1024,
+                 gateway_factory=default_gateway_factory):
+        self.specs = list(specs)
+        self.processes = min(processes or multiprocessing.cpu_count(), max(len(self.specs), 1))
+        self.interval = interval
+        self.slots = slots
+        self.gateway_factory = gateway_factory
+        self._rings = []
+        self._workers = []
+        self._stop = None
+
+    def shards(self):
+        """
+        Target indexes assigned to every worker.
+        """
+        return [list(range(i, len(self.specs), self.processes)) for i in range(self.processes)]
+
+    def start(self):
+        ctx = multiprocessing.get_context()
+        self._stop = ctx.Event()
+        for shard in self.shards():
+            ring = SnapshotRing(slots=self.slots)
+            targets = [(t, self.specs[t]) for t in shard]
+            worker = ctx.Process(target=_worker, name=f'airzone-shard-{len(self._workers)}',
+                                 args=(ring.name, targets, self.interval, self._stop,
+                                       self.gateway_factory),
+                                 daemon=True)
+            worker.start()
+            self._rings.append(ring)
+            self._workers.append(worker)
+
+    @property
+    def rings(self):
+        return list(self._rings)
+
+    def snapshots(self):
+        """
+        Latest registers indexed by (address, port, device id, register address).
+        """
+        result = {}
+        for ring in self._rings:
+            for (target, device_id, address), record in ring.latest().items():
+                spec = self.specs[target]
+                result[(spec.address, spec.port, device_id, address)] = record
+        return result
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+        for worker in self._workers:
+            worker.join()
+        for ring in self._rings:
+            ring.close()
+        self._rings = []
+        self._workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
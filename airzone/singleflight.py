@@ -0,0 +1,78 @@
+""" Single-flight deduplication of concurrent calls.
+
+Callers arriving while a call with the same key is running don't start their
+own: they wait for it and get its result, or its exception. The refresh load on
+the bus or webserver then depends on how often fresh data is needed, not on how
+many threads ask for it.
+"""
+import functools
+from threading import Event, Lock
+
+
+class _Call():
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self.executions = 0
+        self.shared = 0
+
+    def in_flight(self, key):
+        return key in self._calls
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Runs func unless a call with the same key is in flight, in which case
+        its outcome is shared.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def flights_of(obj):
+    """
+    The SingleFlight group of an object, created on first use.
+    """
+    # dict.setdefault is atomic, concurrent first calls get the same group.
+    return obj.__dict__.get('_single_flight') or obj.__dict__.setdefault('_single_flight', SingleFlight())
+
+
+def single_flight(method):
+    """
+    Decorates a method so concurrent calls on the same object with the same
+    arguments share one execution.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        return flights_of(self).do(key, method, self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,59 @@
+""" Immutable, versioned state snapshots.
+
+Every refresh publishes a new Snapshot and swaps the reference held by the
+Machine or Zone. Assigning an attribute is atomic, so reader threads that take
+`obj.snapshot` once get a consistent view without locks, whatever the poller
+publishes meanwhile.
+"""
+import itertools
+import time
+from collections import namedtuple
+
+_versions = itertools.count(1)
+
+
+class FrozenDict(dict):
+    """
+    Read only dict. Still a dict, so it serializes to json as before.
+    """
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Snapshot state is read only, publish a new snapshot instead')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(state):
+    """
+    Deep copies the state into immutable containers: lists become tuples and
+    dicts become FrozenDict.
+    """
+    if isinstance(state, dict):
+        return FrozenDict((k, freeze(v)) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return tuple(freeze(v) for v in state)
+    return state
+
+
+class Snapshot(namedtuple('Snapshot', ['version', 'timestamp', 'state', 'record'])):
+    """
+    State published by one refresh.
+    Arguments:
+        version -- increases with every snapshot published in the process
+        timestamp -- time.time() of the publication
+        state -- the frozen raw state (registers or localapi json)
+        record -- optional decoded view of the state, published along with it
+    """
+    __slots__ = ()
+
+
+EMPTY = Snapshot(0, None, None, None)
+
+
+def publish(state, record=None):
+    return Snapshot(next(_versions), time.time(), freeze(state), record)
@@ -0,0 +1,56 @@
+""" Bounded in-memory trace of wire level transactions.
+
+Gateways and localapi APIs record every transaction into an optional
+TransactionTrace. Nothing is formatted or logged until the trace is dumped, so
+keeping one enabled in the field costs one tuple append per transaction.
+"""
+import time
+from collections import deque, namedtuple
+from threading import Lock
+
+Transaction = namedtuple('Transaction', ['timestamp', 'target', 'device', 'function',
+                                         'address', 'count', 'duration', 'outcome'])
+
+
+class TransactionTrace():
+    """
+    Ring buffer keeping the last `maxlen` transactions.
+    """
+
+    def __init__(self, maxlen=1024):
+        self._transactions = deque(maxlen=maxlen)
+        self._lock = Lock()
+
+    @property
+    def maxlen(self):
+        return self._transactions.maxlen
+
+    def record(self, target, device, function, address, count, duration, outcome='ok'):
+        self._transactions.append(
+            Transaction(time.time(), target, device, function, address, count, duration, outcome))
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def snapshot(self):
+        """
+        Copy of the recorded transactions, oldest first.
+        """
+        with self._lock:
+            return list(self._transactions)
+
+    def dump(self):
+        return [t._asdict() for t in self.snapshot()]
+
+    def format(self):
+        lines = []
+        for t in self.snapshot():
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t.timestamp))
+            lines.append(f'{stamp}.{int(t.timestamp % 1 * 1000):03d} {t.target} device={t.device} '
+                         f'{t.function} address={t.address} count={t.count} '
+                         f'{t.duration * 1000:.1f}ms {t.outcome}')
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._transactions.clear()
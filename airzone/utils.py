@@ -1,4 +1,23 @@
-import base64
+import functools
+import warnings
+
+
+def deprecated(reason):
+    '''
+    Marks a function as deprecated, emitting a DeprecationWarning on every call.
+    Lightweight replacement of the decorator of the Python-Deprecated package.
+    '''
+    def decorator(func):
+        message = f"Call to deprecated function {func.__name__} ({reason})."
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with warnings.catch_warnings():
+                warnings.simplefilter('always', DeprecationWarning)
+                warnings.warn(message, category=DeprecationWarning, stacklevel=2)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
 
 def bitfield(n):
     '''
@@ -0,0 +1,112 @@
+""" Vectorized decoding of innobus zone registers.
+
+Stacks many zone snapshots into a (zones, 13) uint16 matrix and decodes every
+field as a whole column with shifts and masks. Requires numpy.
+"""
+try:
+    import numpy as np  # type: ignore
+except ImportError as e:  # pragma: no cover
+    raise ImportError('airzone.vectorized requires numpy: pip install python-airzone[numpy]') from e
+
+from airzone.innobus import (FancoilSpeed, GridAngle, GridMode, LocalFancoilType,
+                             ProbeType, RelayConfig, ZoneMode)
+
+ZONE_REGISTERS = 13
+
+# name: (register, init bit, end bit, kind, enum)
+# kind 'code' keeps the raw integer, 'tenths' is value / 10 as a float
+# and 'times10' is value * 10 as an integer, like the Zone getters.
+ZONE_FIELDS = {
+    'sleep_on': (0, 0, 0, 'code', None),
+    'automatic_mode': (0, 1, 1, 'code', None),
+    'zone_mode': (0, 0, 1, 'code', ZoneMode),
+    'tacto_on': (0, 2, 2, 'code', None),
+    'zone_hold': (0, 3, 3, 'code', None),
+    'speed_selection': (0, 4, 5, 'code', FancoilSpeed),
+    'min_temp': (1, 0, 15, 'tenths', None),
+    'max_temp': (2, 0, 15, 'tenths', None),
+    'signal_temperature_value': (3, 0, 15, 'tenths', None),
+    'master_zone': (4, 0, 0, 'code', None),
+    'grid_mode': (4, 1, 1, 'code', GridMode),
+    'AA_enabled': (4, 2, 2, 'code', None),
+    'Floor_enabled': (4, 3, 3, 'code', None),
+    'grid_angle_hot': (4, 5, 6, 'code', GridAngle),
+    'grid_angle_cold': (4, 7, 8, 'code', GridAngle),
+    'minimun_air_enabled': (4, 9, 9, 'code', None),
+    'probe_type': (4, 10, 11, 'code', ProbeType),
+    'presence': (4, 12, 13, 'code', RelayConfig),
+    'window': (4, 14, 15, 'code', RelayConfig),
+    'grid_opened_time': (5, 0, 15, 'times10', None),
+    'tacto_address': (6, 0, 15, 'code', None),
+    'master_tacto_address': (7, 0, 15, 'code', None),
+    'remote_probe_temperature': (8, 0, 15, 'tenths', None),
+    'zone_grid_opened': (9, 0, 0, 'code', None),
+    'grid_motor_active': (9, 1, 1, 'code', None),
+    'grid_motor_requested': (9, 2, 2, 'code', None),
+    'floor_active': (9, 5, 5, 'code', None),
+    'local_module_fancoil': (9, 6, 6, 'code', LocalFancoilType),
+    'requesting_air': (9, 7, 7, 'code', None),
+    'occupied': (9, 8, 8, 'code', None),
+    'window_opened': (9, 9, 9, 'code', None),
+    'fancoil_speed': (9, 10, 11, 'code', FancoilSpeed),
+    'proportional_aperture': (9, 12, 13, 'code', None),
+    'tacto_connected_cz': (9, 14, 14, 'code', None),
+    'local_temperature': (10, 0, 15, 'tenths', None),
+}
+
+
+def stack_zone_states(states):
+    """
+    Builds the (zones, 13) uint16 matrix from raw zone states.
+    """
+    matrix = np.asarray(states, dtype=np.uint16)
+    if matrix.ndim != 2 or matrix.shape[1] != ZONE_REGISTERS:
+        raise ValueError(f'Expected (zones, {ZONE_REGISTERS}) registers, got {matrix.shape}')
+    return matrix
+
+
+def stack_zones(zones):
+    """
+    Builds the register matrix from innobus Zone objects.
+    """
+    return stack_zone_states([z.zone_state for z in zones])
+
+
+def decode_field(matrix, name):
+    register, init, end, kind, _ = ZONE_FIELDS[name]
+    column = matrix[:, register]
+    if init != 0 or end != 15:
+        column = (column >> np.uint16(init)) & np.uint16((1 << (end - init + 1)) - 1)
+    if kind == 'tenths':
+        return column.astype(np.float64) / 10
+    if kind == 'times10':
+        return column.astype(np.int64) * 10
+    return column.astype(np.int64)
+
+
+def decode_zone_matrix(matrix, fields=None):
+    """
+    Decodes every requested field (all of them by default) into a column.
+    Enum fields are returned as their integer codes, use decode_enum to get
+    the members. Also adds 'dif_current_temp' when both temperatures are decoded.
+    """
+    matrix = stack_zone_states(matrix)
+    names = ZONE_FIELDS if fields is None else fields
+    decoded = {name: decode_field(matrix, name) for name in names}
+    if 'signal_temperature_value' in decoded and 'local_temperature' in decoded:
+        decoded['dif_current_temp'] = decoded['signal_temperature_value'] - decoded['local_temperature']
+    return decoded
+
+
+def decode_enum(codes, name):
+    """
+    Maps a column of codes to the enum members returned by the Zone getters.
+    """
+    enum = ZONE_FIELDS[name][4]
+    members = {}
+    out = np.empty(len(codes), dtype=object)
+    for i, code in enumerate(codes.tolist()):
+        if code not in members:
+            members[code] = enum(code)
+        out[i] = members[code]
+    return out
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+""" Microbenchmarks of the decoding, discovery and refresh hot paths.
+
+    python benchmarks/bench_hotpaths.py --output results.json
+    python benchmarks/bench_hotpaths.py --compare baseline.json --threshold 1.2
+
+Results are saved as JSON (nanoseconds per operation) so releases can be compared.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airzone import innobus, localapi, protocol, utils  # noqa: E402
+from tests.simulator import SimulatedAPI, SimulatedGateway, localapi_payload  # noqa: E402
+
+ZONE_STATE = [3, 180, 300, 225, 0x5A05, 12, 3, 1, 230, 0x2C83, 214, 0, 0]
+DATE = datetime.datetime(2024, 5, 17, 13, 45)
+
+
+def zone_with_state(state):
+    gateway = SimulatedGateway()
+    regs = gateway.add_innobus_machine(1, [1])
+    regs.update({256 + i: v for i, v in enumerate(state)})
+    return next(iter(innobus.Machine(gateway, 1).zones))
+
+
+def decode_zone(zone):
+    return (zone.is_sleep_on(), zone.is_automatic_mode(), zone.get_zone_mode(),
+            zone.is_tacto_on(), zone.is_zone_hold(), zone.get_speed_selection(),
+            zone.min_temp, zone.max_temp, zone.signal_temperature_value,
+            zone.is_master_zone(), zone.get_grid_mode(), zone.is_AA_enabled(),
+            zone.is_Floor_enabled(), zone.get_grid_angle_hot(), zone.get_grid_angle_cold(),
+            zone.get_is_minimun_air_enabled(), zone.get_probe_type(), zone.get_presence(),
+            zone.get_window(), zone.get_grid_opened_time(), zone.get_tacto_address(),
+            zone.get_master_tacto_address(), zone.get_remote_probe_temperature(),
+            zone.is_zone_grid_opened(), zone.is_grid_motor_active(),
+            zone.is_grid_motor_requested(), zone.is_floor_active(),
+            zone.get_local_module_fancoil(), zone.is_requesting_air(), zone.is_occupied(),
+            zone.is_window_opened(), zone.get_fancoil_speed(),
+            zone.get_proportional_aperture(), zone.is_tacto_connected_cz(),
+            zone.local_temperature, zone.dif_current_temp)
+
+
+def innobus_gateway(num_zones):
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, range(1, num_zones + 1))
+    return gateway
+
+
+def benchmarks():
+    """
+    Name and zero argument callable of every benchmark.
+    """
+    zone = zone_with_state(ZONE_STATE)
+    cases = {
+        'protocol.state_value': lambda: protocol.state_value(ZONE_STATE, 9, 10, 11),
+        'protocol.bit_value': lambda: protocol.bit_value(ZONE_STATE, 9, 7),
+        'protocol.change_bit_value': lambda: protocol.change_bit_value(ZONE_STATE, 0, 3, 1),
+        'protocol.change_range_bit_value':
+            lambda: protocol.change_range_bit_value(ZONE_STATE, 0, 4, 2, 3),
+        'protocol.date_as_number': lambda: protocol.date_as_number(DATE),
+        'utils.bitfield': lambda: utils.bitfield(0xA5A5),
+        'utils.shifting': lambda: utils.shifting([1, 0, 1, 0, 0, 1, 0, 1] * 2),
+        'innobus.Zone.decode_all': lambda: decode_zone(zone),
+        'innobus.Zone.__str__': lambda: str(zone),
+    }
+    for num_zones in (1, 8, 16):
+        gateway = innobus_gateway(num_zones)
+        machine = innobus.Machine(gateway, 1)
+        cases[f'innobus.Machine.init[{num_zones} zones]'] = \
+            lambda gateway=gateway: innobus.Machine(gateway, 1)
+        cases[f'innobus.Machine.refresh[{num_zones} zones]'] = machine._retrieve_machine_state
+    for num_zones in (1, 8, 32):
+        api = SimulatedAPI({1: localapi_payload(1, num_zones)})
+        machine = localapi.Machine(api, 1)
+        cases[f'localapi.Machine.init[{num_zones} zones]'] = \
+            lambda api=api: localapi.Machine(api, 1)
+        cases[f'localapi.Machine.__str__[{num_zones} zones]'] = \
+            lambda machine=machine: str(machine)
+    return cases
+
+
+def measure(func, repeat=5, min_time=0.2):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number * 1e9 for t in timer.repeat(repeat=repeat, number=number)]
+    return {'ns_per_op': statistics.median(runs), 'min_ns_per_op': min(runs),
+            'number': number, 'repeat': repeat}
+
+
+def run(selected=None, repeat=5, min_time=0.2):
+    results = {}
+    for name, func in benchmarks().items():
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = measure(func, repeat, min_time)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns the benchmarks slower than `threshold` times the baseline.
+    """
+    regressions = {}
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ratio = result['ns_per_op'] / old['ns_per_op']
+        print(f'{name:45s} {old["ns_per_op"]:12.0f} {result["ns_per_op"]:12.0f} {ratio:6.2f}x')
+        if ratio > threshold:
+            regressions[name] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Baseline JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Slowdown ratio reported as a regression')
+    parser.add_argument('--filter', action='append', help='Only run benchmarks containing this text')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds per repetition')
+    args = parser.parse_args(argv)
+
+    current = run(args.filter, args.repeat, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), current, args.threshold)
+        if regressions:
+            print('Regressions: ' + ', '.join(sorted(regressions)))
+            return 1
+    else:
+        for name, result in current['results'].items():
+            print(f'{name:45s} {result["ns_per_op"]:12.0f} ns/op')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+""" Fleet scale soak and load harness.
+
+Starts local modbus TCP and localapi stand-ins with injected latency, builds a
+synthetic fleet with airzone_factory and drives sustained refresh and write
+cycles for a fixed duration, then reports throughput, latency percentiles,
+memory growth and error rates.
+
+    python benchmarks/soak.py --innobus-machines 200 --zones 16 \\
+        --localapi-systems 50 --duration 300 --output soak.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airzone import airzone_factory  # noqa: E402
+from tests.simulator import (LocalApiSimulator, ModbusTcpSimulator,  # noqa: E402
+                             SimulatedAPI, SimulatedGateway, localapi_payload)
+
+MAX_DEVICE_ID = 247
+
+
+def rss_bytes():
+    """
+    Resident set size of this process, the peak one where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Reservoir():
+    """
+    Uniform sample of at most `size` latencies (algorithm R) plus the exact
+    count, mean and max, so memory stays flat however long the soak runs.
+    """
+
+    def __init__(self, size=10000, seed=0):
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._rng = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            index = self._rng.randrange(self.count)
+            if index < self.size:
+                self.samples[index] = value
+
+
+def percentiles(reservoir):
+    samples = reservoir.samples
+    if not samples:
+        return {'count': 0}
+    if len(samples) == 1:
+        p50 = p95 = p99 = samples[0]
+    else:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    return {'count': reservoir.count, 'mean_ms': reservoir.total / reservoir.count * 1e3,
+            'p50_ms': p50 * 1e3, 'p95_ms': p95 * 1e3, 'p99_ms': p99 * 1e3,
+            'max_ms': reservoir.max * 1e3}
+
+
+class Fleet():
+    """
+    The stand-ins and the machines built against them.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.servers = []
+        self.targets = []
+
+    def start(self):
+        args = self.args
+        zones = range(1, args.zones + 1)
+        for first in range(0, args.innobus_machines, MAX_DEVICE_ID):
+            gateway = SimulatedGateway(latency=args.modbus_latency)
+            ids = range(1, min(MAX_DEVICE_ID, args.innobus_machines - first) + 1)
+            for machine_id in ids:
+                gateway.add_innobus_machine(machine_id, zones)
+            server = ModbusTcpSimulator(gateway).start()
+            self.servers.append(server)
+            self.targets += [('innobus', server.address, machine_id) for machine_id in ids]
+        if args.localapi_systems:
+            systems = {s: localapi_payload(s, args.localapi_zones)
+                       for s in range(1, args.localapi_systems + 1)}
+            server = LocalApiSimulator(SimulatedAPI(systems, latency=args.http_latency)).start()
+            self.servers.append(server)
+            self.targets += [('localapi', server.address, s) for s in systems]
+
+    def build(self):
+        def build_one(target):
+            system, (host, port), machine_id = target
+            return system, airzone_factory(host, port, machine_id, system)
+        with ThreadPoolExecutor(max_workers=self.args.build_jobs) as executor:
+            return list(executor.map(build_one, self.targets))
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+
+class Recorder():
+
+    def __init__(self, reservoir_size=10000):
+        self._lock = threading.Lock()
+        self.latencies = {'refresh': Reservoir(reservoir_size, 1),
+                          'write': Reservoir(reservoir_size, 2)}
+        self.errors = {'refresh': 0, 'write': 0}
+
+    def record(self, op, elapsed, ok):
+        with self._lock:
+            self.latencies[op].add(elapsed)
+            if not ok:
+                self.errors[op] += 1
+
+
+def refresh(system, machine):
+    """
+    Whether the refresh published new state: a failed one leaves the previous
+    snapshots in place, so their versions are compared.
+    """
+    before = machine.snapshot.version
+    if system == 'localapi':
+        machine.retrieve_machine_state(update_zones=True)
+        return machine.snapshot.version != before and machine.machine_state is not None
+    zones_before = [z.snapshot.version for z in machine.zones]
+    machine._retrieve_machine_state()
+    return machine.snapshot.version != before and machine.machine_state is not None and \
+        all(z.snapshot.version != v and z.zone_state is not None
+            for z, v in zip(machine.zones, zones_before))
+
+
+def write(system, machine, rng):
+    zone = rng.choice(list(machine.zones))
+    setpoint = rng.choice((19, 20, 21, 22, 23, 24))
+    if system == 'localapi':
+        # the API answers None when the webserver rejects the request
+        return zone._api.set_zone_parameter_value(zone._machine_id, zone._zone_id,
+                                                  'setpoint', setpoint) is not None
+    # rejected or unanswered modbus writes raise
+    zone.write_register(3, setpoint * 10)
+    return True
+
+
+def drive(fleet, args):
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    machines = itertools.cycle(fleet)
+    machines_lock = threading.Lock()
+    memory = [rss_bytes()]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            with machines_lock:
+                system, machine = next(machines)
+            op = 'write' if rng.random() < args.write_ratio else 'refresh'
+            start = time.perf_counter()
+            try:
+                ok = write(system, machine, rng) if op == 'write' else refresh(system, machine)
+            except Exception:
+                ok = False
+            recorder.record(op, time.perf_counter() - start, ok)
+
+    threads = [threading.Thread(target=worker, args=(seed,), daemon=True)
+               for seed in range(args.workers)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    while any(t.is_alive() for t in threads):
+        time.sleep(min(1.0, max(0.0, deadline - time.monotonic())) or 0.1)
+        memory.append(rss_bytes())
+    elapsed = time.monotonic() - start
+    return recorder, elapsed, memory
+
+
+def report(args, recorder, elapsed, memory, build_time):
+    total = sum(r.count for r in recorder.latencies.values())
+    return {
+        'config': vars(args),
+        'build_seconds': build_time,
+        'duration_seconds': elapsed,
+        'operations': total,
+        'throughput_ops': total / elapsed if elapsed else 0.0,
+        'latency': {op: percentiles(r) for op, r in recorder.latencies.items()},
+        'error_rate': {op: (recorder.errors[op] / r.count if r.count else 0.0)
+                       for op, r in recorder.latencies.items()},
+        'memory': {'start_bytes': memory[0], 'end_bytes': memory[-1],
+                   'peak_bytes': max(memory), 'growth_bytes': memory[-1] - memory[0]},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--innobus-machines', type=int, default=200)
+    parser.add_argument('--zones', type=int, default=16, help='Zones per innobus machine')
+    parser.add_argument('--localapi-systems', type=int, default=50)
+    parser.add_argument('--localapi-zones', type=int, default=8, help='Zones per localapi system')
+    parser.add_argument('--modbus-latency', type=float, default=0.002,
+                        help='Seconds per modbus transaction on the simulated bus')
+    parser.add_argument('--http-latency', type=float, default=0.02,
+                        help='Seconds per localapi request')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of sustained load')
+    parser.add_argument('--workers', type=int, default=32, help='Concurrent driver threads')
+    parser.add_argument('--build-jobs', type=int, default=64,
+                        help='Machines built concurrently (every modbus gateway waits 2s on connect)')
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(args)
+    fleet.start()
+    # The stand-ins answer every transaction, only report the harness results.
+    logging.disable(logging.CRITICAL)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            start = time.monotonic()
+            machines = fleet.build()
+            build_time = time.monotonic() - start
+            recorder, elapsed, memory = drive(machines, args)
+    finally:
+        logging.disable(logging.NOTSET)
+        fleet.stop()
+    result = report(args, recorder, elapsed, memory, build_time)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0 if not any(recorder.errors.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,36 +1,223 @@
 #!/usr/bin/env python
 import argparse
-
-from importlib_metadata import PackageNotFoundError, version  # type: ignore
+import json
+import sys
+import time
 
 import airzone
 
-try:
-    __version__ = version("python-airzone")
-except PackageNotFoundError:
-    # package is not installed
-    pass
+
+class VersionAction(argparse.Action):
+    """
+    Resolves the installed version only when it is asked for, so the package
+    metadata is not loaded on every run.
+    """
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super().__init__(option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from importlib.metadata import PackageNotFoundError, version
+        try:
+            __version__ = version("python-airzone")
+        except PackageNotFoundError:
+            # package is not installed
+            __version__ = "unknown"
+        parser.exit(message=f'{parser.prog} {__version__}\n')
+
+
+def load_inventory(path):
+    """
+    Reads the targets from a JSON list or a file with one JSON object per line.
+    Every target has an address and a port, machine, system and rtuframer are optional.
+    """
+    with open(path) as f:
+        content = f.read().strip()
+    if content.startswith('['):
+        targets = json.loads(content)
+    else:
+        targets = [json.loads(line) for line in content.splitlines() if line.strip()]
+    return [{"address": t["address"],
+             "port": t["port"],
+             "machine": t.get("machine", 1),
+             "system": t.get("system", "innobus"),
+             "rtuframer": t.get("rtuframer", False)} for t in targets]
+
+
+def gateway_key(target):
+    return (target["address"], target["port"], target["rtuframer"])
+
+
+def build_gateways(targets, executor):
+    """
+    One modbus Gateway, and so one connection, per address, port and framer,
+    shared by the machines behind it. Failed connections are kept as the
+    exception.
+    """
+    from airzone.protocol import Gateway, modbus_factory
+
+    def connect(key):
+        try:
+            return Gateway(modbus_factory(*key))
+        except Exception as e:
+            return e
+    keys = list(dict.fromkeys(gateway_key(t) for t in targets if t["system"] != "localapi"))
+    return dict(zip(keys, executor.map(connect, keys)))
+
+
+def build_machine(target, gateways=None):
+    extra_args = {"use_rtu_framer": target["rtuframer"]}
+    gateway = gateways.get(gateway_key(target)) if gateways and target["system"] != "localapi" else None
+    if isinstance(gateway, Exception):
+        raise gateway
+    if gateway is not None:
+        extra_args["gateway"] = gateway
+    return airzone.airzone_factory(target["address"], target["port"], target["machine"],
+                                   target["system"], **extra_args)
+
+
+def refresh(m):
+    if hasattr(m, 'retrieve_machine_state'):
+        m.retrieve_machine_state(update_zones=True)
+    else:
+        m._retrieve_machine_state()
+
+
+def raw_state(m):
+    zones = getattr(m, '_zones', {})
+    return {"machine": m.machine_state,
+            "zones": {str(zone_id): z.zone_state for zone_id, z in zones.items()}}
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, (list, tuple)):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+    fields = {}
+    for key, item in items:
+        fields.update(flatten(item, f'{prefix}.{key}' if prefix else str(key)))
+    return fields
+
+
+def target_name(target):
+    return f'{target["system"]}://{target["address"]}:{target["port"]}/{target["machine"]}'
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record, default=str) + '\n')
+    sys.stdout.flush()
+
+
+def query(target, state, gateways=None):
+    try:
+        m = build_machine(target, gateways)
+        if state == 'str':
+            result = str(m)
+        elif state == 'json':
+            result = m.to_dict()
+        else:
+            result = raw_state(m)
+        return {"target": target_name(target), "state": result}
+    except Exception as e:
+        return {"target": target_name(target), "error": repr(e)}
+
+
+def batch(targets, state, jobs):
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        gateways = build_gateways(targets, executor)
+        for record in executor.map(lambda t: query(t, state, gateways), targets):
+            emit(record)
+
+
+def watch(targets, interval, jobs, count=None, state='raw'):
+    """
+    Keeps the machines connected and streams only the fields that changed,
+    the decoded ones with state 'json' and the raw registers otherwise.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        gateways = build_gateways(targets, executor)
+        machines = {}
+        for target, m in zip(targets, executor.map(lambda t: _try_build(t, gateways), targets)):
+            if isinstance(m, Exception):
+                emit({"target": target_name(target), "error": repr(m)})
+            else:
+                machines[target_name(target)] = m
+        last = {name: {} for name in machines}
+        iteration = 0
+        while machines and (count is None or iteration < count):
+            start = time.monotonic()
+            if iteration:
+                list(executor.map(_try_refresh, machines.keys(), machines.values()))
+            now = time.time()
+            for name, m in machines.items():
+                fields = flatten(m.to_dict() if state == 'json' else raw_state(m))
+                changes = {k: v for k, v in fields.items() if last[name].get(k, object()) != v}
+                last[name] = fields
+                if changes:
+                    emit({"target": name, "time": now, "changes": changes})
+            iteration += 1
+            if count is None or iteration < count:
+                time.sleep(max(0.0, interval - (time.monotonic() - start)))
+
+
+def _try_build(target, gateways=None):
+    try:
+        return build_machine(target, gateways)
+    except Exception as e:
+        return e
+
+
+def _try_refresh(name, m):
+    try:
+        refresh(m)
+    except Exception as e:
+        emit({"target": name, "error": repr(e)})
 
 
 def action(args):
-    extra_args = {"use_rtu_framer": args.rtuframer}
-    m = airzone.airzone_factory(args.address, args.port, args.machine, args.system, **extra_args)
-    if args.state == 'str':
-        print(str(m))
+    if args.inventory:
+        targets = load_inventory(args.inventory)
+    elif args.address and args.port:
+        targets = [{"address": args.address, "port": args.port, "machine": args.machine,
+                    "system": args.system, "rtuframer": args.rtuframer}]
+    else:
+        parser.error("address and port are required unless --inventory is given")
+    if args.watch:
+        watch(targets, args.watch, args.jobs, args.count, args.state)
+    elif args.inventory:
+        batch(targets, args.state, args.jobs)
     else:
-        print(str(m.machine_state))
+        m = build_machine(targets[0])
+        if args.state == 'str':
+            print(str(m))
+        elif args.state == 'json':
+            print(m.to_bytes().decode())
+        else:
+            print(str(m.machine_state))
 
 
 parser = argparse.ArgumentParser(prog='airzone')
-parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
-parser.add_argument("address", type=str, help="serial device or ip address for localapi")
-parser.add_argument("port", type=str, help="serial tcp port or http port for localapi")
+parser.add_argument('-v', '--version', action=VersionAction)
+parser.add_argument("address", type=str, nargs='?', help="serial device or ip address for localapi")
+parser.add_argument("port", type=str, nargs='?', help="serial tcp port or http port for localapi")
 parser.add_argument("--machine", type=int, default=1, help="Machine number where connect")
 parser.add_argument("--system", choices=['innobus', 'aido', 'localapi'], default='innobus', help="Type of Airzone System")
-parser.add_argument("--state", choices=['str', 'raw'], default='str',
-                    help="Get the formatted state, or the raw machine state")
+parser.add_argument("--state", choices=['str', 'raw', 'json'], default='str',
+                    help="Get the formatted state, the raw machine state or the decoded state as json")
 parser.add_argument("--rtuframer", type=bool, default= False, help="use rtu framer for modbus.")
+parser.add_argument("--inventory", type=str, help="JSON or NDJSON file with the targets to query, output is NDJSON")
+parser.add_argument("--jobs", type=int, default=16, help="Number of targets queried concurrently")
+parser.add_argument("--watch", type=float, metavar="SECONDS",
+                    help="Keep the connections open and stream the changed fields every SECONDS")
+parser.add_argument("--count", type=int, help="Number of watch iterations, forever by default")
 parser.set_defaults(func=action)
 
-args = parser.parse_args()
-args.func(args)
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.func(args)
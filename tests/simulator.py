@@ -0,0 +1,373 @@
+""" In-memory stand-ins of Airzone installations.
+
+Used by the tests, the benchmarks and the load harness to exercise the real
+Machine and Zone classes without a bus or a webserver.
+"""
+import json
+import os
+import select
+import socketserver
+import struct
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# localapi systemID answering for every system, see airzone.localapi.ALL_SYSTEMS
+ALL_SYSTEMS = 127
+
+
+class SimulatedGateway():
+    """
+    Register map per device id exposing the Gateway interface.
+    Arguments:
+        latency -- seconds every transaction takes, spent holding the bus lock
+    """
+
+    def __init__(self, latency=0.0):
+        self.registers = {}
+        self.transactions = 0
+        self.writes = []
+        self.latency = latency
+        self._lock = Lock()
+
+    def add_innobus_machine(self, machine_id, zone_ids):
+        regs = self.registers.setdefault(machine_id, {})
+        mask = sum(1 << (z - 1) for z in zone_ids)
+        regs[9] = mask & 0xFF
+        regs[10] = mask >> 8
+        for z in zone_ids:
+            base = z * 256
+            regs[base + 1] = 180
+            regs[base + 2] = 300
+            regs[base + 3] = 220
+            regs[base + 10] = 215
+        return regs
+
+    def add_aido(self, machine_id):
+        regs = self.registers.setdefault(machine_id, {})
+        regs.update({0: 1, 1: 220, 2: 215, 3: 2, 4: 2, 5: 8, 7: 0, 8: 0})
+        return regs
+
+    def read_input_registers(self, machineid, address, num_registers):
+        with self._lock:
+            if self.latency:
+                time.sleep(self.latency)
+            self.transactions += 1
+            regs = self.registers.get(machineid)
+            if regs is None:
+                return None
+            return [regs.get(a, 0) for a in range(address, address + num_registers)]
+
+    read_holding_registers = read_input_registers
+
+    def write_single_register(self, machineid, address, value):
+        with self._lock:
+            if self.latency:
+                time.sleep(self.latency)
+            self.transactions += 1
+            self.writes.append((machineid, address, value))
+            self.registers.setdefault(machineid, {})[address] = value
+
+    def __str__(self):
+        return f'SimulatedGateway_{id(self)}'
+
+
+def localapi_zone(system_id, zone_id):
+    """
+    A zone record as returned by the localapi webserver.
+    """
+    return {
+        "systemID": system_id, "zoneID": zone_id, "name": f"Zone {zone_id}",
+        "on": 1, "maxTemp": 30, "minTemp": 18, "setpoint": 23,
+        "roomTemp": 21.5 + zone_id / 10, "mode": 2, "speed": 0,
+        "coldStages": 1, "coldStage": 1, "heatStages": 1, "heatStage": 1,
+        "humidity": 50, "units": 0, "errors": [], "air_demand": zone_id % 2,
+        "floor_demand": 0,
+    }
+
+
+def localapi_payload(system_id, num_zones):
+    return [localapi_zone(system_id, z) for z in range(1, num_zones + 1)]
+
+
+class SimulatedAPI():
+    """
+    Stand-in of airzone.localapi.API serving generated payloads.
+    """
+
+    def __init__(self, systems=None, latency=0.0, name='simulated', all_systems=True):
+        """
+        Arguments:
+            all_systems -- whether the firmware answers for every system at once
+        """
+        self.systems = systems if systems is not None else {1: localapi_payload(1, 8)}
+        self.latency = latency
+        self.all_systems = all_systems
+        self.requests = 0
+        self._name = name
+        self._lock = Lock()
+
+    def retrieve_state(self, system_id, zone_id):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            zones = self.systems.get(system_id)
+            if zones is None:
+                return None
+            if zone_id == 0:
+                return [dict(z) for z in zones]
+            return [dict(z) for z in zones if z['zoneID'] == zone_id]
+
+    def retrieve_all_systems(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            if not self.all_systems:
+                return {}
+            return {s: [dict(z) for z in zones] for s, zones in self.systems.items()}
+
+    def set_zone_parameter_value(self, machine_id, zone_id, parameter, value):
+        self.set_zone_parameters(machine_id, zone_id, {parameter: value})
+        return value
+
+    def set_zone_parameters(self, machine_id, zone_id, parameters):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            for z in self.systems.get(machine_id, []):
+                if zone_id == 0 or z['zoneID'] == zone_id:
+                    z.update(parameters)
+        return parameters
+
+    def __str__(self):
+        return f'LocalApi: {self._name}'
+
+
+def process_pdu(gateway, unit, pdu):
+    """
+    Response pdu of a read holding/input registers (3, 4) or write single
+    register (6) request pdu, answered from a SimulatedGateway register map.
+    """
+    function = pdu[0]
+    if function in (3, 4):
+        address, count = struct.unpack('>HH', pdu[1:5])
+        if function == 3:
+            registers = gateway.read_holding_registers(unit, address, count)
+        else:
+            registers = gateway.read_input_registers(unit, address, count)
+        return struct.pack(f'>BB{count}H', function, 2 * count, *registers)
+    if function == 6:
+        address, value = struct.unpack('>HH', pdu[1:5])
+        gateway.write_single_register(unit, address, value)
+        return pdu[:5]
+    # Illegal function
+    return struct.pack('>BB', function | 0x80, 0x01)
+
+
+class _ModbusTcpHandler(socketserver.BaseRequestHandler):
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self):
+        gateway = self.server.gateway
+        self.server.simulator.connected()
+        while True:
+            header = self._recv(7)
+            if header is None:
+                return
+            transaction, protocol, length, unit = struct.unpack('>HHHB', header)
+            pdu = self._recv(length - 1)
+            if pdu is None:
+                return
+            response = self.server.simulator.process(gateway, unit, pdu)
+            self.request.sendall(struct.pack('>HHHB', transaction, protocol,
+                                             len(response) + 1, unit) + response)
+
+
+class _ModbusTcpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ModbusTcpSimulator():
+    """
+    Modbus TCP server answering read holding/input registers (3, 4) and write
+    single register (6) from the register map of a SimulatedGateway, so real
+    Gateway and modbus clients can be driven against it. The latency of the
+    SimulatedGateway is spent on every transaction, serialized like a bus.
+    """
+
+    def __init__(self, gateway=None, host='127.0.0.1', port=0):
+        self.gateway = gateway if gateway is not None else SimulatedGateway()
+        self._server = _ModbusTcpServer((host, port), _ModbusTcpHandler)
+        self._server.gateway = self.gateway
+        self._server.simulator = self
+        self._thread = None
+        self._lock = Lock()
+        self.connections = 0
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def process(self, gateway, unit, pdu):
+        if unit not in gateway.registers:
+            # Gateway target device failed to respond
+            return struct.pack('>BB', pdu[0] | 0x80, 0x0B)
+        return process_pdu(gateway, unit, pdu)
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name='modbus-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class RtuSimulator():
+    """
+    Modbus RTU slaves on one end of a pseudo-terminal pair, answering from the
+    register map of a SimulatedGateway. Clients open `port`, the other end.
+    Devices not in the map stay silent, as they would on a serial line.
+    Arguments:
+        baudrate -- when set, every frame is delayed by its time on such a line
+    """
+
+    def __init__(self, gateway=None, baudrate=None):
+        import tty
+        self.gateway = gateway if gateway is not None else SimulatedGateway()
+        self.baudrate = baudrate
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = False
+        self._thread = None
+
+    def _frame_time(self, size):
+        return size * 10 / self.baudrate if self.baudrate else 0
+
+    def _serve(self):
+        from airzone.rtu import check_frame, frame
+        buffer = b''
+        while self._running:
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                buffer += os.read(self._master, 256)
+            except OSError:
+                return
+            # read and write single register requests are 8 bytes long
+            while len(buffer) >= 8:
+                request, buffer = buffer[:8], buffer[8:]
+                if not check_frame(request):
+                    buffer = b''
+                    break
+                unit, pdu = request[0], request[1:-2]
+                if unit not in self.gateway.registers:
+                    continue
+                response = frame(unit, process_pdu(self.gateway, unit, pdu))
+                time.sleep(self._frame_time(len(request) + len(response)))
+                os.write(self._master, response)
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self._serve, name='rtu-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+class _LocalApiHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _request(self):
+        if self.path != '/api/v1/hvac':
+            self._reply(404, {'errors': ['not found']})
+            return None
+        length = int(self.headers.get('Content-Length', 0))
+        return {k.lower(): v for k, v in json.loads(self.rfile.read(length) or b'{}').items()}
+
+    def do_POST(self):
+        body = self._request()
+        if body is None:
+            return
+        if body.get('systemid') == ALL_SYSTEMS:
+            systems = self.server.api.retrieve_all_systems()
+            if not systems:
+                self._reply(500, {'errors': ['system not found']})
+            else:
+                self._reply(200, {'systems': [{'data': zones} for zones in systems.values()]})
+            return
+        data = self.server.api.retrieve_state(body.get('systemid'), body.get('zoneid', 0))
+        if data is None:
+            self._reply(500, {'errors': ['system not found']})
+        else:
+            self._reply(200, {'data': data})
+
+    def do_PUT(self):
+        body = self._request()
+        if body is None:
+            return
+        system_id, zone_id = body.pop('systemid'), body.pop('zoneid')
+        self.server.api.set_zone_parameters(system_id, zone_id, body)
+        self._reply(200, {'data': [body]})
+
+
+class LocalApiSimulator():
+    """
+    HTTP server speaking the localapi /api/v1/hvac protocol from a SimulatedAPI.
+    """
+
+    def __init__(self, api=None, host='127.0.0.1', port=0):
+        self.api = api if api is not None else SimulatedAPI()
+        self._server = ThreadingHTTPServer((host, port), _LocalApiHandler)
+        self._server.daemon_threads = True
+        self._server.api = self.api
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name='localapi-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
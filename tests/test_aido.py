@@ -0,0 +1,112 @@
+"""Aido refresh tests."""
+from airzone import airzone_factory
+from airzone.aido import Fault, build_aidos, refresh_aidos
+from airzone.commands import CommandQueue
+from airzone.protocol import ILLEGAL_DATA_ADDRESS
+from tests.simulator import SimulatedGateway
+
+FAULT_REGISTERS = (7, 8)
+
+
+class StateOnlyGateway(SimulatedGateway):
+    """Rejects reads beyond the state registers, as units without them do."""
+
+    def __init__(self):
+        super().__init__()
+        self.codes = {}
+        self.offline = set()
+
+    def read_input_registers(self, machineid, address, num_registers):
+        self.codes.pop(machineid, None)
+        if machineid in self.offline:
+            self.transactions += 1
+            return None
+        if address + num_registers > 7:
+            self.transactions += 1
+            self.codes[machineid] = ILLEGAL_DATA_ADDRESS
+            return None
+        return super().read_input_registers(machineid, address, num_registers)
+
+    def exception_code(self, machineid):
+        return self.codes.get(machineid)
+
+
+def test_state_and_faults_in_one_transaction():
+    gateway = SimulatedGateway()
+    gateway.add_aido(3).update({7: 42, 8: 0b101})
+    aido = airzone_factory(None, None, 3, 'aido', gateway=gateway, fault_registers=FAULT_REGISTERS)
+    assert gateway.transactions == 1
+    assert aido.get_errors() == (Fault(3, 'error', 42),)
+    assert aido.get_warnings() == (Fault(3, 'warning', 1), Fault(3, 'warning', 3))
+    assert aido.to_dict()['faults'][0] == {'kind': 'error', 'code': 42}
+
+
+def test_faults_are_not_read_without_their_registers():
+    gateway = SimulatedGateway()
+    gateway.add_aido(3).update({7: 42})
+    aido = airzone_factory(None, None, 3, 'aido', gateway=gateway)
+    assert gateway.transactions == 1
+    assert len(aido.machine_state) == 7
+    assert aido.get_faults() == ()
+
+
+def test_falls_back_on_illegal_address_only():
+    gateway = StateOnlyGateway()
+    gateway.add_aido(3)
+    gateway.add_aido(4)
+    gateway.offline.add(4)
+    aido, offline = build_aidos(gateway, [3, 4], fault_registers=FAULT_REGISTERS)
+    assert aido.get_signal_temperature_value() == 22.0
+    assert aido.get_faults() == ()
+    transactions = gateway.transactions
+    aido._retrieve_machine_state()
+    assert gateway.transactions == transactions + 1
+
+    # no answer costs a single transaction and doesn't tell the registers are missing
+    assert offline.machine_state is None
+    transactions = gateway.transactions
+    offline._retrieve_machine_state()
+    assert gateway.transactions == transactions + 1
+    assert offline._faults_supported
+    gateway.offline.clear()
+    offline._retrieve_machine_state()
+    assert offline.get_signal_temperature_value() == 22.0
+    assert not offline._faults_supported
+
+
+def test_timeouts_keep_reading_faults():
+    gateway = StateOnlyGateway()
+    gateway.add_aido(3)
+    gateway.offline.add(3)
+    aido = build_aidos(gateway, [3], fault_registers=FAULT_REGISTERS)[0]
+    aido._retrieve_machine_state()
+    assert aido._faults_supported
+    other = build_aidos(SimulatedGateway(), [3], fault_registers=FAULT_REGISTERS)[0]
+    assert other._faults_supported
+
+
+def test_exception_code_through_command_queue():
+    gateway = StateOnlyGateway()
+    gateway.add_aido(3)
+    queue = CommandQueue(gateway)
+    try:
+        aido = build_aidos(queue, [3], fault_registers=FAULT_REGISTERS)[0]
+        assert aido.get_signal_temperature_value() == 22.0
+        assert not aido._faults_supported
+    finally:
+        queue.close()
+
+
+def test_refresh_many_units_on_one_gateway():
+    gateway = SimulatedGateway()
+    for machine_id in (1, 2):
+        gateway.add_aido(machine_id)
+    gateway.registers[2][7] = 5
+    aidos = build_aidos(gateway, [1, 2, 9], fault_registers=FAULT_REGISTERS)
+    transactions = gateway.transactions
+    results = refresh_aidos(aidos)
+    assert gateway.transactions == transactions + 3
+    assert sorted(results) == [1, 2, 9]
+    assert results[1].available and results[1].faults == ()
+    assert results[2].faults == (Fault(2, 'error', 5),)
+    assert not results[9].available
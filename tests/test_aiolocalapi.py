@@ -0,0 +1,119 @@
+"""Asyncio localapi tests."""
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from airzone.aiolocalapi import AsyncAPI, AsyncMachine, ClientPool, refresh_all
+from airzone.trace import TransactionTrace
+from tests.simulator import LocalApiSimulator, SimulatedAPI, localapi_payload
+
+
+@pytest.fixture
+def servers():
+    started = [LocalApiSimulator(SimulatedAPI({1: localapi_payload(1, 4),
+                                               2: localapi_payload(2, 2)})).start()
+               for _ in range(3)]
+    yield started
+    for server in started:
+        server.stop()
+
+
+def test_refresh_every_site_from_one_loop(servers):
+    trace = TransactionTrace()
+
+    async def run():
+        async with ClientPool(limit_per_host=1, trace=trace) as pool:
+            machines = await asyncio.gather(*(
+                AsyncMachine.create(pool.api(*server.address), system_id)
+                for server in servers for system_id in (1, 2)))
+            assert [len(m.zones) for m in machines] == [4, 2] * 3
+            servers[0].api.systems[1][0]['roomTemp'] = 30.5
+            assert await refresh_all(machines) == [True] * 6
+            zone = next(iter(machines[0].zones))
+            assert zone.local_temperature == 30.5
+            await zone.turn_off()
+            await machines[0].set_speed(3)
+            await zone.retrieve_zone_state()
+            return machines, zone
+
+    machines, zone = asyncio.run(run())
+    assert machines[0].speed == 3
+    assert not zone.is_on()
+    assert sum(server.api.requests for server in servers) == 15
+    assert {t.outcome for t in trace.snapshot()} == {'200'}
+    with pytest.raises(TypeError):
+        zone.signal_temperature_value = 21
+
+
+def test_unreachable_site():
+    async def run():
+        async with ClientPool(timeout=1) as pool:
+            return await AsyncMachine.create(pool.api('127.0.0.1', 1))
+
+    machine = asyncio.run(run())
+    assert machine.record is None
+    assert list(machine.zones) == []
+
+
+def test_private_pool_is_closed(servers):
+    async def run():
+        async with AsyncAPI(*servers[0].address) as api:
+            machine = await AsyncMachine.create(api)
+            session = api._pool.session
+        async with ClientPool() as pool:
+            shared = pool.api(*servers[0].address)
+            await AsyncMachine.create(shared)
+            await shared.close()
+            assert not pool._session.closed
+        return machine, session
+
+    machine, session = asyncio.run(run())
+    assert len(machine.zones) == 4
+    assert session.closed
+
+
+class BrokenHandler(BaseHTTPRequestHandler):
+    """Answers 200 with the body of its server, whatever the request."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RaisingMachine(AsyncMachine):
+
+    async def refresh(self):
+        raise KeyError('zoneID')
+
+
+def test_bad_answers_fail_only_their_site(servers):
+    broken = []
+    for body in (b'<html>busy</html>', b'{}'):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), BrokenHandler)
+        server.body = body
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        broken.append(server)
+
+    async def run():
+        async with ClientPool() as pool:
+            good = await AsyncMachine.create(pool.api(*servers[0].address))
+            apis = [pool.api(*server.server_address) for server in broken]
+            assert [await api.retrieve_state(1, 0) for api in apis] == [None, None]
+            machines = [good, RaisingMachine(apis[0])] + [AsyncMachine(api) for api in apis]
+            return await refresh_all(machines)
+
+    try:
+        assert asyncio.run(run()) == [True, False, False, False]
+    finally:
+        for server in broken:
+            server.shutdown()
+            server.server_close()
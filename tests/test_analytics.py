@@ -0,0 +1,98 @@
+"""Runtime analytics tests."""
+from airzone.analytics import DAY, HOUR, RuntimeAnalytics, zone_key
+from airzone.innobus import Machine
+from airzone.localapi import Machine as LocalMachine
+from airzone.snapshot import Snapshot
+from tests.simulator import SimulatedAPI, SimulatedGateway
+
+
+def set_state(zone, version, timestamp, state):
+    zone._snapshot = Snapshot(version, timestamp, state, None)
+
+
+def test_innobus_duty_cycle_and_rollups():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1])
+    zone = next(iter(Machine(gateway, 1).zones))
+    idle = list(zone.zone_state)
+    demanding = list(idle)
+    demanding[9] = 0b10000001  # requesting air, grid opened
+    analytics = RuntimeAnalytics(hours=2, max_gap=2 * HOUR)
+    start = 10 * DAY
+    set_state(zone, 1, start, demanding)
+    assert analytics.observe(zone)
+    assert not analytics.observe(zone)
+    set_state(zone, 2, start + 1800, idle)
+    analytics.observe(zone)
+    set_state(zone, 3, start + 2 * HOUR + 1800, idle)
+    analytics.observe(zone)
+
+    data = analytics.export(zone_key(zone))
+    total = data['total']
+    assert total['observed_seconds'] == 2.5 * HOUR
+    assert total['demand_seconds'] == 1800
+    assert total['grid_opened_seconds'] == 1800
+    assert total['duty_cycle'] == 0.2
+    # setpoint 22.0 and room 21.5
+    assert total['mean_dif_temp'] == 0.5
+    # only the last 2 hours are kept, the daily bucket has everything
+    assert [h['start'] for h in data['hourly']] == [start + HOUR, start + 2 * HOUR]
+    assert data['daily'][0]['demand_seconds'] == 1800
+
+
+def test_gaps_are_not_extrapolated():
+    analytics = RuntimeAnalytics(max_gap=600)
+    machine = LocalMachine(SimulatedAPI())
+    zone = next(iter(machine.zones))
+    state = zone.zone_state
+    zone._snapshot = zone.snapshot._replace(version=1, timestamp=0)
+    analytics.observe(zone, 'z')
+    zone._snapshot = zone.snapshot._replace(version=2, timestamp=3600)
+    analytics.observe(zone, 'z')
+    data = analytics.export('z')
+    assert data['gaps'] == 1
+    assert data['total']['observed_seconds'] == 600
+    # zone 1 of the simulated payload demands air
+    assert data['total']['duty_cycle'] == 1.0
+    assert state['air_demand'] == 1
+
+
+def test_local_day_boundaries():
+    analytics = RuntimeAnalytics(utc_offset=2 * HOUR, max_gap=DAY)
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1])
+    zone = next(iter(Machine(gateway, 1).zones))
+    state = zone.zone_state
+    set_state(zone, 1, DAY - 3 * HOUR, state)
+    analytics.observe(zone)
+    set_state(zone, 2, DAY, state)
+    analytics.observe(zone)
+    daily = analytics.export(zone_key(zone))['daily']
+    assert [(d['start'], d['observed_seconds']) for d in daily] == \
+        [(-2 * HOUR, HOUR), (DAY - 2 * HOUR, 2 * HOUR)]
+
+
+def test_observation_of_the_accounted_snapshot():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1])
+    zone = next(iter(Machine(gateway, 1).zones))
+    idle = list(zone.zone_state)
+    demanding = list(idle)
+    demanding[9] = 0b10000000
+
+    class RefreshedZone(type(zone)):
+        """A refresh lands right after the snapshot is read."""
+
+        @property
+        def snapshot(self):
+            snapshot = self._snapshot
+            set_state(self, snapshot.version + 1, snapshot.timestamp + 60, idle)
+            return snapshot
+
+    analytics = RuntimeAnalytics()
+    set_state(zone, 1, 0, demanding)
+    zone.__class__ = RefreshedZone
+    analytics.observe(zone, 'z')
+    set_state(zone, 3, 600, idle)
+    analytics.observe(zone, 'z')
+    assert analytics.export('z')['total']['demand_seconds'] == 600
@@ -0,0 +1,13 @@
+"""Smoke test of the microbenchmark suite."""
+import os
+import runpy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_every_benchmark_runs():
+    bench = runpy.run_path(os.path.join(ROOT, 'benchmarks', 'bench_hotpaths.py'))
+    cases = bench['benchmarks']()
+    assert len(cases) > 15
+    for func in cases.values():
+        func()
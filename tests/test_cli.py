@@ -0,0 +1,90 @@
+"""CLI batch and watch modes against the local simulators."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest  # type: ignore
+
+from tests.simulator import (LocalApiSimulator, ModbusTcpSimulator, SimulatedAPI, SimulatedGateway,
+                             localapi_payload)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def modbus():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2])
+    gateway.add_innobus_machine(2, [1])
+    simulator = ModbusTcpSimulator(gateway).start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture
+def localapi():
+    simulator = LocalApiSimulator(SimulatedAPI({1: localapi_payload(1, 2)})).start()
+    yield simulator
+    simulator.stop()
+
+
+def cli(*args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return [sys.executable, os.path.join(ROOT, 'bin', 'airzone_cli.py')] + list(args), env
+
+
+def run_cli(*args):
+    command, env = cli(*args)
+    result = subprocess.run(command, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return [json.loads(line) for line in result.stdout.splitlines()]
+
+
+def write_inventory(tmp_path, targets):
+    path = tmp_path / 'inventory.ndjson'
+    path.write_text('\n'.join(json.dumps(t) for t in targets) + '\n')
+    return str(path)
+
+
+def test_batch_queries_every_target(tmp_path, modbus, localapi):
+    host, port = modbus.address
+    api_host, api_port = localapi.address
+    inventory = write_inventory(tmp_path, [
+        {'address': host, 'port': port, 'machine': 1},
+        {'address': host, 'port': port, 'machine': 2},
+        {'address': api_host, 'port': api_port, 'machine': 1, 'system': 'localapi'},
+        {'address': host, 'port': port, 'machine': 9},
+    ])
+    records = run_cli('--inventory', inventory, '--state', 'raw', '--jobs', '2')
+    by_target = {r['target']: r for r in records}
+    assert len(records) == 4
+    assert sorted(by_target[f'innobus://{host}:{port}/1']['state']['zones']) == ['1', '2']
+    assert list(by_target[f'innobus://{host}:{port}/2']['state']['zones']) == ['1']
+    assert sorted(by_target[f'localapi://{api_host}:{api_port}/1']['state']['zones']) == ['1', '2']
+    assert 'error' in by_target[f'innobus://{host}:{port}/9']
+    # the three innobus targets share the gateway connection
+    assert modbus.connections == 1
+
+
+def test_watch_streams_only_changes(tmp_path, modbus):
+    host, port = modbus.address
+    inventory = write_inventory(tmp_path, [{'address': host, 'port': port, 'machine': 1}])
+    records = run_cli('--inventory', inventory, '--watch', '0.01', '--count', '2', '--state', 'raw')
+    # the first iteration reports every field, the second nothing as the state is unchanged
+    assert len(records) == 1
+    assert records[0]['target'] == f'innobus://{host}:{port}/1'
+    assert records[0]['changes']['zones.2.10'] == 215
+
+
+def test_watch_reports_changed_registers(tmp_path, modbus):
+    host, port = modbus.address
+    inventory = write_inventory(tmp_path, [{'address': host, 'port': port, 'machine': 1}])
+    command, env = cli('--inventory', inventory, '--watch', '0.2', '--count', '3', '--state', 'raw')
+    with subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True) as process:
+        first = json.loads(process.stdout.readline())
+        modbus.gateway.registers[1][2 * 256 + 10] = 230
+        rest = [json.loads(line) for line in process.stdout]
+    assert process.returncode == 0
+    assert len(first['changes']) > 1
+    assert [r['changes'] for r in rest] == [{'zones.2.10': 230}]
@@ -0,0 +1,44 @@
+"""Command queue tests."""
+from threading import Event
+
+from airzone.commands import CommandQueue
+from tests.simulator import SimulatedGateway
+
+
+class BlockingGateway(SimulatedGateway):
+    """Holds the first read on the wire until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.started = Event()
+        self.release = Event()
+        self.order = []
+
+    def read_input_registers(self, machineid, address, num_registers):
+        self.started.set()
+        self.release.wait(5)
+        self.order.append(('read', address))
+        return super().read_input_registers(machineid, address, num_registers)
+
+    def write_single_register(self, machineid, address, value):
+        self.order.append(('write', address, value))
+        super().write_single_register(machineid, address, value)
+
+
+def test_writes_jump_reads_and_collapse():
+    gateway = BlockingGateway()
+    gateway.registers[1] = {0: 7}
+    queue = CommandQueue(gateway)
+    in_flight = queue.submit_read(1, 0, 1)
+    gateway.started.wait(5)
+    background = queue.submit_read(1, 10, 1)
+    futures = [queue.write_single_register(1, 259, v) for v in (200, 210, 220)]
+    other = queue.write_single_register(1, 515, 1)
+    gateway.release.set()
+    assert [f.result(5) for f in futures] == [220, 220, 220]
+    assert other.result(5) == 1
+    assert in_flight.result(5) == [7]
+    assert background.result(5) == [0]
+    queue.close()
+    assert gateway.order == [('read', 0), ('write', 259, 220), ('write', 515, 1), ('read', 10)]
+    assert gateway.writes == [(1, 259, 220), (1, 515, 1)]
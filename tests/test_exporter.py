@@ -0,0 +1,41 @@
+"""Metrics exporter tests."""
+import urllib.request
+
+from airzone.exporter import MetricsExporter
+from airzone.innobus import Machine
+from airzone.localapi import Machine as LocalMachine
+from tests.simulator import SimulatedAPI, SimulatedGateway
+
+
+def test_render_from_snapshots_only():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2])
+    machine = Machine(gateway, 1)
+    exporter = MetricsExporter([machine, LocalMachine(SimulatedAPI())])
+    transactions = gateway.transactions
+    text = exporter.render()
+    assert gateway.transactions == transactions
+    assert exporter.render() is text
+    lines = text.decode().splitlines()
+    assert '# TYPE airzone_zone_local_temperature gauge' in lines
+    zone = f'machine="{machine.unique_id}",zone="2"'
+    assert f'airzone_zone_local_temperature{{system="innobus",{zone}}} 21.5' in lines
+    assert f'airzone_zone_mode_info{{system="innobus",{zone},zone_mode="MANUAL"}} 1' in lines
+
+    gateway.registers[1][2 * 256 + 10] = 230
+    machine._retrieve_machine_state()
+    assert f'airzone_zone_local_temperature{{system="innobus",{zone}}} 23.0' \
+        in exporter.render().decode().splitlines()
+
+
+def test_serve_metrics():
+    exporter = MetricsExporter([LocalMachine(SimulatedAPI())])
+    host, port = exporter.serve('127.0.0.1', 0)
+    try:
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+            body = response.read()
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    finally:
+        exporter.shutdown()
+    assert body == exporter.render()
+    assert b'airzone_zone_humidity_percent' in body
@@ -0,0 +1,118 @@
+"""Failover gateway tests."""
+from airzone.failover import FailoverGateway
+from airzone.innobus import Machine
+from tests.simulator import SimulatedGateway
+
+
+class Endpoint(SimulatedGateway):
+    """One path to a shared register map that can go down."""
+
+    def __init__(self, registers, latency=0.0):
+        super().__init__(latency)
+        self.registers = registers
+        self.down = False
+
+    def read_input_registers(self, machineid, address, num_registers):
+        if self.down:
+            self.transactions += 1
+            return None
+        return super().read_input_registers(machineid, address, num_registers)
+
+    def write_single_register(self, machineid, address, value):
+        if self.down:
+            raise ConnectionError('gateway unreachable')
+        super().write_single_register(machineid, address, value)
+
+
+def bus():
+    shared = SimulatedGateway()
+    shared.add_innobus_machine(1, [1, 2])
+    return shared.registers
+
+
+def test_routes_to_the_fastest_endpoint():
+    registers = bus()
+    slow, fast = Endpoint(registers, latency=0.02), Endpoint(registers)
+    gateway = FailoverGateway([slow, fast])
+    gateway.check_health()
+    assert gateway.read_input_registers(1, 0, 21) is not None
+    assert (slow.transactions, fast.transactions) == (1, 2)
+    stats = gateway.stats()
+    assert stats[0]['latency_ms'] > stats[1]['latency_ms']
+    assert all(s['healthy'] for s in stats)
+
+
+def test_polls_continue_through_an_outage():
+    registers = bus()
+    primary, backup = Endpoint(registers), Endpoint(registers)
+    gateway = FailoverGateway([primary, backup])
+    machine = Machine(gateway, 1)
+    primary.down = True
+    registers[1][256 + 10] = 250
+    machine._retrieve_machine_state()
+    assert next(iter(machine.zones)).local_temperature == 25.0
+    assert [s['healthy'] for s in gateway.stats()] == [False, True]
+    primary_calls = primary.transactions
+    machine._retrieve_machine_state()
+    assert primary.transactions == primary_calls
+
+
+def test_writes_are_kept_until_an_endpoint_answers():
+    registers = bus()
+    primary, backup = Endpoint(registers), Endpoint(registers)
+    gateway = FailoverGateway([primary, backup])
+    primary.down = backup.down = True
+    gateway.write_single_register(1, 259, 200)
+    gateway.write_single_register(1, 259, 210)
+    gateway.write_single_register(1, 515, 190)
+    assert gateway.pending_writes == [(1, 259, 210), (1, 515, 190)]
+    backup.down = False
+    assert gateway.read_input_registers(1, 259, 1) == [210]
+    assert gateway.pending_writes == []
+    assert backup.writes == [(1, 259, 210), (1, 515, 190)]
+
+
+def test_landed_write_drops_the_queued_one():
+    registers = bus()
+    primary = Endpoint(registers)
+    gateway = FailoverGateway([primary])
+    primary.down = True
+    gateway.write_single_register(1, 259, 200)
+    primary.down = False
+    gateway.write_single_register(1, 259, 230)
+    assert gateway.pending_writes == []
+    assert gateway.flush_writes() == 0
+    assert gateway.read_input_registers(1, 259, 1) == [230]
+    assert primary.writes == [(1, 259, 230)]
+
+
+class ExceptionEndpoint(Endpoint):
+    """Answers devices missing from the bus with an exception response."""
+
+    def exception_code(self, machineid):
+        return None if self.down or machineid in self.registers else 0x0B
+
+
+def test_exception_responses_count_as_alive():
+    registers = bus()
+    primary, backup = ExceptionEndpoint(registers), ExceptionEndpoint(registers)
+    gateway = FailoverGateway([primary, backup])
+    gateway.check_health()
+    assert all(s['healthy'] for s in gateway.stats())
+    assert gateway.read_input_registers(9, 0, 1) is None
+    assert gateway.exception_code(9) == 0x0B
+    assert all(s['healthy'] for s in gateway.stats())
+    gateway.probe = (9, 0)
+    primary.down = True
+    gateway.check_health()
+    assert [s['healthy'] for s in gateway.stats()] == [False, True]
+
+
+def test_health_checks_probe_a_polled_device():
+    shared = SimulatedGateway()
+    shared.add_innobus_machine(5, [1])
+    endpoint = Endpoint(shared.registers)
+    gateway = FailoverGateway([endpoint])
+    assert gateway.read_input_registers(5, 0, 21) is not None
+    gateway.check_health()
+    assert gateway.stats()[0]['healthy']
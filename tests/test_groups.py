@@ -0,0 +1,70 @@
+"""Group and scene tests."""
+import threading
+
+from airzone.aido import Aido
+from airzone.groups import Scene, select, target_id
+from airzone.innobus import Machine
+from airzone.localapi import Machine as LocalMachine
+from tests.simulator import SimulatedAPI, SimulatedGateway
+
+
+class MeetingGateway(SimulatedGateway):
+    """Holds its first write until every gateway of the building is writing."""
+
+    barrier = None
+
+    def write_single_register(self, machineid, address, value):
+        barrier, self.barrier = self.barrier, None
+        if barrier is not None:
+            barrier.wait(timeout=5)
+        super().write_single_register(machineid, address, value)
+
+
+def building(gateway_class=SimulatedGateway):
+    gateways = [gateway_class() for _ in range(3)]
+    machines = []
+    for gateway in gateways:
+        gateway.add_innobus_machine(1, [1, 2])
+        gateway.add_aido(5)
+        machines += [Machine(gateway, 1), Aido(gateway, 5)]
+    api = SimulatedAPI()
+    machines.append(LocalMachine(api))
+    for gateway in gateways:
+        gateway.writes.clear()
+    return gateways, api, machines
+
+
+def test_scene_across_backends():
+    gateways, api, machines = building()
+    results = Scene(setpoint=21, mode='cooling').apply(machines)
+    assert all(r.ok for r in results)
+    for gateway in gateways:
+        # innobus mode, two zone setpoints, Aido mode and setpoint
+        assert sorted(gateway.writes) == [(1, 0, 1), (1, 259, 210), (1, 515, 210),
+                                          (5, 1, 210), (5, 3, 2)]
+    assert all(z['setpoint'] == 21 and z['mode'] == 2 for z in api.systems[1])
+    modes = [r for r in results if r.operation == 'mode']
+    assert len(modes) == 7
+
+
+def test_selector_and_failures():
+    gateways, api, machines = building()
+    targets = select(machines, lambda t: target_id(t).startswith('Aido'))
+    assert len(targets) == 3
+    results = Scene(mode='dry').apply(machines, lambda t: not target_id(t).startswith('Aido'))
+    failed = [r for r in results if not r.ok]
+    assert len(failed) == 3 and isinstance(failed[0].error, ValueError)
+    assert api.systems[1][0]['mode'] == 5
+
+
+def test_gateways_run_in_parallel():
+    gateways, _, machines = building(MeetingGateway)
+    barrier = threading.Barrier(len(gateways))
+    for gateway in gateways:
+        gateway.barrier = barrier
+    results = Scene(setpoint=22).apply(machines)
+    # a gateway waiting for the others would break the barrier if they ran one after another
+    assert len(results) == 17
+    assert all(r.ok for r in results)
+    assert not barrier.broken
+    assert all(len(gateway.writes) == 3 for gateway in gateways)
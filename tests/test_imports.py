@@ -0,0 +1,46 @@
+"""Import time regression tests based on `python -X importtime`."""
+import os
+import subprocess
+import sys
+
+import pytest  # type: ignore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous budgets for the cumulative import time of every module, in seconds.
+BUDGETS = {
+    'airzone': 0.05,
+    'airzone.innobus': 0.2,
+    'airzone.aido': 0.2,
+    'airzone.localapi': 1.0,
+}
+
+
+def import_times(module):
+    """Cumulative import time in microseconds of every module imported by `module`."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', ['airzone.innobus', 'airzone.aido'])
+def test_modbus_backends_do_not_import_http_stack(module):
+    imported = import_times(module)
+    assert not [m for m in imported if m.split('.')[0] in ('requests', 'pymodbus', 'deprecated')]
+
+
+def test_localapi_does_not_import_pymodbus():
+    imported = import_times('airzone.localapi')
+    assert not [m for m in imported if m.split('.')[0] in ('pymodbus', 'deprecated')]
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time_budget(module):
+    assert import_times(module)[module] / 1e6 < BUDGETS[module]
@@ -5,7 +5,8 @@ import os
 import pytest  # type: ignore
 import requests_mock  # type: ignore
 
-from airzone.localapi import API, Machine, OperationMode, Speed
+from airzone.localapi import API, Machine, OperationMode, Speed, TempUnits, Webserver, ZoneRecord
+from tests.simulator import LocalApiSimulator, SimulatedAPI, localapi_payload
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 response_test_path = os.path.join(THIS_DIR, "data/response.json")
@@ -20,7 +21,7 @@ def mock_api():
         machine_ipaddr = "0.0.0.0"
         mock_addr = f"http://{machine_ipaddr}:3000/api/v1/hvac"
         mock_resp.post(mock_addr, json=data)
-        return API(machine_ipaddr)
+        yield API(machine_ipaddr)
 
 
 def test_create_machine(mock_api):
@@ -28,3 +29,90 @@ def test_create_machine(mock_api):
     machine = Machine(mock_api)
     assert machine.speed == Speed.AUTO
     assert machine.operation_mode == OperationMode.COOLING
+
+
+def test_zone_records(mock_api):
+    """Test the zones are parsed into records with the enums resolved."""
+    machine = Machine(mock_api)
+    zone = list(machine.zones)[0]
+    assert isinstance(zone.record, ZoneRecord)
+    assert zone.units == TempUnits.CELSIUS
+    assert zone.local_temperature == zone.record.room_temp
+    assert not hasattr(zone.record, '__dict__')
+
+
+def test_record_without_name():
+    """Old firmware doesn't send the name, nor the speed."""
+    record = ZoneRecord.from_json({"systemID": 1, "zoneID": 4, "mode": 3, "units": 1})
+    assert record.name is None
+    assert record.speed == Speed.AUTO
+    assert record.mode == OperationMode.HEATING
+    assert record == ZoneRecord.from_json({"systemID": 1, "zoneID": 4, "mode": 3, "units": 1})
+
+
+def test_record_with_unknown_units():
+    for units in (None, 7):
+        record = ZoneRecord.from_json({"systemID": 1, "zoneID": 4, "units": units})
+        assert record.units == TempUnits.CELSIUS
+
+
+def test_zones_built_from_the_system_request(mock_api):
+    """Zones take their state from the system wide request."""
+    machine = Machine(mock_api)
+    assert [z.record.zone_id for z in machine.zones] == [z for z in machine._zones]
+
+
+@pytest.mark.parametrize('all_systems, discovery, refresh', [(True, 1, 1), (False, 5, 2)])
+def test_webserver_systems(all_systems, discovery, refresh):
+    """One request for every system when the firmware allows it, one per system otherwise."""
+    api = SimulatedAPI({1: localapi_payload(1, 3), 3: localapi_payload(3, 2)},
+                       all_systems=all_systems)
+    server = LocalApiSimulator(api).start()
+    try:
+        webserver = Webserver(API(*server.address), max_systems=4)
+        assert webserver.systems == [1, 3]
+        assert api.requests == discovery
+        assert len(webserver.machine(3).zones) == 2
+        api.systems[3][1]['roomTemp'] = 25.0
+        before = api.requests
+        assert webserver.refresh() == [1, 3]
+        assert api.requests - before == refresh
+        assert list(webserver.machine(3).zones)[1].local_temperature == 25.0
+    finally:
+        server.stop()
+
+
+class FlakyAPI(SimulatedAPI):
+    """Fails to answer the first requests listing every system."""
+
+    def __init__(self, *args, failures=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = failures
+
+    def retrieve_all_systems(self):
+        if self.failures:
+            self.failures -= 1
+            self.requests += 1
+            return None
+        return super().retrieve_all_systems()
+
+
+def test_webserver_retries_listing_after_connection_errors():
+    api = FlakyAPI({1: localapi_payload(1, 2)})
+    webserver = Webserver(api, max_systems=4)
+    assert webserver.systems == [] and api.requests == 1
+    assert webserver.discover() == [1]
+    assert api.requests == 2
+    webserver.refresh()
+    assert api.requests == 3
+
+
+def test_all_systems_answers():
+    assert API('127.0.0.1', 1).retrieve_all_systems() is None
+    server = LocalApiSimulator(SimulatedAPI({1: localapi_payload(1, 2)}, all_systems=False)).start()
+    try:
+        assert API(*server.address).retrieve_all_systems() == {}
+        server.api.all_systems = True
+        assert list(API(*server.address).retrieve_all_systems()) == [1]
+    finally:
+        server.stop()
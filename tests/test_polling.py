@@ -0,0 +1,65 @@
+"""Adaptive poller tests."""
+import pytest  # type: ignore
+
+from airzone.innobus import Machine
+from airzone.polling import AdaptivePoller, TransactionBudget
+from tests.simulator import SimulatedGateway
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def machine():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2])
+    return Machine(gateway, 1)
+
+
+def test_idle_zones_back_off_and_active_zones_stay_fast(machine):
+    clock = Clock()
+    poller = AdaptivePoller(min_interval=5, max_interval=40, clock=clock,
+                            transactions_per_second=100)
+    poller.add_machine(machine)
+    z1, z2 = list(machine.zones)
+    # zone 2 requests air (register 9, bit 7)
+    machine._gateway.registers[1][2 * 256 + 9] = 1 << 7
+    for _ in range(20):
+        poller.poll_once()
+        clock.now = poller.next_due()
+    assert poller.interval_of(z1) == 40
+    assert poller.interval_of(z2) == 5
+
+
+def test_write_bursts_the_zone(machine):
+    clock = Clock()
+    poller = AdaptivePoller(min_interval=5, max_interval=40, burst_interval=1,
+                            burst_duration=3, clock=clock, transactions_per_second=100)
+    poller.add_machine(machine)
+    z1 = list(machine.zones)[0]
+    clock.now = 100.0
+    poller.poll_once()
+    poller.notify_write(z1)
+    assert poller.poll_once() == [z1]
+    assert poller.interval_of(z1) == 1
+
+
+def test_gateway_budget_is_shared(machine):
+    clock = Clock()
+    poller = AdaptivePoller(clock=clock, transactions_per_second=1)
+    poller.add_machine(machine)
+    assert len(poller.poll_once()) == 1
+    clock.now = 1.0
+    assert len(poller.poll_once()) == 1
+
+
+def test_budget_delay():
+    budget = TransactionBudget(2, burst=1)
+    assert budget.try_acquire(0)
+    assert not budget.try_acquire(0)
+    assert budget.delay(0) == 0.5
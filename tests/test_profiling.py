@@ -0,0 +1,150 @@
+"""Poll cycle profiling tests."""
+import threading
+import time
+
+import pytest
+
+from airzone import protocol
+from airzone.commands import CommandQueue
+from airzone.innobus import Machine
+from airzone.localapi import API, Machine as LocalMachine
+from airzone.profiling import CycleProfiler
+from tests.simulator import LocalApiSimulator, SimulatedGateway
+
+
+class Response():
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+
+class SlowClient():
+    """Modbus client answering from a SimulatedGateway after `latency` seconds."""
+
+    def __init__(self, gateway, latency):
+        self.gateway = gateway
+        self.latency = latency
+
+    def connect(self):
+        return True
+
+    def read_input_registers(self, address, count, device_id):
+        time.sleep(self.latency)
+        return Response(self.gateway.read_input_registers(device_id, address, count))
+
+    def write_register(self, address, value, device_id):
+        self.gateway.write_single_register(device_id, address, value)
+        return Response([value])
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setattr(protocol.time, 'sleep', lambda seconds: None)
+    registers = SimulatedGateway()
+    registers.add_innobus_machine(1, [1, 2])
+    client = SlowClient(registers, 0.0)
+    gateway = protocol.Gateway(client)
+    monkeypatch.undo()
+    client.latency = 0.01
+    return gateway
+
+
+class SignallingLock():
+    """Gateway lock setting `waiting` when a thread blocks on it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = threading.Event()
+
+    def __enter__(self):
+        if self._lock.locked():
+            self.waiting.set()
+        self._lock.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def test_cycle_breakdown(gateway):
+    machine = Machine(gateway, 1)
+    profiler = CycleProfiler(sample_every=2)
+    profiler.attach(gateway)
+    lock = gateway._lock = SignallingLock()
+    held = threading.Event()
+
+    def hold():
+        held.set()
+        # keep the lock a while once the sampled cycle is blocked on it
+        lock.waiting.wait(5)
+        time.sleep(0.03)
+
+    holder = threading.Thread(target=gateway._call, args=('hold', hold))
+    for i in range(4):
+        if i == 0:
+            holder.start()
+            held.wait(5)
+        with profiler.cycle('m1'):
+            machine._retrieve_machine_state()
+            time.sleep(0.02)
+    holder.join()
+
+    row = profiler.summary()['m1']
+    assert row['cycles'] == 2
+    # the machine registers and one read per zone
+    assert row['transactions'] == 3
+    assert row['io_ms'] >= 30
+    assert row['decode_ms'] >= 20
+    # 30ms of lock wait over the 2 sampled cycles
+    assert row['lock_wait_ms'] >= 15
+    assert 'm1' in profiler.summary_table()
+    folded = dict(line.rsplit(' ', 1) for line in profiler.folded().splitlines())
+    assert set(folded) == {'m1;lock_wait', 'm1;io;read_input_registers', 'm1;decode'}
+    assert int(folded['m1;io;read_input_registers']) >= 60000
+
+
+def test_machines_polled_in_turn_are_all_sampled():
+    profiler = CycleProfiler(sample_every=2)
+    for _ in range(4):
+        for key in ('m1', 'm2'):
+            with profiler.cycle(key):
+                pass
+    assert {key: row['cycles'] for key, row in profiler.summary().items()} == {'m1': 2, 'm2': 2}
+
+
+def test_reads_through_the_command_queue(gateway):
+    queue = CommandQueue(gateway)
+    try:
+        machine = Machine(queue, 1)
+        profiler = CycleProfiler()
+        profiler.attach(gateway)
+        with profiler.cycle('m1'):
+            machine._retrieve_machine_state()
+        queue.submit_read(1, 0, 21).result()
+    finally:
+        queue.close()
+    row = profiler.summary()['m1']
+    # recorded by the worker thread in the cycle of the caller
+    assert row['transactions'] == 3
+    assert row['io_ms'] >= 30
+    assert row['decode_ms'] < row['io_ms']
+
+
+def test_unsampled_cycles_and_http():
+    server = LocalApiSimulator().start()
+    try:
+        api = API(*server.address)
+        machine = LocalMachine(api)
+        profiler = CycleProfiler()
+        profiler.attach(api)
+        machine.retrieve_machine_state()
+        assert profiler.summary() == {}
+        profiler.profile('local', machine.retrieve_machine_state)
+        row = profiler.summary()['local']
+        assert row['transactions'] == 1 and row['io_ms'] > 0
+        profiler.detach(api)
+        assert api.profiler is None
+    finally:
+        server.stop()
@@ -0,0 +1,92 @@
+"""Modbus RTU transport tests, against simulated slaves on a pseudo-terminal."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from airzone.innobus import Machine
+from airzone.profiling import CycleProfiler
+from airzone.rtu import RtuBus, RtuTiming, crc16, frame
+from tests.simulator import RtuSimulator, SimulatedGateway
+
+pytest.importorskip('termios')
+
+
+@pytest.fixture
+def line():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2])
+    for machine_id in range(2, 6):
+        gateway.add_aido(machine_id)
+    simulator = RtuSimulator(gateway, baudrate=38400).start()
+    bus = RtuBus(simulator.port, baudrate=38400, turnaround=0.02)
+    yield gateway, bus
+    bus.close()
+    simulator.stop()
+
+
+def test_timing_from_line_settings():
+    timing = RtuTiming(9600)
+    assert timing.char_time == pytest.approx(10 / 9600)
+    assert timing.inter_frame == pytest.approx(3.5 * 10 / 9600)
+    assert RtuTiming(9600, parity='E').bits_per_char == 11
+    assert RtuTiming(115200).inter_frame == 0.00175
+    # read of 13 registers: 8 byte request, 31 byte response
+    assert timing.turnaround == pytest.approx(20 * 10 / 9600)
+    assert RtuTiming(115200).turnaround == 0.01
+    assert RtuTiming(9600, turnaround=0.05).timeout(8, 31) == \
+        pytest.approx(39 * 10 / 9600 + 0.05 + 7 * 10 / 9600)
+
+
+def test_frame_crc():
+    # read 1 holding register at 0 from unit 1, the classic spec example
+    assert frame(1, bytes([3, 0, 0, 0, 1])).hex() == '010300000001840a'
+    assert crc16(bytes.fromhex('010300000001840a')) == 0
+
+
+def test_machine_over_rtu(line):
+    gateway, bus = line
+    machine = Machine(bus, 1)
+    assert [z.local_temperature for z in machine.zones] == [21.5, 21.5]
+    next(iter(machine.zones)).signal_temperature_value = 21
+    assert gateway.registers[1][256 + 3] == 210
+    assert bus.read_input_registers(9, 0, 1) is None
+    stats = bus.stats()
+    assert stats['timeouts'] == 2 and stats['errors'] == 0
+    assert stats['frames_per_second'] > 0
+
+
+def test_concurrent_devices_share_the_line(line):
+    gateway, bus = line
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        reads = [executor.submit(bus.read_input_registers, machine_id, 0, 7)
+                 for machine_id in range(2, 6) for _ in range(3)]
+        writes = [executor.submit(bus.write_single_register, machine_id, 1, 240)
+                  for machine_id in range(2, 6)]
+        assert all(r.result(10)[0] == 1 for r in reads)
+        for w in writes:
+            w.result(10)
+    assert all(gateway.registers[m][1] == 240 for m in range(2, 6))
+    assert bus.stats()['frames'] == 2 * 16
+
+
+def test_short_writes_send_the_whole_frame(line, monkeypatch):
+    from airzone import rtu
+    gateway, bus = line
+    write = rtu.os.write
+    # the simulator shares the os module: only shorten the writes of the bus
+    monkeypatch.setattr(rtu.os, 'write',
+                        lambda fd, data: write(fd, bytes(data[:3]) if fd == bus._fd else data))
+    assert bus.read_input_registers(2, 0, 7)[0] == 1
+    bus.write_single_register(2, 1, 230)
+    assert gateway.registers[2][1] == 230
+
+
+def test_profiled_transactions(line):
+    _, bus = line
+    profiler = CycleProfiler()
+    profiler.attach(bus)
+    machine = Machine(bus, 1)
+    assert profiler.summary() == {}
+    profiler.profile('m1', machine._retrieve_machine_state)
+    row = profiler.summary()['m1']
+    assert row['transactions'] == 3 and row['io_ms'] > 0
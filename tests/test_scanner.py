@@ -0,0 +1,70 @@
+"""Device id scanner tests."""
+from airzone.scanner import Scanner, classify
+
+
+class Response():
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+
+class FakeClient():
+    """Answers for an innobus on id 1 and an Aido on id 5."""
+
+    devices = {
+        1: [0] * 9 + [3, 0] + [0] * 10,
+        5: [1, 220, 215, 2, 2, 8, 0],
+    }
+    # zone registers of the innobus devices
+    zones = {1: {256: 0}}
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def read_input_registers(self, address, count, device_id):
+        registers = self.devices.get(device_id)
+        if registers is None:
+            raise TimeoutError()
+        zones = self.zones.get(device_id, {})
+        if address in zones:
+            return Response([zones[address]])
+        if address + count > len(registers):
+            raise ValueError('illegal address')
+        return Response(registers[address:address + count])
+
+
+def test_scan_classifies_responders():
+    scanner = Scanner('gateway', 502, concurrency=4, client_factory=FakeClient)
+    specs = scanner.scan(range(1, 11))
+    assert [(s.machineId, s.system) for s in specs] == [(1, 'innobus'), (5, 'aido')]
+    assert specs[0].address == 'gateway'
+
+
+def test_classify_unknown_layout():
+    assert classify(None, [7, 0, 0, 0, 0, 0, 0]) is None
+
+
+class WideAidoClient(FakeClient):
+    """Aido units with fault registers after the state, answering the 21 register read."""
+
+    devices = {
+        1: [0] * 9 + [3, 0] + [0] * 10,
+        # an innobus whose state also fits the Aido layout
+        2: [1, 0, 0, 2, 0, 0, 0, 0, 0, 1, 0] + [0] * 10,
+        5: [1, 220, 215, 2, 2, 8, 0] + [0] * 14,
+        # error code 1 in register 9 looks like a zone mask
+        6: [1, 220, 215, 2, 2, 8, 0, 0, 0, 1, 0] + [0] * 10,
+    }
+    zones = {1: {256: 0}, 2: {256: 0}}
+
+
+def test_aido_answering_the_innobus_read():
+    scanner = Scanner('gateway', 502, concurrency=4, client_factory=WideAidoClient)
+    results = {r.machineId: r for r in scanner.probe_all(range(1, 11))}
+    assert {i: r.system for i, r in results.items()} == {1: 'innobus', 2: 'innobus', 5: 'aido', 6: 'aido'}
+    assert results[6].registers == [1, 220, 215, 2, 2, 8, 0]
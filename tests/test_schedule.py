@@ -0,0 +1,112 @@
+"""Schedule engine tests."""
+import datetime
+
+from airzone.innobus import Machine
+from airzone.localapi import Machine as LocalMachine
+from airzone.schedule import ScheduleEntry, Scheduler, desired_settings
+from tests.simulator import SimulatedAPI, SimulatedGateway
+
+MONDAY_8 = datetime.datetime(2024, 5, 13, 8, 0)
+
+
+class Clock():
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+ENTRIES = [
+    ScheduleEntry('07:00', {'setpoint': 21, 'zone_mode': 'AUTOMATIC', 'speed': 'SPEED_2'},
+                  days=range(5)),
+    ScheduleEntry('22:00', {'setpoint': 18}),
+    ScheduleEntry('09:00', {'on': 0}),
+]
+
+
+def test_desired_settings_look_back():
+    assert desired_settings(ENTRIES, None, MONDAY_8) == \
+        {'setpoint': 21, 'zone_mode': 'AUTOMATIC', 'speed': 'SPEED_2', 'on': 0}
+    saturday_8 = datetime.datetime(2024, 5, 18, 8, 0)
+    assert desired_settings(ENTRIES, None, saturday_8)['setpoint'] == 18
+
+
+def test_only_differences_are_written_spread_out():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2, 3, 4])
+    machine = Machine(gateway, 1)
+    gateway.writes.clear()
+    clock = Clock()
+    scheduler = Scheduler(ENTRIES, machine.zones, spread=40, writes_per_second=10,
+                          now=lambda: MONDAY_8, clock=clock)
+    assert scheduler.tick() == 4
+    assert scheduler.run_pending() == 2
+    # zone mode and speed share register 0: one write each
+    assert gateway.writes == [(1, 256, 0b100010), (1, 259, 210)]
+    clock.now = 40
+    assert scheduler.run_pending() == 6
+    assert scheduler.tick() == 0
+
+    machine._retrieve_machine_state()
+    assert scheduler.tick() == 0
+    gateway.registers[1][2 * 256 + 3] = 250
+    machine._retrieve_machine_state()
+    assert scheduler.tick() == 1
+    clock.now = 80
+    assert scheduler.run_pending() == 1
+    assert gateway.writes[-1] == (1, 2 * 256 + 3, 210)
+
+
+def test_gateway_budget_defers_writes():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2, 3])
+    machine = Machine(gateway, 1)
+    clock = Clock()
+    scheduler = Scheduler(ENTRIES, machine.zones, spread=0, writes_per_second=2,
+                          now=lambda: MONDAY_8, clock=clock)
+    scheduler.tick()
+    assert scheduler.run_pending() == 2
+    assert scheduler.next_due() > 0
+    clock.now = 10
+    assert scheduler.run_pending() == 2
+    clock.now = 20
+    assert scheduler.run_pending() == 2
+    assert scheduler.next_due() is None
+
+
+def test_localapi_zone_parameters_in_one_request():
+    api = SimulatedAPI()
+    machine = LocalMachine(api)
+    clock = Clock()
+    scheduler = Scheduler(ENTRIES, machine.zones, spread=0, writes_per_second=100,
+                          now=lambda: MONDAY_8, clock=clock)
+    requests = api.requests
+    assert scheduler.tick() == 8
+    clock.now = 10
+    scheduler.run_pending()
+    assert api.requests - requests == 8
+    assert all(z['setpoint'] == 21 and z['on'] == 0 for z in api.systems[1])
+
+
+def test_broken_entries_do_not_stop_the_others():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2])
+    machine = Machine(gateway, 1)
+    gateway.writes.clear()
+    rooms = {1: 'office'}
+    entries = [
+        ScheduleEntry('06:00', {'setpoint': 20}),
+        # zone 2 is missing from the lookup table
+        ScheduleEntry('07:00', {'setpoint': 23}, zones=lambda zone: rooms[zone._zone_id] == 'office'),
+        ScheduleEntry('07:30', {'zone_mode': 'UNKNOWN'}, zones=lambda zone: zone._zone_id == 2),
+    ]
+    scheduler = Scheduler(entries, machine.zones, spread=0, now=lambda: MONDAY_8, clock=Clock())
+    assert scheduler.tick() == 1
+    assert scheduler.run_pending() == 1
+    assert gateway.writes == [(1, 259, 230)]
+    scheduler.entries.pop()
+    assert scheduler.tick() == 1
+    assert scheduler.run_pending() == 1
+    assert gateway.writes[-1] == (1, 2 * 256 + 3, 200)
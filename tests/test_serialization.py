@@ -0,0 +1,61 @@
+"""Structured export tests."""
+import json
+
+import pytest  # type: ignore
+
+from airzone.aido import Aido
+from airzone.innobus import Machine
+from airzone.localapi import Machine as LocalMachine
+from tests.simulator import SimulatedAPI, SimulatedGateway
+
+
+def innobus_machine():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1, 2])
+    return gateway, Machine(gateway, 1)
+
+
+def test_innobus_export_is_cached_per_snapshot():
+    gateway, machine = innobus_machine()
+    data = machine.to_dict()
+    assert data['system'] == 'innobus'
+    assert [z['zone_id'] for z in data['zones']] == [1, 2]
+    assert data['zones'][0]['local_temperature'] == 21.5
+    assert data['zones'][0]['zone_mode'] == 'MANUAL'
+    encoded = machine.to_bytes()
+    assert machine.to_dict() is data
+    assert machine.to_bytes() is encoded
+    assert json.loads(encoded) == json.loads(json.dumps(data))
+
+    gateway.registers[1][2 * 256 + 10] = 230
+    machine._retrieve_machine_state()
+    assert machine.to_bytes() is not encoded
+    assert machine.to_dict()['zones'][1]['local_temperature'] == 23.0
+
+
+def test_aido_export():
+    gateway = SimulatedGateway()
+    gateway.add_aido(3)
+    data = Aido(gateway, 3).to_dict()
+    assert data['on'] is True
+    assert data['operation_mode'] == 'COOLING'
+    assert data['louvres'] == 'AUTO'
+
+
+def test_localapi_export():
+    machine = LocalMachine(SimulatedAPI())
+    data = json.loads(machine.to_bytes())
+    assert data['operation_mode'] == 'COOLING'
+    assert len(data['zones']) == 8
+    assert data['zones'][0]['name'] == 'Zone 1'
+
+
+def test_exportable_requires_the_hooks():
+    from airzone.serialization import Exportable
+
+    class Partial(Exportable):
+        def _export(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,71 @@
+"""Sharded poller tests."""
+import subprocess
+import sys
+import time
+
+from airzone.sharded import GatewaySpec, ShardedPoller, SnapshotRing
+from tests.simulator import SimulatedGateway
+
+
+def fake_gateway_factory(spec):
+    gateway = SimulatedGateway()
+    for machine_id in spec.machine_ids:
+        gateway.add_innobus_machine(machine_id, [1, 3])
+    return gateway
+
+
+def test_ring_detects_overwritten_records():
+    ring = SnapshotRing(slots=2, width=4)
+    try:
+        for value in range(3):
+            ring.publish(0, 1, 0, [value] * 4)
+        assert ring.head == 3
+        assert ring.read(0) is None
+        assert ring.read(2).registers == (2, 2, 2, 2)
+        with ring.view(1) as view:
+            assert list(view) == [1, 1, 1, 1]
+            assert ring.is_current(1)
+        with ring.view(0) as view:
+            assert view is None
+    finally:
+        # no view left holding the buffer
+        ring.close()
+
+
+def test_reader_attaches_by_name():
+    ring = SnapshotRing(slots=4, width=2)
+    reader = SnapshotRing(ring.name)
+    try:
+        ring.publish(3, 7, 256, [215, 220])
+        record = reader.latest()[(3, 7, 256)]
+        assert record.registers == (215, 220)
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_workers_publish_snapshots():
+    specs = [GatewaySpec('gw1', 502, [1]), GatewaySpec('gw2', 502, [2, 3])]
+    with ShardedPoller(specs, processes=2, interval=0.05,
+                       gateway_factory=fake_gateway_factory) as poller:
+        deadline = time.monotonic() + 10
+        while len(poller.snapshots()) < 9 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        snapshots = poller.snapshots()
+    assert snapshots[('gw2', 502, 3, 3 * 256)].registers[10] == 215
+    assert len(snapshots[('gw1', 502, 1, 0)].registers) == 21
+
+
+def test_attaching_process_leaves_block_alive():
+    ring = SnapshotRing(slots=4, width=2)
+    try:
+        ring.publish(0, 1, 0, [1, 2])
+        code = f'from airzone.sharded import SnapshotRing; SnapshotRing({ring.name!r}).close()'
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=30)
+        assert result.returncode == 0
+        assert 'leaked' not in result.stderr
+        reader = SnapshotRing(ring.name)
+        assert reader.latest()[(0, 1, 0)].registers == (1, 2)
+        reader.close()
+    finally:
+        ring.close()
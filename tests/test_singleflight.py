@@ -0,0 +1,79 @@
+"""Single-flight deduplication tests."""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event
+
+import pytest
+
+from airzone.innobus import Machine
+from airzone.singleflight import SingleFlight, flights_of
+from tests.simulator import SimulatedGateway
+
+
+class CountingFlight(SingleFlight):
+    """Notifies every caller joining a call in flight."""
+
+    def __init__(self):
+        self.joined = Condition()
+        super().__init__()
+
+    @property
+    def shared(self):
+        return self._shared
+
+    @shared.setter
+    def shared(self, value):
+        with self.joined:
+            self._shared = value
+            self.joined.notify_all()
+
+    def wait_shared(self, count, timeout=5):
+        with self.joined:
+            assert self.joined.wait_for(lambda: self._shared >= count, timeout)
+
+
+def test_waiters_share_the_leader_outcome():
+    flights = CountingFlight()
+    started, release = Event(), Event()
+
+    def slow(value):
+        started.set()
+        release.wait(5)
+        if value is None:
+            raise ValueError('no response')
+        return value
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        leader = executor.submit(flights.do, 'key', slow, 42)
+        started.wait(5)
+        followers = [executor.submit(flights.do, 'key', slow, 0) for _ in range(3)]
+        flights.wait_shared(3)
+        other = executor.submit(flights.do, 'other', lambda: 'other')
+        assert other.result(5) == 'other'
+        release.set()
+        assert [f.result(5) for f in [leader] + followers] == [42] * 4
+    assert flights.executions == 2 and not flights.in_flight('key')
+
+    started.clear()
+    release.clear()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flights.do, 'key', slow, None)
+        started.wait(5)
+        follower = executor.submit(flights.do, 'key', slow, 1)
+        flights.wait_shared(4)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result(5)
+
+
+def test_concurrent_refreshes_share_bus_transactions():
+    gateway = SimulatedGateway(latency=0.01)
+    gateway.add_innobus_machine(1, [1, 2])
+    machine = Machine(gateway, 1)
+    start = gateway.transactions
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for future in [executor.submit(machine._retrieve_machine_state) for _ in range(8)]:
+            future.result(5)
+    # 3 transactions a refresh: the machine registers and one read per zone
+    assert gateway.transactions - start < 3 * 8
+    assert flights_of(machine).shared > 0
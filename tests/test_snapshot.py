@@ -0,0 +1,56 @@
+"""Snapshot tests."""
+import json
+import pickle
+
+import pytest  # type: ignore
+
+from airzone.innobus import Machine
+from airzone.localapi import Machine as LocalMachine
+from airzone.snapshot import FrozenDict, publish
+from tests.simulator import SimulatedAPI, SimulatedGateway
+
+
+def test_state_is_frozen():
+    snapshot = publish({'mode': 2, 'errors': [], 'modes': [1, 2]})
+    with pytest.raises(TypeError):
+        snapshot.state['mode'] = 3
+    assert snapshot.state['modes'] == (1, 2)
+    assert json.loads(json.dumps(snapshot.state)) == {'mode': 2, 'errors': [], 'modes': [1, 2]}
+    assert pickle.loads(pickle.dumps(snapshot.state)) == snapshot.state
+    assert isinstance(pickle.loads(pickle.dumps(snapshot.state)), FrozenDict)
+
+
+def test_refresh_swaps_snapshots():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1])
+    machine = Machine(gateway, 1)
+    zone = next(iter(machine.zones))
+    before = zone.snapshot
+    gateway.registers[1][256 + 10] = 230
+    machine._retrieve_machine_state()
+    after = zone.snapshot
+    assert after.version > before.version
+    assert before.state[10] == 215 and after.state[10] == 230
+    assert isinstance(after.state, tuple)
+
+
+def test_localapi_setter_publishes_new_snapshot():
+    machine = LocalMachine(SimulatedAPI())
+    before = machine.snapshot
+    machine.speed = 3
+    assert before.state['speed'] == 0
+    assert machine.snapshot.version > before.version
+    assert machine.speed == 3
+
+
+def test_pinned_zone_reads_one_snapshot():
+    gateway = SimulatedGateway()
+    gateway.add_innobus_machine(1, [1])
+    machine = Machine(gateway, 1)
+    zone = next(iter(machine.zones))
+    pinned = zone.pinned()
+    gateway.registers[1][256 + 10] = 230
+    machine._retrieve_machine_state()
+    assert pinned.local_temperature == 21.5 and zone.local_temperature == 23.0
+    assert pinned.dif_current_temp == pytest.approx(0.5)
+    assert zone.dif_current_temp == pytest.approx(-1.0)
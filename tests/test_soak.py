@@ -0,0 +1,55 @@
+"""Smoke test of the load harness against the local stand-ins."""
+import json
+import logging
+import os
+import runpy
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_soak_reports_percentiles(tmp_path, capsys):
+    soak = runpy.run_path(os.path.join(ROOT, 'benchmarks', 'soak.py'))
+    output = tmp_path / 'soak.json'
+    filters = list(warnings.filters)
+    rc = soak['main'](['--innobus-machines', '2', '--zones', '2', '--localapi-systems', '2',
+                       '--duration', '0.5', '--workers', '2', '--modbus-latency', '0',
+                       '--http-latency', '0', '--write-ratio', '0.5', '--output', str(output)])
+    report = json.loads(output.read_text())
+    assert rc == 0
+    assert report['operations'] > 0
+    assert report['error_rate'] == {'refresh': 0.0, 'write': 0.0}
+    assert 'p99_ms' in report['latency']['refresh']
+    assert json.loads(capsys.readouterr().out) == report
+    # the run leaves the logging and warnings of the process as they were
+    assert logging.root.manager.disable == logging.NOTSET
+    assert warnings.filters == filters
+
+
+def test_reservoir_is_bounded():
+    soak = runpy.run_path(os.path.join(ROOT, 'benchmarks', 'soak.py'))
+    reservoir = soak['Reservoir'](size=100)
+    for value in range(10000):
+        reservoir.add(value / 1000)
+    stats = soak['percentiles'](reservoir)
+    assert len(reservoir.samples) == 100
+    assert stats['count'] == 10000
+    assert stats['max_ms'] == 9999
+    assert 4000 < stats['p50_ms'] < 6000
+
+
+def test_failed_operations_are_reported():
+    from airzone.localapi import Machine
+    from tests.simulator import SimulatedAPI, localapi_payload
+
+    soak = runpy.run_path(os.path.join(ROOT, 'benchmarks', 'soak.py'))
+    api = SimulatedAPI({1: localapi_payload(1, 2)})
+    machine = Machine(api, 1)
+    assert soak['refresh']('localapi', machine)
+    api.systems = {}
+    assert not soak['refresh']('localapi', machine)
+
+    def rejected(*args):
+        return None
+    api.set_zone_parameter_value = rejected
+    assert not soak['write']('localapi', machine, soak['random'].Random(0))
@@ -0,0 +1,86 @@
+"""Transaction trace tests."""
+import pytest
+from pymodbus.pdu import ExceptionResponse
+
+from airzone import protocol
+from airzone.commands import CommandQueue
+from airzone.trace import TransactionTrace
+
+
+class Response():
+
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+
+class FakeClient():
+
+    def connect(self):
+        return True
+
+    def read_input_registers(self, address, count, device_id):
+        if device_id == 2:
+            return ExceptionResponse(4, 0x0B)
+        return Response([address] * count)
+
+    def read_holding_registers(self, address, count, device_id):
+        raise ConnectionError('no route')
+
+    def write_register(self, address, value, device_id):
+        if device_id == 2:
+            return ExceptionResponse(6, 0x03)
+        return Response([value])
+
+    def __str__(self):
+        return 'FakeClient'
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setattr(protocol.time, 'sleep', lambda seconds: None)
+    return protocol.Gateway(FakeClient(), trace=TransactionTrace(maxlen=3))
+
+
+def test_records_outcomes(gateway):
+    assert gateway.read_input_registers(1, 256, 2) == [256, 256]
+    assert gateway.read_input_registers(2, 0, 1) is None
+    assert gateway.read_holding_registers(1, 0, 1) is None
+    assert gateway.exception_code(2) == 11 and gateway.exception_code(1) is None
+    outcomes = [(t.device, t.function, t.outcome) for t in gateway.trace.snapshot()]
+    assert outcomes == [(1, 'read_input_registers', 'ok'),
+                        (2, 'read_input_registers', 'exception_code=11'),
+                        (1, 'read_holding_registers', 'ConnectionError')]
+    assert 'device=2 read_input_registers address=0 count=1' in gateway.trace.format()
+
+
+def test_rejected_write_raises(gateway):
+    with pytest.raises(protocol.ModbusError) as e:
+        gateway.write_single_register(2, 3, 500)
+    assert e.value.exception_code == 3
+    assert gateway.trace.snapshot()[-1].outcome == 'exception_code=3'
+    queue = CommandQueue(gateway)
+    try:
+        with pytest.raises(protocol.ModbusError):
+            queue.write_single_register(2, 3, 500).result(5)
+        assert queue.write_single_register(1, 3, 210).result(5) == 210
+    finally:
+        queue.close()
+
+
+def test_ring_buffer_keeps_latest(gateway):
+    for address in range(5):
+        gateway.write_single_register(1, address, 1)
+    assert len(gateway.trace) == 3
+    assert [t['address'] for t in gateway.trace.dump()] == [2, 3, 4]
+    gateway.trace.clear()
+    assert len(gateway.trace) == 0
+
+
+def test_no_trace_by_default(monkeypatch):
+    monkeypatch.setattr(protocol.time, 'sleep', lambda seconds: None)
+    gateway = protocol.Gateway(FakeClient())
+    assert gateway.read_input_registers(1, 0, 1) == [0]
+    assert gateway.trace is None
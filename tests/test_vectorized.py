@@ -0,0 +1,83 @@
+"""Vectorized decoding tests."""
+import random
+
+import pytest  # type: ignore
+
+np = pytest.importorskip("numpy")
+
+from airzone.innobus import Zone  # noqa: E402
+from airzone.snapshot import publish  # noqa: E402
+from airzone.vectorized import ZONE_FIELDS, decode_enum, decode_zone_matrix  # noqa: E402
+
+GETTERS = {
+    'sleep_on': Zone.is_sleep_on,
+    'automatic_mode': Zone.is_automatic_mode,
+    'zone_mode': Zone.get_zone_mode,
+    'tacto_on': Zone.is_tacto_on,
+    'zone_hold': Zone.is_zone_hold,
+    'speed_selection': Zone.get_speed_selection,
+    'min_temp': lambda z: z.min_temp,
+    'max_temp': lambda z: z.max_temp,
+    'signal_temperature_value': lambda z: z.signal_temperature_value,
+    'master_zone': Zone.is_master_zone,
+    'grid_mode': Zone.get_grid_mode,
+    'AA_enabled': Zone.is_AA_enabled,
+    'Floor_enabled': Zone.is_Floor_enabled,
+    'grid_angle_hot': Zone.get_grid_angle_hot,
+    'grid_angle_cold': Zone.get_grid_angle_cold,
+    'minimun_air_enabled': Zone.get_is_minimun_air_enabled,
+    'probe_type': Zone.get_probe_type,
+    'presence': Zone.get_presence,
+    'window': Zone.get_window,
+    'grid_opened_time': Zone.get_grid_opened_time,
+    'tacto_address': Zone.get_tacto_address,
+    'master_tacto_address': Zone.get_master_tacto_address,
+    'remote_probe_temperature': Zone.get_remote_probe_temperature,
+    'zone_grid_opened': Zone.is_zone_grid_opened,
+    'grid_motor_active': Zone.is_grid_motor_active,
+    'grid_motor_requested': Zone.is_grid_motor_requested,
+    'floor_active': Zone.is_floor_active,
+    'local_module_fancoil': Zone.get_local_module_fancoil,
+    'requesting_air': Zone.is_requesting_air,
+    'occupied': Zone.is_occupied,
+    'window_opened': Zone.is_window_opened,
+    'fancoil_speed': Zone.get_fancoil_speed,
+    'proportional_aperture': Zone.get_proportional_aperture,
+    'tacto_connected_cz': Zone.is_tacto_connected_cz,
+    'local_temperature': lambda z: z.local_temperature,
+    'dif_current_temp': lambda z: z.dif_current_temp,
+}
+
+
+def random_state(rng):
+    state = [rng.randrange(0, 1 << 16) for _ in range(13)]
+    # probe type, presence and window only accept codes 0 to 2
+    reg4 = state[4] & 0x03FF
+    for shift in (10, 12, 14):
+        reg4 |= rng.randrange(0, 3) << shift
+    state[4] = reg4
+    return state
+
+
+def make_zone(state):
+    zone = Zone.__new__(Zone)
+    zone._snapshot = publish(state)
+    return zone
+
+
+def test_matches_scalar_getters():
+    rng = random.Random(1)
+    states = [random_state(rng) for _ in range(300)]
+    decoded = decode_zone_matrix(states)
+    assert set(decoded) == set(GETTERS)
+    for name, getter in GETTERS.items():
+        column = decoded[name]
+        if name in ZONE_FIELDS and ZONE_FIELDS[name][4] is not None:
+            column = decode_enum(column, name)
+        expected = [getter(make_zone(s)) for s in states]
+        assert column.tolist() == expected, name
+
+
+def test_rejects_wrong_shape():
+    with pytest.raises(ValueError):
+        decode_zone_matrix([[0] * 12])